@@ -45,7 +45,6 @@
 #define NAIVE_CONV_THREADED
 #include "naive_conv.h"
 #define conv_fwd_nchw naive_conv_fwd_nchw
-#define conv_bwd_d_nchw naive_conv_bwd_d_nchw
 #define conv_bwd_f_nchw naive_conv_bwd_f_nchw
 #endif
 
@@ -136,6 +135,7 @@ measured_fp32_conv_gflops(double time_ms, size_t n, size_t c, size_t hi,
 
 #include "igemm_gtc_base.h"
 #include "igemm_bwd_gtc_driver.h"
+#include "tuning_db.h"
 
 #ifndef ABS
 #define ABS(x) ((x) > 0 ? (x) : -1 * (x))
@@ -161,6 +161,21 @@ static inline int env_get_int(const char *var_name, int default_int) {
     return r;
 }
 
+#ifndef USE_XDNN
+// IGEMM_NAIVE_BWD_REF=1 falls back to the direct loop, which is much slower than the dtile gemm one
+static inline void conv_bwd_d_nchw(float *src_grad, const float *filter,
+                                   const float *dst_grad, size_t n,
+                                   size_t w, size_t h, size_t c, size_t k,
+                                   size_t fx, size_t fy, size_t px,
+                                   size_t py, size_t sx, size_t sy,
+                                   size_t dx, size_t dy) {
+    if (env_get_int("IGEMM_NAIVE_BWD_REF", 0))
+        naive_conv_bwd_d_nchw(src_grad, filter, dst_grad, n, w, h, c, k, fx, fy, px, py, sx, sy, dx, dy);
+    else
+        naive_conv_bwd_d_nchw_gemm(src_grad, filter, dst_grad, n, w, h, c, k, fx, fy, px, py, sx, sy, dx, dy);
+}
+#endif
+
 static inline char *env_get_str(const char *var_name, char *default_str) {
     char *v = getenv(var_name);
     if (v)
@@ -299,13 +314,14 @@ void dump_arg(const args_t *arg) {
     int pad_w = arg->get_int("pad_w");
     int y = arg->get_int("fil_h");
     int x = arg->get_int("fil_w");
+    int g = arg->get_int("group_count");
     int ho = conv_out_size(hi, pad_h, dilation_h, y, stride_h);
     int wo = conv_out_size(wi, pad_w, dilation_w, x, stride_w);
 
     printf("n:%d, c:%d, h:%d, w:%d, k:%d, y:%d, x:%d, sy:%d, sx:%d, dy:%d, "
-           "dx:%d, py:%d, px:%d, ho:%d, wo:%d\n",
+           "dx:%d, py:%d, px:%d, ho:%d, wo:%d, g:%d\n",
            n, c, hi, wi, k, y, x, stride_h, stride_w, dilation_h, dilation_w,
-           pad_h, pad_w, ho, wo);
+           pad_h, pad_w, ho, wo, g);
 }
 
 int main(int argc, char **argv) {
@@ -315,6 +331,7 @@ int main(int argc, char **argv) {
     int warmup = env_get_int("IGEMM_WARMUP", WARMUP);
     int repeat = env_get_int("IGEMM_REPEAT", REPEAT);
     int sclk_mhz = env_get_int("IGEMM_SCLK_MHZ", SCLK_MHZ);
+    char *tuning_db_file = env_get_str("IGEMM_TUNING_DB", NULL);
     config_parser_t config_parser(config_file);
     auto content = config_parser.parse();
     //content.dump();
@@ -373,13 +390,20 @@ int main(int argc, char **argv) {
 
     int num_cu;
     int num_simd = 64; // hard coded
+    int gcn_arch;
     {
         hipDeviceProp_t dev_prop;
         hipDevice_t dev;
         HIP_CALL(hipGetDevice(&dev));
         HIP_CALL(hipGetDeviceProperties(&dev_prop, dev));
         num_cu = dev_prop.multiProcessorCount;
+        gcn_arch = dev_prop.gcnArch;
     }
+
+    // shape already tuned only runs the best kernel in db
+    tuning_db_t tuning_db;
+    if (tuning_db_file && !tuning_db.load(tuning_db_file))
+        printf("fail to load tuning db %s, run every kernel\n", tuning_db_file);
     double fp32_gflops =
         theoritical_fp32_gflops(((double)sclk_mhz) / 1000.0, num_cu, num_simd);
 
@@ -428,8 +452,35 @@ int main(int argc, char **argv) {
 
         igemm_bwd_gtc_t conv_bwd_driver;
         double nrms = get_bwd_nrms();
+        printf("[bwd] ");
+        dump_arg(&conv_args);
+
+        // host buffers above are float, so only fp32 kernels of the db apply here
+        std::string db_kernel_name;
+        std::vector<tuning_db_result_t> db_results;
+        bool db_exact;
+        tuning_db_key_t db_key = tuning_db_key_from_args(&conv_args, gcn_arch,
+                                    tuning_db_direction_from_string("bwd"), tuning_db_precision_from_string("fp32"));
+        if (tuning_db.find(db_key, db_results, db_exact)) {
+            for (auto &r : db_results) {
+                for (auto &t : tunables)
+                    if (conv_bwd_driver.get_kernel_name(&t) == r.kernel_name)
+                        db_kernel_name = r.kernel_name;
+                if (!db_kernel_name.empty()) {
+                    printf("tuning db: %s match %s (%.3fms in db)\n", db_exact ? "exact" : "nearest",
+                           db_kernel_name.c_str(), r.duration_ms);
+                    break;
+                }
+            }
+            // unseen shape is still tuned with every kernel, nearest one is only a hint
+            if (!db_exact)
+                db_kernel_name.clear();
+        }
+
         for (int i = 0; i < tunables.size(); i++) {
             igemm_gtc_tunable_t *tunable = &tunables[i];
+            if (!db_kernel_name.empty() && conv_bwd_driver.get_kernel_name(tunable) != db_kernel_name)
+                continue;
 
             printf("  %s, ", conv_bwd_driver.get_kernel_name(tunable).c_str());
 
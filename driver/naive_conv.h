@@ -28,10 +28,15 @@
 
 #define NAIVE_CONV_THREADED
 
-#ifdef NAIVE_CONV_THREADED
+#include <algorithm>
+#include <atomic>
+#include <cstddef>
+#include <functional>
 #include <thread>
 #include <vector>
-#include <functional>
+#include "utility.h"
+
+#ifdef NAIVE_CONV_THREADED
 using naive_conv_threadwise_conv_t = std::function<void(size_t,size_t,size_t,size_t)>;
 
 class naive_conv_blockwise_4d_t{
@@ -430,4 +435,105 @@ static inline void naive_conv_bwd_f_cnhw(const float *src, float *filter_grad,
     }
 }
 
-#endif
\ No newline at end of file
+// run f(0..total-1) on every hardware thread, each thread keeps taking the next index, so uneven work balances
+static inline void naive_conv_parallel_for(size_t total, std::function<void(size_t)> f)
+{
+    size_t num_threads = std::max(1u, std::thread::hardware_concurrency());
+    num_threads = std::min(num_threads, total);
+    std::atomic<size_t> next(0);
+    auto worker = [&](){
+        for (size_t i = next++; i < total; i = next++)
+            f(i);
+    };
+    std::vector<std::thread> threads;
+    for (size_t tid = 1; tid < num_threads; tid++)
+        threads.push_back(std::thread(worker));
+    worker();
+    for (auto &th : threads)
+        th.join();
+}
+
+/*
+ * bwd data as transposed gemm of every (y_tilda, x_tilda) dtile, the same tiling as igemm_bwd_gtc_driver.h.
+ * input rows/cols of one dtile only get taps ir = iy_tilda + j * y_tilda (j < y_dot_slice) and likewise for x,
+ * so divisibility is decided once per dtile and bounds once per (row, tap), never per element.
+ * filter is transposed to [y][x][k][c] so a block of c is contiguous, and the inner loop is a stride-sx axpy of
+ * one dst_grad row into one src_grad row, kept in cache over the c block. work is split by (n, c block),
+ * every src_grad element is written by one thread only.
+ */
+#define NAIVE_CONV_BWD_D_C_BLOCK 16
+static inline void naive_conv_bwd_d_nchw_gemm(float *src_grad, const float *filter,
+                                         const float *dst_grad, size_t n,
+                                         size_t w, size_t h, size_t c, size_t k,
+                                         size_t fx, size_t fy, size_t px,
+                                         size_t py, size_t sx, size_t sy,
+                                         size_t dx, size_t dy) {
+    std::ptrdiff_t oh = naive_conv_out_size(h, py, dy, fy, sy);
+    std::ptrdiff_t ow = naive_conv_out_size(w, px, dx, fx, sx);
+    size_t y_tilda = sy / utility_gcd(sy, dy);
+    size_t x_tilda = sx / utility_gcd(sx, dx);
+
+    std::vector<float> filter_t(fy * fx * k * c);
+    for (size_t ik = 0; ik < k; ik++)
+        for (size_t ic = 0; ic < c; ic++)
+            for (size_t ir = 0; ir < fy; ir++)
+                for (size_t is = 0; is < fx; is++)
+                    filter_t[((ir * fx + is) * k + ik) * c + ic] = filter[((ik * c + ic) * fy + ir) * fx + is];
+
+    size_t c_blocks = (c + NAIVE_CONV_BWD_D_C_BLOCK - 1) / NAIVE_CONV_BWD_D_C_BLOCK;
+    auto one_block = [&](size_t idx){
+        size_t in = idx / c_blocks;
+        size_t c_start = (idx % c_blocks) * NAIVE_CONV_BWD_D_C_BLOCK;
+        size_t c_len = std::min((size_t)NAIVE_CONV_BWD_D_C_BLOCK, c - c_start);
+        float *p_src = src_grad + (in * c + c_start) * h * w;
+        const float *p_dst = dst_grad + in * k * oh * ow;
+        // position not reached by any dtile (gcd of stride and dilation > 1) stays 0
+        std::fill(p_src, p_src + c_len * h * w, .0f);
+
+        for (size_t iy_tilda = 0; iy_tilda < y_tilda; iy_tilda++) {
+            size_t y_dot_slice = iy_tilda < fy ? (fy - iy_tilda + y_tilda - 1) / y_tilda : 0;    // taps of this dtile
+            for (size_t ix_tilda = 0; ix_tilda < x_tilda; ix_tilda++) {
+                size_t x_dot_slice = ix_tilda < fx ? (fx - ix_tilda + x_tilda - 1) / x_tilda : 0;
+                for (size_t ih = 0; ih < h; ih++) {
+                    std::ptrdiff_t oh_num = (std::ptrdiff_t)ih + py - (std::ptrdiff_t)(dy * iy_tilda);
+                    if (((oh_num % (std::ptrdiff_t)sy) + sy) % sy != 0)
+                        continue;   // row of another dtile
+                    for (size_t jy = 0; jy < y_dot_slice; jy++) {
+                        size_t ir = iy_tilda + jy * y_tilda;
+                        std::ptrdiff_t cur_oh = (oh_num - (std::ptrdiff_t)(dy * jy * y_tilda)) / (std::ptrdiff_t)sy;
+                        if (oh_num - (std::ptrdiff_t)(dy * jy * y_tilda) < 0 || cur_oh >= oh)
+                            continue;
+                        for (size_t jx = 0; jx < x_dot_slice; jx++) {
+                            size_t is = ix_tilda + jx * x_tilda;
+                            // iw = ow * sx - px + dx * is, valid ow range of this tap
+                            std::ptrdiff_t iw_base = (std::ptrdiff_t)(dx * is) - (std::ptrdiff_t)px;
+                            std::ptrdiff_t ow_start = iw_base >= 0 ? 0 : (-iw_base + sx - 1) / sx;
+                            std::ptrdiff_t ow_end = std::min(ow, ((std::ptrdiff_t)w - 1 - iw_base) / (std::ptrdiff_t)sx + 1);
+                            if ((std::ptrdiff_t)w - 1 - iw_base < 0 || ow_start >= ow_end)
+                                continue;
+                            const float *p_filter = filter_t.data() + (ir * fx + is) * k * c + c_start;
+                            for (size_t ik = 0; ik < k; ik++) {
+                                const float *dst_row = p_dst + (ik * oh + cur_oh) * ow;
+                                for (size_t ic = 0; ic < c_len; ic++) {
+                                    float v = p_filter[ik * c + ic];
+                                    // iw_base may be negative, only iw_base + iow * sx is inside the row
+                                    float *src_row = p_src + (ic * h + ih) * w;
+                                    if (sx == 1) {
+                                        for (std::ptrdiff_t iow = ow_start; iow < ow_end; iow++)
+                                            src_row[iw_base + iow] += v * dst_row[iow];
+                                    } else {
+                                        for (std::ptrdiff_t iow = ow_start; iow < ow_end; iow++)
+                                            src_row[iw_base + iow * (std::ptrdiff_t)sx] += v * dst_row[iow];
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    };
+    naive_conv_parallel_for(n * c_blocks, one_block);
+}
+
+#endif
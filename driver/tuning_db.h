@@ -0,0 +1,223 @@
+/*******************************************************************************
+ *
+ * MIT License
+ *
+ * Copyright (c) 2020 Advanced Micro Devices, Inc.
+ *
+ * Permission is hereby granted, free of charge, to any person obtaining a copy
+ * of this software and associated documentation files (the "Software"), to deal
+ * in the Software without restriction, including without limitation the rights
+ * to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+ * copies of the Software, and to permit persons to whom the Software is
+ * furnished to do so, subject to the following conditions:
+ *
+ * The above copyright notice and this permission notice shall be included in all
+ * copies or substantial portions of the Software.
+ *
+ * THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+ * IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+ * FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+ * AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+ * LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+ * OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+ * SOFTWARE.
+ *
+ *******************************************************************************/
+
+#ifndef __TUNING_DB_H
+#define __TUNING_DB_H
+
+#include <assert.h>
+#include <math.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+#include <string>
+#include <vector>
+
+// reader of the binary tuning database written by igemm/tuning_db.py, see there for the layout
+#define TUNING_DB_MAGIC "IGTUNEDB"
+#define TUNING_DB_VERSION 1
+#define TUNING_DB_KEY_LEN 17
+#define TUNING_DB_EMPTY_BUCKET 0xffffffffu
+
+// arch(e.g. 908), direction(0 fwd, 1 bwd, 2 wrw), precision(0 fp32, 1 fp16, 2 bf16),
+// n, c, hi, wi, k, y, x, sy, sx, py, px, dy, dx, g
+typedef struct {
+    int v[TUNING_DB_KEY_LEN];
+} tuning_db_key_t;
+
+typedef struct {
+    std::string kernel_name;
+    float duration_ms;
+} tuning_db_result_t;
+
+// same codes as conv_string_to_direction() and amdgpu_string_to_precision() >> 20 of the python side
+static inline int tuning_db_direction_from_string(const std::string &direction) {
+    if (direction == "fwd")
+        return 0;
+    if (direction == "bwd")
+        return 1;
+    if (direction == "wrw")
+        return 2;
+    assert(false);
+    return -1;
+}
+
+static inline int tuning_db_precision_from_string(const std::string &precision) {
+    if (precision == "fp32")
+        return 0;
+    if (precision == "fp16")
+        return 1;
+    if (precision == "bf16")
+        return 2;
+    assert(false);
+    return -1;
+}
+
+static inline tuning_db_key_t tuning_db_key_from_args(const args_t *arg, int arch, int direction, int precision) {
+    tuning_db_key_t key;
+    const char *fields[] = {"batchsize", "in_channels", "in_h", "in_w", "out_channels", "fil_h", "fil_w",
+                            "conv_stride_h", "conv_stride_w", "pad_h", "pad_w", "dilation_h", "dilation_w", "group_count"};
+    key.v[0] = arch;
+    key.v[1] = direction;
+    key.v[2] = precision;
+    for (int i = 0; i < TUNING_DB_KEY_LEN - 3; i++)
+        key.v[3 + i] = arg->get_int(fields[i]);
+    return key;
+}
+
+class tuning_db_t {
+  public:
+    bool load(const char *file_name) {
+        FILE *fp = fopen(file_name, "rb");
+        if (!fp)
+            return false;
+        fseek(fp, 0, SEEK_END);
+        data.resize(ftell(fp));
+        fseek(fp, 0, SEEK_SET);
+        size_t got = fread(data.data(), 1, data.size(), fp);
+        fclose(fp);
+        if (got != data.size() || data.size() < 32 || memcmp(data.data(), TUNING_DB_MAGIC, 8) != 0 ||
+            u32(8) != TUNING_DB_VERSION) {
+            printf("%s is not a tuning db of version %d\n", file_name, TUNING_DB_VERSION);
+            data.clear();
+            return false;
+        }
+        num_records = u32(12);
+        num_buckets = u32(16);
+        uint32_t num_names = u32(20);
+        uint32_t names_bytes = u32(24);
+        uint32_t num_entries = u32(28);
+        names_offset = 32;
+        records_offset = names_offset + names_bytes;
+        entries_offset = records_offset + num_records * record_size();
+        buckets_offset = entries_offset + num_entries * 8;
+        name_offsets.clear();
+        for (size_t pos = names_offset; name_offsets.size() < num_names; pos += strlen(data.data() + pos) + 1)
+            name_offsets.push_back(pos);
+        return true;
+    }
+
+    size_t size() const { return num_records; }
+
+    // fnv-1a over 32bit words of key, same as tuning_db_hash() in python
+    static uint32_t hash(const tuning_db_key_t &key) {
+        uint32_t h = 2166136261u;
+        for (int i = 0; i < TUNING_DB_KEY_LEN; i++)
+            h = (h ^ (uint32_t)key.v[i]) * 16777619u;
+        return h;
+    }
+
+    // exact match, return record index or -1
+    int lookup(const tuning_db_key_t &key) const {
+        if (num_buckets == 0)
+            return -1;
+        for (uint32_t b = hash(key) & (num_buckets - 1);; b = (b + 1) & (num_buckets - 1)) {
+            uint32_t r = u32(buckets_offset + 4 * b);
+            if (r == TUNING_DB_EMPTY_BUCKET)
+                return -1;
+            if (memcmp(data.data() + records_offset + r * record_size(), key.v, sizeof(key.v)) == 0)
+                return r;
+        }
+    }
+
+    // nearest tuned shape of same arch/direction/precision, and never across 1x1 and others. -1 if none
+    int nearest(const tuning_db_key_t &key) const {
+        const float weights[TUNING_DB_KEY_LEN - 3] = {1, 1, 1, 1, 1, 4, 4, 4, 4, 4, 4, 4, 4, 4};
+        int best = -1;
+        double best_dist = 0;
+        for (uint32_t r = 0; r < num_records; r++) {
+            tuning_db_key_t k = get_key(r);
+            if (k.v[0] != key.v[0] || k.v[1] != key.v[1] || k.v[2] != key.v[2] || is_1x1(k) != is_1x1(key))
+                continue;
+            double dist = 0;
+            for (int i = 3; i < TUNING_DB_KEY_LEN; i++) {
+                double d = log2(1.0 + k.v[i]) - log2(1.0 + key.v[i]);
+                dist += weights[i - 3] * d * d;
+            }
+            // records are sorted by key, so first one wins a tie, same as python
+            if (best < 0 || dist < best_dist) {
+                best = r;
+                best_dist = dist;
+            }
+        }
+        return best;
+    }
+
+    // exact match, or nearest shape. return false if nothing for this arch/direction/precision
+    bool find(const tuning_db_key_t &key, std::vector<tuning_db_result_t> &results, bool &exact) const {
+        int r = lookup(key);
+        exact = r >= 0;
+        if (!exact)
+            r = nearest(key);
+        if (r < 0)
+            return false;
+        results = get_results(r);
+        return true;
+    }
+
+    tuning_db_key_t get_key(uint32_t r) const {
+        tuning_db_key_t key;
+        memcpy(key.v, data.data() + records_offset + r * record_size(), sizeof(key.v));
+        return key;
+    }
+
+    std::vector<tuning_db_result_t> get_results(uint32_t r) const {
+        size_t record = records_offset + r * record_size();
+        uint32_t first = u32(record + 4 * TUNING_DB_KEY_LEN);
+        uint32_t count = u32(record + 4 * TUNING_DB_KEY_LEN + 4);
+        std::vector<tuning_db_result_t> results;
+        for (uint32_t i = 0; i < count; i++) {
+            size_t entry = entries_offset + (first + i) * 8;
+            tuning_db_result_t result;
+            result.kernel_name = std::string(data.data() + name_offsets[u32(entry)]);
+            memcpy(&result.duration_ms, data.data() + entry + 4, 4);
+            results.push_back(result);
+        }
+        return results;
+    }
+
+  private:
+    static size_t record_size() { return 4 * TUNING_DB_KEY_LEN + 8; }
+    static bool is_1x1(const tuning_db_key_t &key) {
+        return key.v[8] == 1 && key.v[9] == 1 && key.v[10] == 1 && key.v[11] == 1 && key.v[12] == 0 &&
+               key.v[13] == 0;
+    }
+    uint32_t u32(size_t offset) const {
+        uint32_t v;
+        memcpy(&v, data.data() + offset, 4);
+        return v;
+    }
+
+    std::vector<char> data;
+    std::vector<size_t> name_offsets;
+    uint32_t num_records = 0;
+    uint32_t num_buckets = 0;
+    size_t names_offset = 0;
+    size_t records_offset = 0;
+    size_t entries_offset = 0;
+    size_t buckets_offset = 0;
+};
+
+#endif
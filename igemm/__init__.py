@@ -28,6 +28,12 @@
 import sys
 from .codegen import *
 from .algo import *
+from .perf_advisor import *
+from .cost_model import *
+from .tuning_db import *
+from .kernel_set import *
+from .kernel_emulate import *
+from .kernel_manifest import *
 from .igemm_codegen_driver import *
 
 if sys.hexversion < 0x30600f0:
@@ -25,11 +25,15 @@
 ################################################################################
 
 from .conv import *
+from .conv_args import *
+from .conv_ref import *
 from .fma_main_loop import *
 from .global_memory import *
 from .shared_memory import *
 from .igemm_base import *
 from .igemm_bwd_gtc import *
+from .igemm_sweep import *
+from .igemm_sweep_filter import *
 from .utility import *
 from .thread_mapping import *
 from .coalescing_store import *
\ No newline at end of file
@@ -60,6 +60,30 @@ class ctrl_coalescing_store_t(object):
             assert cg <= self.get_length_m_groups()
             self.coalescing_groups = cg
 
+    def is_valid(self):
+        '''
+        true if igemm_coalescing_store_t can store with this ctrl. the index of every group is computed the same
+        way as emit does, on a copy adjusted by adjust_optimal_coalescing_groups(), so any assert it hits means invalid
+        '''
+        if self.ctm.t_mr() != 2 or self.ctm.t_nr() != 2 or self.block_size % self.ctm.n_n_total() != 0:
+            return False
+        ctrl = copy.copy(self)
+        try:
+            ctrl.adjust_optimal_coalescing_groups()
+            g_mr, g_m1, g_m0, g_nr, g_n1, g_n0 = ctrl.get_subgroups()
+            if g_m1 != 1 or g_nr != 1 or g_n1 != 1 or g_n0 != 1:
+                return False
+            m_index_per_group = ctrl.get_m_index_per_group_m1_m0()
+            if len(m_index_per_group) != ctrl.coalescing_groups:
+                return False
+            ctrl.get_thread_m_stride()
+            for m_index in m_index_per_group:
+                for i_m in m_index[0]:
+                    ctrl.get_m0_m1_index(i_m)
+        except AssertionError:
+            return False
+        return True
+
     def get_length_m_groups(self):
         return self.ctm.t_mr() * self.ctm.t_m1() * self.ctm.t_m0()
     def get_length_n_groups(self):
@@ -278,7 +302,7 @@ class igemm_coalescing_store_t(mc_base_t):
 
             self._emit(f"v_and_b32 v[{v_tmp2}], {l_m0 - 1}, v[{v_co_sub_m_index}]")
             self._emit(f"v_lshrrev_b32 v[{v_tmp2}+1], {igemm_log2(l_m0)}, v[{v_co_sub_m_index}]")
-            self._emit(f"v_lshl_or_b32 v[{v_co_sub_m_index}] v[{v_tmp2}+1], {igemm_log2(ctrl.ctm.t_m0())}, v[{v_tmp2}]")
+            self._emit(f"v_lshl_or_b32 v[{v_co_sub_m_index}], v[{v_tmp2}+1], {igemm_log2(ctrl.ctm.t_m0())}, v[{v_tmp2}]")
         return self._get_deferred()
 
     def init_co_sub_n_index(self, v_co_sub_n_index, v_tid, v_tmp2):
@@ -0,0 +1,130 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+import re
+from .conv import *
+
+# short flag -> (long name in driver/args.h, default), only the ones part of conv_param_t
+CONV_ARGS_FLAGS = {
+    'F' : ('forw',          0),
+    'n' : ('batchsize',     100),
+    'c' : ('in_channels',   3),
+    'H' : ('in_h',          32),
+    'W' : ('in_w',          32),
+    'k' : ('out_channels',  32),
+    'y' : ('fil_h',         3),
+    'x' : ('fil_w',         3),
+    'u' : ('conv_stride_h', 1),
+    'v' : ('conv_stride_w', 1),
+    'p' : ('pad_h',         0),
+    'q' : ('pad_w',         0),
+    'l' : ('dilation_h',    1),
+    'j' : ('dilation_w',    1),
+    'g' : ('group_count',   1),
+    '_' : ('spatial_dim',   2),
+}
+CONV_ARGS_LONG_TO_SHORT = {long_name : short_name for short_name, (long_name, _) in CONV_ARGS_FLAGS.items()}
+
+# base command of MIOpenDriver -> precision
+CONV_ARGS_BASE_PRECISION = {'conv' : 'fp32', 'convfp16' : 'fp16', 'convbfp16' : 'bf16'}
+CONV_ARGS_RE = re.compile(r'(conv|convfp16|convbfp16)\s+(-.*)$')
+
+def conv_args_forw_to_directions(forw):
+    '''
+    -F of driver, 0 is fwd+bwd+wrw, otherwise bit 1/2/4 for fwd/bwd/wrw
+    '''
+    if forw == 0:
+        forw = 7
+    return [d for bit, d in ((1, CONV_DIRECTION_FWD), (2, CONV_DIRECTION_BWD), (4, CONV_DIRECTOIN_WRW)) if forw & bit]
+
+def conv_args_parse(base, arg_string):
+    '''
+    flags after base command, like "-n 64 -c 64 -H 56 ...", to key of conv_param_t of every direction in -F.
+    parsing stops at first token that is not a flag, same as driver. 3d is not supported and returns no key
+    '''
+    values = {s : d for s, (_, d) in CONV_ARGS_FLAGS.items()}
+    tokens = arg_string.split()
+    for i in range(0, len(tokens) - 1, 2):
+        flag = tokens[i]
+        if flag[:2] == '--':
+            flag = CONV_ARGS_LONG_TO_SHORT.get(flag[2:], None)
+        elif flag[:1] == '-' and len(flag) == 2:
+            flag = flag[1]
+        else:
+            break
+        if flag in values:
+            values[flag] = int(tokens[i + 1])
+    if values['_'] != 2:
+        return list()
+    return [(values['n'], values['g'], values['c'], values['H'], values['W'], values['k'], values['y'], values['x'],
+                values['p'], values['q'], values['u'], values['v'], values['l'], values['j'], direction, CONV_ARGS_BASE_PRECISION[base])
+                for direction in conv_args_forw_to_directions(values['F'])]
+
+class conv_workload_t(object):
+    '''
+    deduplicated conv problems with occurrence count, from MIOpenDriver/conv_driver.exe command lines in scripts or logs.
+    a line counts if it has "conv ..."/"convfp16 ..."/"convbfp16 ..." followed by flags. text before the command is ignored,
+    and repeated command strings are parsed only once, so a log of millions of lines is a single linear pass
+    '''
+    def __init__(self):
+        self.counts = dict()        # key -> count, key is argument tuple of conv_param_t without ho/wo
+        self.parsed = dict()        # (base, flags) -> keys
+        self.num_lines = 0
+
+    def add_lines(self, lines):
+        for line in lines:
+            self.num_lines += 1
+            m = None
+            pos = line.find('conv')
+            while pos >= 0 and m is None:
+                if pos == 0 or line[pos - 1].isspace():
+                    m = CONV_ARGS_RE.match(line.rstrip(), pos)
+                pos = line.find('conv', pos + 4)
+            if m is None:
+                continue
+            keys = self.parsed.get(m.groups(), None)
+            if keys is None:
+                keys = self.parsed[m.groups()] = conv_args_parse(*m.groups())
+            for key in keys:
+                self.counts[key] = self.counts.get(key, 0) + 1
+        return self
+
+    def add_file(self, file_name):
+        with open(file_name) as f:
+            return self.add_lines(f)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __iter__(self):
+        '''
+        (conv_param_t, count), most frequent first
+        '''
+        for key, count in sorted(self.counts.items(), key = lambda kc: (-kc[1], kc[0])):
+            n, g, c, hi, wi, k, y, x, py, px, sy, sx, dy, dx, direction, precision = key
+            yield conv_param_t(n, g, c, hi, wi, k, y, x, py, px, sy, sx, dy, dx, -1, -1, direction, precision), count
+
+    def get_conv_params(self, direction = None):
+        return [p for p, _ in self if direction is None or p.direction == direction]
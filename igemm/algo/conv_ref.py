@@ -0,0 +1,176 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+import os
+import hashlib
+from .conv import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None   # reference is not available, codegen does not need it
+
+CONV_REF_VERSION        = 1                     # part of cache key, bump if result of same key changes
+CONV_REF_COL_BYTES      = 256 * 1024 * 1024     # im2col buffer is built for this many bytes of batch at a time
+
+def conv_ref_dtype(precision):
+    '''
+    storage type. bf16 is not in numpy, so it is kept as fp32
+    '''
+    assert np is not None, 'numpy is needed for reference convolution'
+    return np.float16 if precision == 'fp16' else np.float32
+
+def _conv_ref_batches(p):
+    col_bytes_per_n = p.c * p.y * p.x * p.ho * p.wo * 4
+    step = max(1, CONV_REF_COL_BYTES // max(1, col_bytes_per_n))
+    for i in range(0, p.n, step):
+        yield slice(i, min(p.n, i + step))
+
+def _conv_ref_pad(inp, p):
+    return np.pad(inp, ((0, 0), (0, 0), (p.py, p.py), (p.px, p.px)))
+
+def _conv_ref_im2col(inp_pad, p):
+    '''
+    (n, g, c/g*y*x, ho*wo) of padded input, a strided view is copied once by reshape
+    '''
+    n, c = inp_pad.shape[0], inp_pad.shape[1]
+    s_n, s_c, s_h, s_w = inp_pad.strides
+    col = np.lib.stride_tricks.as_strided(inp_pad, shape = (n, c, p.y, p.x, p.ho, p.wo),
+                strides = (s_n, s_c, s_h * p.dy, s_w * p.dx, s_h * p.sy, s_w * p.sx), writeable = False)
+    return col.reshape(n, p.g, (c // p.g) * p.y * p.x, p.ho * p.wo)
+
+def conv_ref_fwd(inp, wei, p):
+    '''
+    inp (n, c, hi, wi), wei (k, c/g, y, x) -> out (n, k, ho, wo), in fp32
+    '''
+    inp, wei = inp.astype(np.float32, copy = False), wei.astype(np.float32, copy = False)
+    w = wei.reshape(p.g, p.k // p.g, -1)
+    out = np.empty((p.n, p.k, p.ho, p.wo), dtype = np.float32)
+    for b in _conv_ref_batches(p):
+        col = _conv_ref_im2col(_conv_ref_pad(inp[b], p), p)
+        out[b] = np.matmul(w, col).reshape(-1, p.k, p.ho, p.wo)
+    return out
+
+def conv_ref_bwd_data(out, wei, p):
+    '''
+    out (n, k, ho, wo) as gradient of output, wei (k, c/g, y, x) -> gradient of input (n, c, hi, wi), in fp32
+    '''
+    out, wei = out.astype(np.float32, copy = False), wei.astype(np.float32, copy = False)
+    w_t = wei.reshape(p.g, p.k // p.g, -1).transpose(0, 2, 1)
+    inp = np.empty((p.n, p.c, p.hi, p.wi), dtype = np.float32)
+    h_end, w_end = p.sy * (p.ho - 1) + 1, p.sx * (p.wo - 1) + 1
+    for b in _conv_ref_batches(p):
+        dout = out[b].reshape(-1, p.g, p.k // p.g, p.ho * p.wo)
+        dcol = np.matmul(w_t, dout).reshape(-1, p.c, p.y, p.x, p.ho, p.wo)
+        inp_pad = np.zeros((dcol.shape[0], p.c, p.hi + 2 * p.py, p.wi + 2 * p.px), dtype = np.float32)
+        # col2im, one strided add per filter tap
+        for iy in range(p.y):
+            for ix in range(p.x):
+                inp_pad[:, :, iy * p.dy : iy * p.dy + h_end : p.sy, ix * p.dx : ix * p.dx + w_end : p.sx] += dcol[:, :, iy, ix]
+        inp[b] = inp_pad[:, :, p.py : p.py + p.hi, p.px : p.px + p.wi]
+    return inp
+
+def conv_ref_bwd_weight(inp, out, p):
+    '''
+    inp (n, c, hi, wi), out (n, k, ho, wo) as gradient of output -> gradient of weight (k, c/g, y, x), in fp32
+    '''
+    inp, out = inp.astype(np.float32, copy = False), out.astype(np.float32, copy = False)
+    wei = np.zeros((p.g, p.k // p.g, (p.c // p.g) * p.y * p.x), dtype = np.float32)
+    for b in _conv_ref_batches(p):
+        col = _conv_ref_im2col(_conv_ref_pad(inp[b], p), p)
+        dout = out[b].reshape(-1, p.g, p.k // p.g, p.ho * p.wo)
+        wei += np.matmul(dout, col.transpose(0, 1, 3, 2)).sum(axis = 0)
+    return wei.reshape(p.k, p.c // p.g, p.y, p.x)
+
+def conv_ref_tensors(p, seed = 0):
+    '''
+    random operands of p.direction, same distribution as host driver: data in [0, 1), weight in [-0.5, 0.5)
+    '''
+    rng = np.random.default_rng(seed)
+    dtype = conv_ref_dtype(p.precision)
+    def data(shape):
+        return rng.random(shape, dtype = np.float32).astype(dtype, copy = False)
+    def weight(shape):
+        return (rng.random(shape, dtype = np.float32) - 0.5).astype(dtype, copy = False)
+    if p.direction == CONV_DIRECTION_FWD:
+        return {'inp' : data((p.n, p.c, p.hi, p.wi)), 'wei' : weight((p.k, p.c // p.g, p.y, p.x))}
+    if p.direction == CONV_DIRECTION_BWD:
+        return {'out' : data((p.n, p.k, p.ho, p.wo)), 'wei' : weight((p.k, p.c // p.g, p.y, p.x))}
+    return {'inp' : data((p.n, p.c, p.hi, p.wi)), 'out' : data((p.n, p.k, p.ho, p.wo))}
+
+def conv_ref(p, tensors):
+    '''
+    result of p.direction from operands of conv_ref_tensors(), in storage type of p.precision
+    '''
+    if p.direction == CONV_DIRECTION_FWD:
+        result = conv_ref_fwd(tensors['inp'], tensors['wei'], p)
+    elif p.direction == CONV_DIRECTION_BWD:
+        result = conv_ref_bwd_data(tensors['out'], tensors['wei'], p)
+    else:
+        result = conv_ref_bwd_weight(tensors['inp'], tensors['out'], p)
+    return result.astype(conv_ref_dtype(p.precision), copy = False)
+
+def conv_ref_nrms(ref, pred):
+    '''
+    same measure as valid_vector() of host driver
+    '''
+    ref, pred = np.asarray(ref, dtype = np.float64).ravel(), np.asarray(pred, dtype = np.float64).ravel()
+    return np.sqrt(np.sum((ref - pred) ** 2) / np.sum(2.0 * ref * ref))
+
+class conv_ref_cache_t(object):
+    '''
+    reference result on disk as .npy, keyed by shape, direction, precision and seed, and loaded memory mapped.
+    operands are cheap to regenerate from seed, so only the result is stored
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hit = 0
+        self.miss = 0
+        os.makedirs(cache_dir, exist_ok = True)
+
+    def get_key(self, p, seed):
+        fields = (CONV_REF_VERSION, p.n, p.g, p.c, p.hi, p.wi, p.k, p.y, p.x, p.py, p.px, p.sy, p.sx, p.dy, p.dx,
+                    conv_direction_to_string(p.direction), p.precision, seed)
+        return hashlib.sha1(repr(fields).encode()).hexdigest()
+
+    def get(self, p, seed = 0):
+        '''
+        return (operands, result), result is a read only memmap
+        '''
+        tensors = conv_ref_tensors(p, seed)
+        file_name = os.path.join(self.cache_dir, self.get_key(p, seed) + '.npy')
+        if os.path.exists(file_name):
+            self.hit += 1
+        else:
+            self.miss += 1
+            # write then rename, so a concurrent reader never sees a partial file
+            tmp_name = f'{file_name}.{os.getpid()}.tmp.npy'
+            np.save(tmp_name, conv_ref(p, tensors))
+            os.replace(tmp_name, file_name)
+        return tensors, np.load(file_name, mmap_mode = 'r')
+
+    def summary(self):
+        return f'conv reference cache: {self.hit} hit, {self.miss} miss'
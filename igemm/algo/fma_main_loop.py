@@ -66,6 +66,16 @@ class macro_v_fma_mxn_t(mc_base_t):
             for idx_m in range(self.m):
                 for idx_n in range(self.n):
                     self._emit(fma(reg_c(idx_m * self.stride + idx_n), reg_a(idx_m), reg_b(idx_n)))
+    def expand(self, c, a, b):
+        '''
+        same as invoking this macro, but every fma is emitted inline
+        '''
+        fma = inst_fma_t(self.mc.arch_config)
+        with self._deferred_context():
+            for idx_m in range(self.m):
+                for idx_n in range(self.n):
+                    self._emit(fma(sym_t.expr(c, idx_m * self.stride + idx_n), sym_t.expr(a, idx_m), sym_t.expr(b, idx_n)))
+        return self._get_deferred()
 
 class ctrl_fma_main_loop_t(object):
     def __init__(self):
@@ -82,6 +92,8 @@ class ctrl_fma_main_loop_t(object):
         self.gemm_n_level1_cluster       = 0
         self.lds_single_size             = 0                    # in byte, should be power of 2
         self.lds_buffer_num              = 2
+        self.scheduler                   = None                 # ir_scheduler_t, to schedule unrolled fma body and loop tail
+        self.macro_table                 = None                 # ir_macro_table_t, to expand macros of loop tail for scheduler
 
         # functor
         self.global_load_a_functor       = None
@@ -119,6 +131,7 @@ class fma_main_loop_t(mc_base_t):
     def __init__(self, mc, ctrl):
         mc_base_t.__init__(self, mc)
         self.ctrl = ctrl
+        self.stall_cycles = None        # predicted (before, after) if scheduled
     def emit(self):
         label_fma_body = 'L_{}_fma_body'.format(self.ctrl.label_prefix)
         label_fma_finishing = 'L_{}_fma_finishing'.format(self.ctrl.label_prefix)
@@ -172,6 +185,80 @@ class fma_main_loop_t(mc_base_t):
         thread_sub_n = self.ctrl.thread_n // self.ctrl.gemm_n_repeat
 
         v_fma = macro_v_fma_mxn_t(self.mc, thread_sub_m, thread_sub_n, thread_n)
+        scheduler = self.ctrl.scheduler
+
+        def emit_unroll_k_body(fma):
+            # 1st fma
+            self._emit(f's_waitcnt lgkmcnt(2)')
+            self._emit(fma(v_c(), v_a(), v_b()))
+            #self._emit_empty_line()
+
+            # 2nd fma
+            self._emit(f's_waitcnt lgkmcnt(1)')
+            self._emit(fma(v_c(thread_sub_n), v_a(), v_b(thread_sub_n)))
+            #self._emit_empty_line()
+
+            # 3rd fma
+            self._emit(f_sld_a(v_a(), v_sld_a_os(), f'{lds_base_m}+(.itr_k+1)*{lds_width_m}'))
+            self._emit(f's_waitcnt lgkmcnt(1)')
+            self._emit(fma(v_c(thread_sub_m * thread_n), v_a(thread_sub_m), v_b()))
+            #self._emit_empty_line()
+
+            # 4th fma
+            self._emit(f_sld_b(v_b(), v_sld_b_os(), f'{lds_base_n}+(.itr_k+1)*{lds_width_n}'))
+            self._emit(fma(v_c(thread_sub_m * thread_n + thread_sub_n), v_a(thread_sub_m), v_b(thread_sub_n)))
+            self._emit_empty_line()
+
+            # last
+            self._emit(f_sld_b(v_b(thread_sub_n), v_sld_b_os(), f'{lds_base_n}+(.itr_k+1)*{lds_width_n}+{lds_width_n//2}'))
+            self._emit(f_sld_a(v_a(thread_sub_m), v_sld_a_os(), f'{lds_base_m}+(.itr_k+1)*{lds_width_m}+{lds_width_m//2}'))
+            self._emit('.itr_k = .itr_k + 1')
+
+        def emit_unroll_k():
+            with self._record_context():
+                self._emit(f_sld_a(v_a(), v_sld_a_os(), lds_base_m))
+                self._emit(f_sld_b(v_b(), v_sld_b_os(), lds_base_n))
+                self._emit(f_sld_b(v_b(thread_sub_n), v_sld_b_os(), lds_base_n + lds_width_n // 2 ))
+                self._emit(f_sld_a(v_a(thread_sub_m), v_sld_a_os(), lds_base_m + lds_width_m // 2 ))
+            sld_prologue = self._get_recorded()
+            self._emit_ir(sld_prologue)
+
+            self._emit(f".itr_k = 0")
+            self._emit(f".rept {unroll_k-1}")
+            with self._indent_context():
+                if scheduler is None:
+                    emit_unroll_k_body(v_fma)
+                else:
+                    # fma is inlined, so every single fma can be interleaved with lds load
+                    with self._record_context():
+                        emit_unroll_k_body(v_fma.expand)
+                    body = self._get_recorded()
+                    scheduled_body = scheduler(body, sld_prologue.get_insts())
+                    stall = [scheduler.predict_stall(b, sld_prologue.get_insts(), unroll_k - 1) for b in (body, scheduled_body)]
+                    self._emit_ir(scheduled_body)
+            self._emit(f".endr")
+            if scheduler is not None:
+                self._emit(f"; scheduled for {amdgpu_arch_to_string(scheduler.arch_config.arch)}, predicted stall cycles of unroll: {stall[0]} -> {stall[1]}")
+                self.stall_cycles = stall
+            self._emit_empty_line()
+            return sld_prologue
+
+        def emit_scheduled(emit_func, lgkm_pending):
+            '''
+            statements of emit_func with macros expanded and scheduled, if there is scheduler. between barrier,
+            branch and vmcnt wait, fma is interleaved with global and lds load/store. return predicted stall
+            '''
+            if scheduler is None:
+                emit_func()
+                return None
+            with self._record_context():
+                emit_func()
+            segment = self.ctrl.macro_table.expand_ir(self._get_recorded())
+            scheduled = scheduler(segment, lgkm_pending)
+            stall = [scheduler.predict_stall(b, lgkm_pending) for b in (segment, scheduled)]
+            self._emit_ir(scheduled)
+            self._emit(f"; scheduled for {amdgpu_arch_to_string(scheduler.arch_config.arch)}, predicted stall cycles of tail: {stall[0]} -> {stall[1]}")
+            return stall
 
         # start emit
         self._emit(f"; start FMA loop, {thread_m}x{thread_n} thread tile with {thread_sub_m}x{thread_sub_n} sub-tile")
@@ -206,87 +293,57 @@ class fma_main_loop_t(mc_base_t):
         # Label: start of fma body
         self._emit_front(f"{label_fma_body}:")
         self._emit(f"; do fma accumulate with unroll {unroll_k}")
-        self._emit(f_sld_a(v_a(), v_sld_a_os(), lds_base_m))
-        self._emit(f_sld_b(v_b(), v_sld_b_os(), lds_base_n))
-        self._emit(f_sld_b(v_b(thread_sub_n), v_sld_b_os(), lds_base_n + lds_width_n // 2 ))
-        self._emit(f_sld_a(v_a(thread_sub_m), v_sld_a_os(), lds_base_m + lds_width_m // 2 ))
-
-        self._emit(f".itr_k = 0")
-        self._emit(f".rept {unroll_k-1}")
-        with self._indent_context():
+        sld_prologue = emit_unroll_k()
+        self._emit(f"; last unroll")
+        def emit_loop_tail():
+            self._emit(f"v_xor_b32 v[{v_sld_b_os()}], {lds_single_size}, v[{v_sld_b_os()}] ; switch double buffer b load")
+            self._emit(f"v_xor_b32 v[{v_sld_a_os()}], {lds_single_size}, v[{v_sld_a_os()}] ; switch double buffer a load")
+
             # 1st fma
-            self._emit(f's_waitcnt lgkmcnt(2)')
+            self._emit(f"s_waitcnt lgkmcnt(2)")
             self._emit(v_fma(v_c(), v_a(), v_b()))
             #self._emit_empty_line()
 
             # 2nd fma
-            self._emit(f's_waitcnt lgkmcnt(1)')
+            self._emit(f"s_waitcnt lgkmcnt(1)")
             self._emit(v_fma(v_c(thread_sub_n), v_a(), v_b(thread_sub_n)))
             #self._emit_empty_line()
 
-            # 3rd fma
-            self._emit(f_sld_a(v_a(), v_sld_a_os(), f'{lds_base_m}+(.itr_k+1)*{lds_width_m}'))
-            self._emit(f's_waitcnt lgkmcnt(1)')
-            self._emit(v_fma(v_c(thread_sub_m * thread_n), v_a(thread_sub_m), v_b()))
-            #self._emit_empty_line()
+            #       wait global and store to LDS
+            self._emit(f"s_waitcnt vmcnt({f_gld_a.get_issues()})")
+            self._emit(f_sst_b())
+            self._emit(f"s_waitcnt vmcnt(0)")
+            self._emit(f_sst_a())
 
-            # 4th fma
-            self._emit(f_sld_b(v_b(), v_sld_b_os(), f'{lds_base_n}+(.itr_k+1)*{lds_width_n}'))
-            self._emit(v_fma(v_c(thread_sub_m * thread_n + thread_sub_n), v_a(thread_sub_m), v_b(thread_sub_n)))
-            self._emit_empty_line()
+            #       iteration--
+            self._emit(f"s_sub_i32 s[{s_kitr()}], s[{s_kitr()}], {unroll_k}")
+            self._emit(f"s_cmp_gt_i32 s[{s_kitr()}], 0")
+            self._emit(f"s_cbranch_scc0 {label_fma_finishing}")
 
-            # last
-            self._emit(f_sld_b(v_b(thread_sub_n), v_sld_b_os(), f'{lds_base_n}+(.itr_k+1)*{lds_width_n}+{lds_width_n//2}'))
-            self._emit(f_sld_a(v_a(thread_sub_m), v_sld_a_os(), f'{lds_base_m}+(.itr_k+1)*{lds_width_m}+{lds_width_m//2}'))
-            self._emit('.itr_k = .itr_k + 1')
-
-        self._emit(f".endr")
-        self._emit_empty_line()
-        self._emit(f"; last unroll")
-        self._emit(f"v_xor_b32 v[{v_sld_b_os()}], {lds_single_size}, v[{v_sld_b_os()}] ; switch double buffer b load")
-        self._emit(f"v_xor_b32 v[{v_sld_a_os()}], {lds_single_size}, v[{v_sld_a_os()}] ; switch double buffer a load")
-
-        # 1st fma
-        self._emit(f"s_waitcnt lgkmcnt(2)")
-        self._emit(v_fma(v_c(), v_a(), v_b()))
-        #self._emit_empty_line()
-
-        # 2nd fma
-        self._emit(f"s_waitcnt lgkmcnt(1)")
-        self._emit(v_fma(v_c(thread_sub_n), v_a(), v_b(thread_sub_n)))
-        #self._emit_empty_line()
-
-        #       wait global and store to LDS
-        self._emit(f"s_waitcnt vmcnt({f_gld_a.get_issues()})")
-        self._emit(f_sst_b())
-        self._emit(f"s_waitcnt vmcnt(0)")
-        self._emit(f_sst_a())
+            self._emit(f_move_slice_window_b())
+            self._emit(f_move_slice_window_a())
 
-        #       iteration--
-        self._emit(f"s_sub_i32 s[{s_kitr()}], s[{s_kitr()}], {unroll_k}")
-        self._emit(f"s_cmp_gt_i32 s[{s_kitr()}], 0")
-        self._emit(f"s_cbranch_scc0 {label_fma_finishing}")
-
-        self._emit(f_move_slice_window_b())
-        self._emit(f_move_slice_window_a())
+            # 3rd fma
+            self._emit(f"s_waitcnt lgkmcnt({f_sst_a.get_issues() + f_sst_b.get_issues()})")
+            self._emit(v_fma(v_c(thread_sub_m * thread_n), v_a(thread_sub_m), v_b()))
+            #self._emit_empty_line()
 
-        # 3rd fma
-        self._emit(f"s_waitcnt lgkmcnt({f_sst_a.get_issues() + f_sst_b.get_issues()})")
-        self._emit(v_fma(v_c(thread_sub_m * thread_n), v_a(thread_sub_m), v_b()))
-        #self._emit_empty_line()
+            self._emit(f"v_xor_b32 v[{v_sst_b_os()}], {lds_single_size}, v[{v_sst_b_os()}] ; switch double buffer b store")
+            self._emit(f"v_xor_b32 v[{v_sst_a_os()}], {lds_single_size}, v[{v_sst_a_os()}] ; switch double buffer a store")
+            #       barrier here!
+            self._emit(f"s_waitcnt lgkmcnt(0)")
+            self._emit(f"s_barrier")
 
-        self._emit(f"v_xor_b32 v[{v_sst_b_os()}], {lds_single_size}, v[{v_sst_b_os()}] ; switch double buffer b store")
-        self._emit(f"v_xor_b32 v[{v_sst_a_os()}], {lds_single_size}, v[{v_sst_a_os()}] ; switch double buffer a store")
-        #       barrier here!
-        self._emit(f"s_waitcnt lgkmcnt(0)")
-        self._emit(f"s_barrier")
+            #       load next from global
+            self._emit(f_gld_b())
+            self._emit(f_gld_a())
 
-        #       load next from global
-        self._emit(f_gld_b())
-        self._emit(f_gld_a())
-
-        # 4th fma
-        self._emit(v_fma(v_c(thread_sub_m*thread_n+thread_sub_n), v_a(thread_sub_m), v_b(thread_sub_n)))
+            # 4th fma
+            self._emit(v_fma(v_c(thread_sub_m*thread_n+thread_sub_n), v_a(thread_sub_m), v_b(thread_sub_n)))
+        stall = emit_scheduled(emit_loop_tail, sld_prologue.get_insts())
+        if stall:
+            # unroll and tail are what a loop iteration runs
+            self.stall_cycles = [a + b for a, b in zip(self.stall_cycles, stall)]
         self._emit_empty_line()
         self._emit(f"s_branch {label_fma_body}")
 
@@ -301,14 +358,9 @@ class fma_main_loop_t(mc_base_t):
         self._emit("s_waitcnt lgkmcnt(0)")
         self._emit("s_barrier")
 
-        self._emit(f_sld_a(v_a(), v_sld_a_os(), lds_base_m))
-        self._emit(f_sld_b(v_b(), v_sld_b_os(), lds_base_n))
-        self._emit(f_sld_b(v_b(thread_sub_n), v_sld_b_os(), lds_base_n + lds_width_n // 2 ))
-        self._emit(f_sld_a(v_a(thread_sub_m), v_sld_a_os(), lds_base_m + lds_width_m // 2 ))
-
-        self._emit(f".itr_k = 0")
-        self._emit(f".rept {unroll_k - 1}")
-        with self._indent_context():
+        sld_prologue = emit_unroll_k()
+        self._emit('; last unroll')
+        def emit_last_tail():
             # 1st fma
             self._emit('s_waitcnt lgkmcnt(2)')
             self._emit(v_fma(v_c(), v_a(), v_b()))
@@ -320,38 +372,11 @@ class fma_main_loop_t(mc_base_t):
             #self._emit_empty_line()
 
             # 3rd fma
-            self._emit(f_sld_a(v_a(), v_sld_a_os(), f'{lds_base_m}+(.itr_k+1)*{lds_width_m}'))
-            self._emit('s_waitcnt lgkmcnt(1)')
+            self._emit('s_waitcnt lgkmcnt(0)')
             self._emit(v_fma(v_c(thread_sub_m*thread_n), v_a(thread_sub_m), v_b()))
             #self._emit_empty_line()
 
             # 4th fma
-            self._emit(f_sld_b(v_b(), v_sld_b_os(), f'{lds_base_n}+(.itr_k+1)*{lds_width_n}'))
             self._emit(v_fma(v_c(thread_sub_m*thread_n+thread_sub_n), v_a(thread_sub_m), v_b(thread_sub_n)))
-            self._emit_empty_line()
-
-            # last
-            self._emit(f_sld_b(v_b(thread_sub_n), v_sld_b_os(), f'{lds_base_n}+(.itr_k+1)*{lds_width_n}+{lds_width_n//2}'))
-            self._emit(f_sld_a(v_a(thread_sub_m), v_sld_a_os(), f'{lds_base_m}+(.itr_k+1)*{lds_width_m}+{lds_width_m//2}'))
-            self._emit('.itr_k = .itr_k + 1')
-        self._emit('.endr')
+        emit_scheduled(emit_last_tail, sld_prologue.get_insts())
         self._emit_empty_line()
-        self._emit('; last unroll')
-        # 1st fma
-        self._emit('s_waitcnt lgkmcnt(2)')
-        self._emit(v_fma(v_c(), v_a(), v_b()))
-        #self._emit_empty_line()
-
-        # 2nd fma
-        self._emit('s_waitcnt lgkmcnt(1)')
-        self._emit(v_fma(v_c(thread_sub_n), v_a(), v_b(thread_sub_n)))
-        #self._emit_empty_line()
-
-        # 3rd fma
-        self._emit('s_waitcnt lgkmcnt(0)')
-        self._emit(v_fma(v_c(thread_sub_m*thread_n), v_a(thread_sub_m), v_b()))
-        #self._emit_empty_line()
-
-        # 4th fma
-        self._emit(v_fma(v_c(thread_sub_m*thread_n+thread_sub_n), v_a(thread_sub_m), v_b(thread_sub_n)))
-        self._emit_empty_line()
\ No newline at end of file
@@ -276,6 +276,9 @@ class macro_igemm_2d_global_load_t(mc_base_t):
             return  ctrl.length_d1 * n_d0
         else:
             return 1
+    def get_num_vgpr(self):
+        ''' number of destination vgpr written by this macro '''
+        return self.ctrl.length_d0 * self.ctrl.length_d1
 
 class macro_igemm_2d_global_load_precache_soffset_t(mc_base_t):
     # precache soffset means no salu while do loading
@@ -331,16 +334,12 @@ class macro_igemm_2d_global_load_precache_soffset_t(mc_base_t):
         ctrl = self.ctrl
         assert ctrl.length_d1 % ctrl.vector_d1 == 0
         n_d1 = ctrl.length_d1 // ctrl.vector_d1
-        soffset_cnt = 0
-        for i_d0 in range(ctrl.length_d0):
-            for i_d1 in range(n_d1):
-                if i_d0 == 0 and i_d1 == 0:
-                    continue
-                if i_d0 == 0 and i_d1 == 1:
-                    continue
-                if i_d0 == 1 and i_d1 == 0:
-                    continue
-                soffset_cnt += 1
+        # (0,0), (0,1), (1,0) are addressed by voffset/stride directly, see get_2d_index_soffset()
+        soffset_cnt = ctrl.length_d0 * n_d1 - 1
+        if n_d1 > 1:
+            soffset_cnt -= 1
+        if ctrl.length_d0 > 1:
+            soffset_cnt -= 1
         return soffset_cnt
 
     def init_precache_soffset(self, s_stride_d0, s_stride_d1, s_offset, s_tmp):
@@ -428,6 +427,9 @@ class macro_igemm_2d_global_load_precache_soffset_t(mc_base_t):
         ctrl = self.ctrl
         n_d1 = ctrl.length_d1 // ctrl.vector_d1
         return  ctrl.length_d0 * n_d1
+    def get_num_vgpr(self):
+        ''' number of destination vgpr written by this macro '''
+        return self.ctrl.length_d0 * self.ctrl.length_d1
 
 
 class macro_igemm_write_4d_strided_t(mc_base_t):
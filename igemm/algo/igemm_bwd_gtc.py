@@ -24,6 +24,7 @@
 # 
 ################################################################################
 # pylint: disable=maybe-no-member
+import logging
 from ..codegen import *
 from .fma_main_loop import *
 from .igemm_base import *
@@ -33,6 +34,8 @@ from .utility import *
 from .thread_mapping import *
 from .coalescing_store import *
 
+_logger = logging.getLogger(__name__)
+
 IGEMM_BWD_GTC_LDS_STORE_ORDER_GEMM_M_C0_C1 = 0
 IGEMM_BWD_GTC_LDS_STORE_ORDER_GEMM_M_C1_C0 = 1
 IGEMM_BWD_GTC_LDS_STORE_ORDER_GEMM_N_N0_N1B = 4
@@ -47,6 +50,39 @@ def _find_non_1_index_in_list(list_object):
             result_list.append(idx)
     return result_list
 
+def _igemm_bwd_gtc_need_reverse_order(x0, x1):
+    if x0 != 1 and x1 == 1:
+        return True
+    if x0 > x1:
+        return True
+    return False
+
+def igemm_bwd_gtc_get_coalescing_store_ctrl(tunable):
+    '''
+    ctrl of the output coalescing store, from tunable only. coalescing groups are not adjusted yet,
+    so sweep can ask ctrl_coalescing_store_t.is_valid() before a kernel is built
+    '''
+    ctrl_thread_mapping = ctrl_thread_mapping_t()
+            #                        ->      MR x  NR x ML1 x NL1 x ML0 x NL0
+    ctrl_thread_mapping.thread_lengths = [tunable.gemm_m_repeat, tunable.gemm_n_repeat, 1, 1, tunable.gemm_m_per_thread, tunable.gemm_n_per_thread]
+    ctrl_thread_mapping.cluster_lengths = [1, 1, tunable.gemm_m_level1_cluster, tunable.gemm_n_level1_cluster, tunable.gemm_m_level0_cluster, tunable.gemm_n_level0_cluster]
+
+    ctrl_coalescing_store = ctrl_coalescing_store_t()
+    ctrl_coalescing_store.ctm = ctrl_thread_mapping
+    ctrl_coalescing_store.coalescing_groups = igemm_next_pow2(tunable.coalescing_store_groups)
+    ctrl_coalescing_store.data_byte = amdgpu_precision_data_byte(tunable.precision)
+
+    ctrl_coalescing_store.vector_write_out = 1                      # TODO: some cases this can be set to other value
+    ctrl_coalescing_store.block_size = tunable.block_size
+
+    # gemm_m is c0*c1, lengths of tensor a are k0, k1e, c0, c1
+    t_c0, t_c1 = tunable.tensor_a_thread_lengths[2], tunable.tensor_a_thread_lengths[3]
+    c_c0, c_c1 = tunable.tensor_a_cluster_lengths[2], tunable.tensor_a_cluster_lengths[3]
+    ctrl_coalescing_store.gemm_m_m0_m1 = [t_c0 * c_c0, t_c1 * c_c1]
+    if tunable.allow_lds_reorder and _igemm_bwd_gtc_need_reverse_order(t_c0, t_c1):
+        ctrl_coalescing_store.gemm_m_order = IGEMM_COALESCING_GEMM_M_ORDER_M1_M0
+    return ctrl_coalescing_store
+
 class macro_igemm_bwd_gtc_out_update_os_t(mc_base_t):
     def __init__(self, mc, data_byte):
         mc_base_t.__init__(self, mc)
@@ -389,29 +425,10 @@ class igemm_bwd_gtc_t(mc_base_t):
         assert self.out_thread_copy_ndim in (1, 2)
         assert self.wei_thread_copy_ndim in (1, 2)
 
-        ctrl_thread_mapping = ctrl_thread_mapping_t()
-                #                        ->      MR x  NR x ML1 x NL1 x ML0 x NL0
-        ctrl_thread_mapping.thread_lengths = [self.tunable.gemm_m_repeat, self.tunable.gemm_n_repeat, 1, 1, self.tunable.gemm_m_per_thread, self.tunable.gemm_n_per_thread]
-        ctrl_thread_mapping.cluster_lengths = [1, 1, self.tunable.gemm_m_level1_cluster, self.tunable.gemm_n_level1_cluster, self.tunable.gemm_m_level0_cluster, self.tunable.gemm_n_level0_cluster]
-        self.thread_mapping = igemm_thread_mapping_t(self.mc, ctrl_thread_mapping)
-
-
-        self.coalescing_store_groups = igemm_next_pow2(self.tunable.coalescing_store_groups)
-        ctrl_coalescing_store = ctrl_coalescing_store_t()
-        ctrl_coalescing_store.ctm = ctrl_thread_mapping
-        ctrl_coalescing_store.coalescing_groups = self.coalescing_store_groups
-        ctrl_coalescing_store.data_byte = amdgpu_precision_data_byte(self.tunable.precision)
-
-        ctrl_coalescing_store.vector_write_out = 1                      # TODO: some cases this can be set to other value
-        ctrl_coalescing_store.block_size = self.tunable.block_size
-
-        gemm_m_order, gemm_n_order = self.get_lds_gemm_m_gemm_n_order()
-        n_c0, n_c1, n_k0, n_k1e, n_n0, n_n1b = self.get_dims_lengths()
-        ctrl_coalescing_store.gemm_m_m0_m1 = [n_c0, n_c1]
-        if gemm_m_order == IGEMM_BWD_GTC_LDS_STORE_ORDER_GEMM_M_C1_C0:
-            ctrl_coalescing_store.gemm_m_order = IGEMM_COALESCING_GEMM_M_ORDER_M1_M0
-
+        ctrl_coalescing_store = igemm_bwd_gtc_get_coalescing_store_ctrl(self.tunable)
+        self.thread_mapping = igemm_thread_mapping_t(self.mc, ctrl_coalescing_store.ctm)
 
+        self.coalescing_store_groups = ctrl_coalescing_store.coalescing_groups
         ctrl_coalescing_store.adjust_optimal_coalescing_groups()        # in m1_m0 order, must adjust 
         self.coalescing_store = igemm_coalescing_store_t(mc, ctrl_coalescing_store)
 
@@ -429,6 +446,8 @@ class igemm_bwd_gtc_t(mc_base_t):
         self.karg = self.kernel_karg_t(mc, self)
         self.sgpr = self.kernel_sgpr_t(mc, self)
         self.vgpr = self.kernel_vgpr_t(mc, self)
+        self.recorded_body = None
+        self.waitcnt_stall = None           # predicted wait cycles (hand, analytic) of body
 
 
     def name(self):
@@ -452,12 +471,7 @@ class igemm_bwd_gtc_t(mc_base_t):
         return False
 
     def get_lds_gemm_m_gemm_n_order(self):
-        def need_reverse_order(x0, x1):
-            if x0 != 1 and x1 == 1:
-                return True
-            if x0 > x1:
-                return True
-            return False
+        need_reverse_order = _igemm_bwd_gtc_need_reverse_order
 
         t_c0, t_c1, t_k0, t_k1e, t_n0, t_n1b = self.get_thread_lengths()
 
@@ -490,7 +504,7 @@ class igemm_bwd_gtc_t(mc_base_t):
             with self._deferred_context():
                 self._emit(f"; load output")
                 if self.outer.tunable.nxe != 0:
-                    self._emit(f".v_clear_nc {v.v_gld_b()}, {m_out_2d_global_load.ctrl.length_d0 * m_out_2d_global_load.ctrl.length_d1}")
+                    self._emit(f".v_clear_nc {v.v_gld_b()}, {m_out_2d_global_load.get_num_vgpr()}")
                     self._emit(f"v_cmp_eq_u32 vcc, 1, v[{v.v_out_flag()}]")
                     self._emit(f"s_and_saveexec_b64 s[{s.s_tmp(4)}:{s.s_tmp(5)}], vcc")
                 if self.outer.tunable.precache_soffset:
@@ -713,6 +727,7 @@ class igemm_bwd_gtc_t(mc_base_t):
                 self.s_wei_offset          = sym_t("s_wei_offset"             ,sseq(wei_npc))
             self.s_tmp                     = sym_t("s_tmp"                    ,sseq(6, 2))
             self.s_end                     = sym_t("s_end"                    ,sseq())
+            self.sseq                      = sseq
 
         def get_count(self):
             return self.s_end.value
@@ -811,10 +826,53 @@ class igemm_bwd_gtc_t(mc_base_t):
 
             self.v_tmp           = sym_t("v_tmp"          ,vseq(6, 2))
             self.v_end           = sym_t("v_end"          ,vseq())
+            self.vseq            = vseq
 
         def get_count(self):
             return self.v_end.value
 
+        def get_layout(self):
+            return {k : v.value for k, v in self.__dict__.items() if k.startswith('v_')}
+
+        def set_layout(self, layout):
+            for k, value in layout.items():
+                getattr(self, k).value = value
+
+        def allocate(self, ir):
+            '''
+            re-assign vgpr by live range in recorded kernel body. symbols of same value are aliases,
+            symbols overlaid on v_c (prologue temporaries) are allocated on their own.
+            keep the linear layout if anything can't be proved safe, or it is not smaller
+            '''
+            groups = dict()
+            for k, v in self.__dict__.items():
+                if k.startswith('v_') and k != 'v_end':
+                    groups.setdefault(v.value, []).append(k)
+            ranges, extents = gpr_get_live_ranges(ir, [k for g in groups.values() for k in g])
+
+            alloc = gpr_alloc_t()
+            for r, live_range in ranges.items():
+                if type(r) is int:
+                    # physical register (thread id in v0) is live from kernel entry
+                    alloc.add_fixed(r, 1, (0, live_range[1]))
+            for start, g in groups.items():
+                size = max(self.vseq.get_step(start), 1)
+                if any(extents.get(k, 0) > size for k in g):
+                    return False
+                live = [ranges[k] for k in g if k in ranges]
+                if not live:
+                    continue
+                alignment = 4 if size >= 4 else (2 if size >= 2 else 1)
+                alloc.add(start, size, alignment, (min(l[0] for l in live), max(l[1] for l in live)))
+            allocated = alloc()
+            if alloc.count >= self.get_count():
+                return False
+            for start, g in groups.items():
+                for k in g:
+                    getattr(self, k).value = allocated.get(start, 0)
+            self.v_end.value = alloc.count
+            return True
+
         def emit(self):
             for k, v in self.__dict__.items():
                 if k.startswith('v_'):
@@ -1335,12 +1393,12 @@ class igemm_bwd_gtc_t(mc_base_t):
             if gemm_m_unmerge_cluster == 1:
                 self._emit(f"s_lshr_b32 s[{s.s_tmp()}], s[{s.s_c()}], {igemm_log2(n_c0)}")
                 self._emit(f"s_mul_i32 s[{s.s_in_stride_c0()}], s[{s.s_in_stride_c()}], s[{s.s_tmp()}]")
-            if gemm_n_unmerge_cluster == 1:
-                self._emit(f"s_lshr_b32 s[{s.s_tmp()}], s[{s.s_n()}], {igemm_log2(n_n0)}")
-                self._emit(f"s_mul_i32 s[{s.s_in_stride_n0()}], s[{s.s_in_stride_n()}], s[{s.s_tmp()}]")
             self._emit(f"s_mov_b32 s[{s.s_wei_stride_k()}],      s[{s.s_c()}]")
             self._emit(f"s_mul_i32 s[{s.s_out_stride_n()}],      s[{s.s_k()}],        s[{s.s_stride_hw()}]")
             self._emit(f"s_mul_i32 s[{s.s_in_stride_n()}],       s[{s.s_c()}],        s[{s.s_stride_hw()}]")
+            if gemm_n_unmerge_cluster == 1:
+                self._emit(f"s_lshr_b32 s[{s.s_tmp()}], s[{s.s_n()}], {igemm_log2(n_n0)}")
+                self._emit(f"s_mul_i32 s[{s.s_in_stride_n0()}], s[{s.s_in_stride_n()}], s[{s.s_tmp()}]")
             if t_k0 != 1:
                 self._emit(f"s_lshl_b32 s[{s.s_out_stride_k0()}], s[{s.s_stride_hw()}], {igemm_log2(unmerge_sub_k1)}")
                 self._emit(f"s_lshl_b32 s[{s.s_wei_stride_k0()}], s[{s.s_c()}], {igemm_log2(unmerge_sub_k1)}")
@@ -1836,8 +1894,13 @@ class igemm_bwd_gtc_t(mc_base_t):
         fctrl.s_kitr                      = s.s_kitr
         fctrl.s_knum                      = s.s_knum
 
+        fctrl.scheduler                   = ir_scheduler_t(self.mc.arch_config) if self.mc.arch_config.schedule else None
+        fctrl.macro_table                 = self.get_kernel_macro_table() if self.mc.arch_config.schedule else None
+
         fma_main_loop = fma_main_loop_t(self.mc, fctrl)
         fma_main_loop.emit()
+        if fma_main_loop.stall_cycles:
+            _logger.info(f'{self.name()}: predicted stall cycles per main loop {fma_main_loop.stall_cycles[0]} -> {fma_main_loop.stall_cycles[1]}')
 
     def emit_kernel_epilogue(self):
         s = self.sgpr
@@ -1874,9 +1937,59 @@ class igemm_bwd_gtc_t(mc_base_t):
         self._emit('{}:'.format(kernel_name))
 
     def emit_kernel_body(self):
+        if self.recorded_body is not None:
+            self._emit_ir(self.recorded_body)
+            return
         self.emit_kernel_prologue()
         self.emit_kernel_fma_main_loop()
         self.emit_kernel_epilogue()
+
+    def get_symbol_table(self):
+        '''
+        name -> (kind, index, size) of sgpr/vgpr symbols. size is the allocation of sequencer,
+        or up to the next symbol for fixed ones
+        '''
+        table = dict()
+        for kind, gpr, seq in (('s', self.sgpr, self.sgpr.sseq), ('v', self.vgpr, self.vgpr.vseq)):
+            syms = {k : v.value for k, v in gpr.__dict__.items() if k.startswith(kind + '_')}
+            starts = sorted(set(syms.values()))
+            for k, value in syms.items():
+                following = [x for x in starts if x > value]
+                size = seq.get_step(value) or ((following[0] if following else value + 1) - value)
+                table[k] = (kind, value, size)
+        return table
+
+    def get_kernel_macro_table(self):
+        '''
+        ir_macro_table_t of every macro the kernel body may invoke
+        '''
+        macro_list = self.get_kernel_macros() + [macro_int_div_vv_t(self.mc), macro_int_div_vs_t(self.mc), macro_int_div_ss_t(self.mc),
+                macro_int_div_rem_vv_t(self.mc), macro_int_div_rem_vs_t(self.mc), macro_int_div_rem_ss_t(self.mc), macro_c_clear_t(self.mc),
+                macro_v_fma_mxn_t(self.mc, self.tunable.thread_sub_tile_m, self.tunable.thread_sub_tile_n, self.tunable.thread_tile_n)]
+        return ir_macro_table_t(macro_list)
+
+    def prepare_kernel_body(self):
+        '''
+        record the body once at the indent it is emitted, shrink vgpr by live range, and re-compute
+        s_waitcnt by dataflow. body is then emitted from the record, as the symbols are only .set in front of it.
+        the record is kept even without both, for analysis like kernel_manifest_get_entry()
+        '''
+        arch_config = self.mc.arch_config
+        if self.recorded_body is not None:
+            return
+        with self._indent_context():
+            with self._record_context():
+                self.emit_kernel_body()
+            recorded_body = self._get_recorded()
+        if arch_config.vgpr_alloc:
+            self.vgpr.allocate(recorded_body)
+        if arch_config.analytic_waitcnt:
+            waitcnt = ir_waitcnt_t(arch_config, self.get_kernel_macro_table(), self.get_symbol_table())
+            body = waitcnt(recorded_body)
+            self.waitcnt_stall = (waitcnt.predict_stall(recorded_body), waitcnt.predict_stall(body))
+            _logger.info(f'{self.name()}: analytic waitcnt, predicted wait cycles {self.waitcnt_stall[0]} -> {self.waitcnt_stall[1]}')
+            recorded_body = body
+        self.recorded_body = recorded_body
     def emit_kernel_end(self):
         self._emit('s_endpgm')
     def emit_kernel_footer(self):
@@ -0,0 +1,242 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+from __future__ import print_function
+import sys
+from ..codegen import *
+from .igemm_base import *
+from .igemm_bwd_gtc import *
+
+IGEMM_GTC_SWEEP_AUTO = 'auto'       # value of a list key, enumerate every thread/cluster lengths that fit the tile
+IGEMM_GTC_LDS_MAX = 65536
+
+IGEMM_GTC_TUNABLE_LIST_KEYS = ['tensor_a_thread_lengths', 'tensor_a_cluster_lengths',
+                               'tensor_b_thread_lengths', 'tensor_b_cluster_lengths']
+
+# keys are assigned in this order, so a constraint is checked as soon as all keys it needs are known
+IGEMM_GTC_SWEEP_ORDER = ['direction', 'precision', 'nxe', 'nxb',
+                         'gemm_m_unmerge_cluster', 'gemm_n_unmerge_cluster', 'gemm_k_unmerge_cluster',
+                         'gemm_m_per_block', 'gemm_n_per_block', 'gemm_k_per_block',
+                         'gemm_m_per_thread', 'gemm_m_level0_cluster', 'gemm_m_level1_cluster',
+                         'gemm_n_per_thread', 'gemm_n_level0_cluster', 'gemm_n_level1_cluster',
+                         'tensor_a_cluster_lengths', 'tensor_a_thread_lengths',
+                         'tensor_b_cluster_lengths', 'tensor_b_thread_lengths']
+
+IGEMM_GTC_SWEEP_OPTIONAL_KEYS = ['gemm_m_unmerge_cluster', 'gemm_n_unmerge_cluster', 'gemm_k_unmerge_cluster']
+
+def igemm_gtc_is_sweep_dict(tunable_dict):
+    '''
+    true if any key holds a range/list of choices instead of a single value
+    '''
+    for k, v in tunable_dict.items():
+        if k in IGEMM_GTC_TUNABLE_LIST_KEYS:
+            if v == IGEMM_GTC_SWEEP_AUTO:
+                return True
+        elif type(v) in (list, range):
+            return True
+    return False
+
+def _igemm_sweep_factorize(n, parts):
+    # every tuple of `parts` positive integers whose product is n
+    if parts == 1:
+        yield (n,)
+        return
+    for d in range(1, n + 1):
+        if n % d == 0:
+            for rest in _igemm_sweep_factorize(n // d, parts - 1):
+                yield (d,) + rest
+
+def _igemm_sweep_lds_total(d):
+    data_byte = amdgpu_precision_data_byte(d['precision'])
+    lds_a_np2 = igemm_next_pow2(data_byte * d['gemm_k_per_block'] * d['gemm_m_per_block'])
+    lds_b_np2 = igemm_next_pow2(data_byte * d['gemm_k_per_block'] * d['gemm_n_per_block'])
+    return 2 * igemm_next_pow2(lds_a_np2 + lds_b_np2)
+
+def _igemm_sweep_block_size(d):
+    return d['gemm_m_level0_cluster'] * d['gemm_m_level1_cluster'] * d['gemm_n_level0_cluster'] * d['gemm_n_level1_cluster']
+
+def _igemm_sweep_gemm_repeat(d, gemm):
+    return d[f'gemm_{gemm}_per_block'] // (d[f'gemm_{gemm}_per_thread'] * d[f'gemm_{gemm}_level0_cluster'] * d[f'gemm_{gemm}_level1_cluster'])
+
+def _igemm_sweep_coalescing_store_ok(d):
+    # igemm_coalescing_store_t only does 2x2 repeat, and block must cover gemm_n of a row at once.
+    # groups is same as igemm_gtc_tunable_parameter_t.coalescing_store_groups, with the divisibility igemm_bwd_gtc_t asserts
+    m, n, k = d['gemm_m_per_block'], d['gemm_n_per_block'], d['gemm_k_per_block']
+    if _igemm_sweep_gemm_repeat(d, 'm') != 2 or _igemm_sweep_gemm_repeat(d, 'n') != 2:
+        return False
+    if _igemm_sweep_block_size(d) % n != 0:
+        return False
+    groups = max(2, (m * n) // (2 * igemm_next_pow2(igemm_next_pow2(k * m) + igemm_next_pow2(k * n))))
+    return (2 * d['gemm_m_per_thread']) % igemm_next_pow2(groups) == 0
+
+def igemm_gtc_coalescing_store_index_ok(tunable_dict):
+    '''
+    _igemm_sweep_coalescing_store_ok() is necessary only, how m index of every group is strided depends on all
+    the lengths, so the ctrl igemm_bwd_gtc_t would build is asked to index them. needs a complete tunable dict
+    '''
+    return igemm_bwd_gtc_get_coalescing_store_ctrl(igemm_gtc_tunable_parameter_t(tunable_dict)).is_valid()
+
+def _igemm_sweep_lengths_ok(thread_lengths, cluster_lengths, gemm_k, gemm_x):
+    # K0xK1E of thread*cluster cover gemm_k, X0xX1 cover gemm_m (tensor a) or gemm_n (tensor b).
+    # every length is used as shift, and global load is 1d or 2d (igemm_bwd_gtc_t)
+    if len(thread_lengths) != 4 or len(cluster_lengths) != 4:
+        return False
+    if not all(igemm_is_pow2(l) for l in thread_lengths + cluster_lengths):
+        return False
+    if len([t for t in thread_lengths if t != 1]) not in (1, 2):
+        return False
+    if cluster_lengths[0] == 1 and cluster_lengths[1] == 1 or cluster_lengths[2] == 1 and cluster_lengths[3] == 1:
+        return False
+    return thread_lengths[0] * cluster_lengths[0] * thread_lengths[1] * cluster_lengths[1] == gemm_k and \
+            thread_lengths[2] * cluster_lengths[2] * thread_lengths[3] * cluster_lengths[3] == gemm_x
+
+def _igemm_sweep_unmerge_ok(d, x, unmerge_sub, thread_lengths, cluster_lengths):
+    # x0*x1 is unmerged from one dimension, same check as igemm_bwd_gtc_t.emit_kernel_prologue()
+    n_x0, n_x1 = thread_lengths[0] * cluster_lengths[0], thread_lengths[1] * cluster_lengths[1]
+    unmerge_cluster = d.get(f'gemm_{x}_unmerge_cluster', 0)
+    if unmerge_cluster == 0:
+        return unmerge_sub % n_x0 == 0 and n_x1 % (unmerge_sub // n_x0) == 0
+    if unmerge_cluster == 1:
+        return cluster_lengths[0] == 1 and cluster_lengths[1] != 1 and thread_lengths[0] != 1 and thread_lengths[1] == 1
+    return False
+
+def _igemm_sweep_tensor_a_ok(d):
+    t, c = d['tensor_a_thread_lengths'], d['tensor_a_cluster_lengths']
+    if d.get('gemm_m_unmerge_cluster', 0) == 1 and not (c[2] == 1 and c[3] != 1 and t[2] != 1 and t[3] == 1):
+        return False
+    k = d['gemm_k_per_block']
+    unmerge_sub_k = k // d['nxe'] if d['nxe'] != 0 and k % d['nxe'] == 0 else k
+    return _igemm_sweep_unmerge_ok(d, 'k', unmerge_sub_k, t[:2], c[:2])
+
+def _igemm_sweep_tensor_b_ok(d, key):
+    # gemm_k is shared, so K0xK1E of tensor b must be the same as tensor a
+    return d[key][:2] == d[key.replace('tensor_b', 'tensor_a')][:2]
+
+IGEMM_GTC_SWEEP_CHECKS = {
+    'direction'             : lambda d: d['direction'] in ('fwd', 'bwd', 'wrw'),
+    'precision'             : lambda d: d['precision'] in ('fp32', 'fp16', 'bf16'),
+    'nxe'                   : lambda d: d['nxe'] in (0, 1),
+    'nxb'                   : lambda d: d['nxb'] in (1, 4, 16, 64, 256),
+    'gemm_n_per_block'      : lambda d: d['direction'] == 'wrw' or d['gemm_n_per_block'] % d['nxb'] == 0,
+    'gemm_k_per_block'      : lambda d: _igemm_sweep_lds_total(d) <= IGEMM_GTC_LDS_MAX,
+    'gemm_m_level1_cluster' : lambda d: d['gemm_m_per_block'] % (d['gemm_m_per_thread'] * d['gemm_m_level0_cluster'] * d['gemm_m_level1_cluster']) == 0,
+    'gemm_n_level1_cluster' : lambda d: d['gemm_n_per_block'] % (d['gemm_n_per_thread'] * d['gemm_n_level0_cluster'] * d['gemm_n_level1_cluster']) == 0 and \
+                                        _igemm_sweep_coalescing_store_ok(d),
+    'tensor_a_cluster_lengths' : lambda d: igemm_flatten_list_product(d['tensor_a_cluster_lengths']) == _igemm_sweep_block_size(d),
+    'tensor_a_thread_lengths'  : lambda d: _igemm_sweep_lengths_ok(d['tensor_a_thread_lengths'], d['tensor_a_cluster_lengths'],
+                                        d['gemm_k_per_block'], d['gemm_m_per_block']) and _igemm_sweep_tensor_a_ok(d),
+    'tensor_b_cluster_lengths' : lambda d: igemm_flatten_list_product(d['tensor_b_cluster_lengths']) == _igemm_sweep_block_size(d) and \
+                                        _igemm_sweep_tensor_b_ok(d, 'tensor_b_cluster_lengths'),
+    'tensor_b_thread_lengths'  : lambda d: _igemm_sweep_lengths_ok(d['tensor_b_thread_lengths'], d['tensor_b_cluster_lengths'],
+                                        d['gemm_k_per_block'], d['gemm_n_per_block']) and \
+                                        _igemm_sweep_tensor_b_ok(d, 'tensor_b_thread_lengths') and \
+                                        (d['direction'] == 'wrw' or _igemm_sweep_unmerge_ok(d, 'n', d['gemm_n_per_block'] // d['nxb'],
+                                            d['tensor_b_thread_lengths'][2:], d['tensor_b_cluster_lengths'][2:])),
+}
+
+def igemm_gtc_is_valid_tunable_dict(tunable_dict):
+    '''
+    every sweep constraint on one complete tunable dict. checked in sweep order, a later check relies on earlier ones
+    '''
+    return all(IGEMM_GTC_SWEEP_CHECKS[k](tunable_dict) for k in IGEMM_GTC_SWEEP_ORDER if k in IGEMM_GTC_SWEEP_CHECKS) and \
+            igemm_gtc_coalescing_store_index_ok(tunable_dict)
+
+class igemm_gtc_tunable_sweep_t(object):
+    '''
+    tuning space of one config section. any scalar key may be a list or a range (start, end, step),
+    thread/cluster lengths may be 'auto'. iterating it expands the cartesian product lazily, depth first
+    in IGEMM_GTC_SWEEP_ORDER, and drops a branch as soon as a constraint of igemm_gtc_tunable_parameter_t
+    or igemm_bwd_gtc_t fails, so invalid points are never built and nothing is kept in memory. a complete point
+    is kept only if its coalescing store can be indexed
+    '''
+    def __init__(self, sweep_dict):
+        for k in IGEMM_GTC_SWEEP_ORDER:
+            assert k in sweep_dict or k in IGEMM_GTC_SWEEP_OPTIONAL_KEYS, f"missing key {k} in sweep of {sweep_dict.get('name', '')}"
+        self.sweep_dict = sweep_dict
+        self.keys = [k for k in IGEMM_GTC_SWEEP_ORDER if k in sweep_dict] + [k for k in sweep_dict if k not in IGEMM_GTC_SWEEP_ORDER]
+
+    def get_choices(self, key, d):
+        value = self.sweep_dict[key]
+        if key in IGEMM_GTC_TUNABLE_LIST_KEYS:
+            if value != IGEMM_GTC_SWEEP_AUTO:
+                return [value]
+            # only the layout igemm_bwd_gtc_t implements: cluster is 1xK1Ex1xX1, thread is K0xK1ExX0x1,
+            # and K0xK1E of tensor b is taken from tensor a
+            gemm_k = d['gemm_k_per_block']
+            gemm_x = d['gemm_m_per_block'] if key.startswith('tensor_a') else d['gemm_n_per_block']
+            if key.endswith('_cluster_lengths'):
+                if key.startswith('tensor_b'):
+                    c_k1e = d['tensor_a_cluster_lengths'][1]
+                    return [[1, c_k1e, 1, _igemm_sweep_block_size(d) // c_k1e]]
+                return [[1, c_k1e, 1, c_x1] for c_k1e, c_x1 in _igemm_sweep_factorize(_igemm_sweep_block_size(d), 2)
+                            if gemm_k % c_k1e == 0 and gemm_x % c_x1 == 0]
+            c = d[key.replace('_thread_', '_cluster_')]
+            if key.startswith('tensor_b'):
+                t = d['tensor_a_thread_lengths']
+                return [[t[0], t[1], gemm_x // (c[2] * c[3]), 1]]
+            return [[t_k0, t_k1e, gemm_x // (c[2] * c[3]), 1] for t_k0, t_k1e in _igemm_sweep_factorize(gemm_k // (c[0] * c[1]), 2)]
+        if type(value) in (list, range):
+            return value
+        return [value]
+
+    def size(self):
+        '''
+        number of points before pruning, 'auto' lengths count as 1
+        '''
+        n = 1
+        for k in self.keys:
+            v = self.sweep_dict[k]
+            if k not in IGEMM_GTC_TUNABLE_LIST_KEYS and type(v) in (list, range):
+                n *= len(v)
+        return n
+
+    def __iter__(self):
+        def expand(i, d):
+            if i == len(self.keys):
+                if igemm_gtc_coalescing_store_index_ok(d):
+                    yield dict(d)
+                return
+            key = self.keys[i]
+            check = IGEMM_GTC_SWEEP_CHECKS.get(key)
+            for value in self.get_choices(key, d):
+                d[key] = value
+                if check is None or check(d):
+                    yield from expand(i + 1, d)
+            d.pop(key, None)
+        return expand(0, dict())
+
+    def get_tunables(self):
+        for tunable_dict in self:
+            yield igemm_gtc_tunable_parameter_t(tunable_dict)
+
+def igemm_gtc_expand_tunable_dicts(tunable_dicts):
+    '''
+    generator of tunable dict, every section with list/range/'auto' is expanded, others pass through unchanged
+    '''
+    for tunable_dict in tunable_dicts:
+        if igemm_gtc_is_sweep_dict(tunable_dict):
+            yield from igemm_gtc_tunable_sweep_t(tunable_dict)
+        else:
+            yield tunable_dict
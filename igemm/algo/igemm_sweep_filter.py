@@ -0,0 +1,172 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+from ..codegen import *
+from .igemm_base import *
+from .igemm_bwd_gtc import *
+from .igemm_sweep import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None   # batched filter is not available, igemm_gtc_tunable_sweep_t still works one by one
+
+IGEMM_GTC_CANDIDATE_FIELDS = [
+    ('direction', 'U3'), ('precision', 'U4'), ('nxb', 'i4'), ('nxe', 'i4'),
+    ('gemm_m_unmerge_cluster', 'i4'), ('gemm_n_unmerge_cluster', 'i4'), ('gemm_k_unmerge_cluster', 'i4'),
+    ('gemm_m_per_block', 'i4'), ('gemm_n_per_block', 'i4'), ('gemm_k_per_block', 'i4'),
+    ('gemm_m_per_thread', 'i4'), ('gemm_m_level0_cluster', 'i4'), ('gemm_m_level1_cluster', 'i4'),
+    ('gemm_n_per_thread', 'i4'), ('gemm_n_level0_cluster', 'i4'), ('gemm_n_level1_cluster', 'i4'),
+    ('tensor_a_thread_lengths', 'i4', (4,)), ('tensor_a_cluster_lengths', 'i4', (4,)),
+    ('tensor_b_thread_lengths', 'i4', (4,)), ('tensor_b_cluster_lengths', 'i4', (4,))]
+
+IGEMM_GTC_CANDIDATE_RESOURCE_FIELDS = [
+    ('block_size', 'i4'), ('gemm_m_repeat', 'i4'), ('gemm_n_repeat', 'i4'),
+    ('num_vgpr_accumulate_c', 'i4'), ('num_vgpr_accumulate_a', 'i4'), ('num_vgpr_accumulate_b', 'i4'),
+    ('num_vgpr_global_load_a', 'i4'), ('num_vgpr_global_load_b', 'i4'),
+    ('lds_total', 'i4'), ('coalescing_store_groups', 'i4'),
+    ('vgpr', 'i4')]          # count of igemm_bwd_gtc_t.kernel_vgpr_t before live range allocation, an upper bound
+
+def igemm_gtc_candidate_dtype():
+    assert np is not None, 'numpy is needed for batched candidate filter'
+    return np.dtype(IGEMM_GTC_CANDIDATE_FIELDS)
+
+def igemm_gtc_candidates_from_dicts(tunable_dicts, count = -1):
+    '''
+    structured array, one row per tunable dict. tunable_dicts can be a generator (e.g. igemm_gtc_tunable_sweep_t),
+    count is the number of rows to take, -1 for all
+    '''
+    dtype = igemm_gtc_candidate_dtype()
+    def to_row(td):
+        return tuple(td.get(f[0], 0) for f in IGEMM_GTC_CANDIDATE_FIELDS)
+    return np.fromiter((to_row(td) for td in tunable_dicts), dtype = dtype, count = count)
+
+def igemm_gtc_candidate_to_dict(candidate):
+    tunable_dict = {'name' : f"igemm_{candidate['direction']}_gtc"}
+    for f in IGEMM_GTC_CANDIDATE_FIELDS:
+        value = candidate[f[0]]
+        tunable_dict[f[0]] = value.tolist() if len(f) == 3 else value.item()
+    return tunable_dict
+
+def _np_next_pow2(x):
+    x = np.maximum(x, 1).astype(np.int64)
+    return np.left_shift(1, np.ceil(np.log2(x)).astype(np.int64))
+
+def _np_is_pow2(x):
+    return (x > 0) & ((x & (x - 1)) == 0)
+
+def _np_div(a, b):
+    # floor division that never divides by 0, rows with b <= 0 are invalid anyway
+    return a // np.maximum(b, 1)
+
+def _np_mod(a, b):
+    return np.where(b > 0, a % np.maximum(b, 1), 1)
+
+def _np_lengths_ok(t, c, gemm_k, gemm_x):
+    # same as _igemm_sweep_lengths_ok()
+    ok = np.all(_np_is_pow2(t), axis = 1) & np.all(_np_is_pow2(c), axis = 1)
+    ok &= np.isin(np.count_nonzero(t != 1, axis = 1), (1, 2))
+    ok &= ~((c[:, 0] == 1) & (c[:, 1] == 1)) & ~((c[:, 2] == 1) & (c[:, 3] == 1))
+    ok &= (t[:, 0] * c[:, 0] * t[:, 1] * c[:, 1] == gemm_k) & (t[:, 2] * c[:, 2] * t[:, 3] * c[:, 3] == gemm_x)
+    return ok
+
+def _np_unmerge_ok(unmerge_cluster, unmerge_sub, t, c):
+    # same as _igemm_sweep_unmerge_ok(), t/c are the 2 columns unmerged from one dimension
+    n_x0, n_x1 = t[:, 0] * c[:, 0], t[:, 1] * c[:, 1]
+    ok_0 = (_np_mod(unmerge_sub, n_x0) == 0) & (_np_mod(n_x1, _np_div(unmerge_sub, n_x0)) == 0)
+    ok_1 = (c[:, 0] == 1) & (c[:, 1] != 1) & (t[:, 0] != 1) & (t[:, 1] == 1)
+    return np.where(unmerge_cluster == 0, ok_0, np.where(unmerge_cluster == 1, ok_1, False))
+
+def _np_kernel_vgpr_count(candidates, ok, res):
+    # linear count of igemm_bwd_gtc_t.kernel_vgpr_t, it only depends on nxe and the buffer sizes,
+    # so one kernel is built for every distinct set of them among valid rows
+    keys = np.stack([candidates['nxe'], res['num_vgpr_accumulate_c'], res['num_vgpr_accumulate_a'], res['num_vgpr_accumulate_b'],
+                res['num_vgpr_global_load_a'], res['num_vgpr_global_load_b']], axis = 1)
+    count = np.zeros(len(candidates), dtype = np.int32)
+    rows = np.flatnonzero(ok)
+    if len(rows) == 0:
+        return count
+    unique_keys, first, inverse = np.unique(keys[rows], axis = 0, return_index = True, return_inverse = True)
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t(None))
+    unique_count = np.array([igemm_bwd_gtc_t(mc, igemm_gtc_tunable_parameter_t(igemm_gtc_candidate_to_dict(candidates[rows[i]]))).vgpr.get_count()
+                for i in first])
+    count[rows] = unique_count[inverse.reshape(-1)]
+    return count
+
+def igemm_gtc_validate_candidates(candidates):
+    '''
+    vectorized igemm_gtc_is_valid_tunable_dict() over a structured array of igemm_gtc_candidate_dtype().
+    return (valid mask, resources), resources is a structured array of IGEMM_GTC_CANDIDATE_RESOURCE_FIELDS,
+    computed the same way as igemm_gtc_tunable_parameter_t (vgpr by kernel_vgpr_t of igemm_bwd_gtc_t), and only
+    meaningful for valid rows
+    '''
+    # fields of structured array are strided views, every column is copied once to be contiguous
+    c = {f[0] : np.ascontiguousarray(candidates[f[0]]) for f in IGEMM_GTC_CANDIDATE_FIELDS}
+    m, n, k = c['gemm_m_per_block'].astype(np.int64), c['gemm_n_per_block'].astype(np.int64), c['gemm_k_per_block'].astype(np.int64)
+    nxb, nxe = c['nxb'], c['nxe']
+    ta, ca = c['tensor_a_thread_lengths'], c['tensor_a_cluster_lengths']
+    tb, cb = c['tensor_b_thread_lengths'], c['tensor_b_cluster_lengths']
+    not_wrw = c['direction'] != 'wrw'
+
+    res = np.zeros(len(candidates), dtype = IGEMM_GTC_CANDIDATE_RESOURCE_FIELDS)
+    block_size = c['gemm_m_level0_cluster'] * c['gemm_m_level1_cluster'] * c['gemm_n_level0_cluster'] * c['gemm_n_level1_cluster']
+    m_per_level = c['gemm_m_per_thread'] * c['gemm_m_level0_cluster'] * c['gemm_m_level1_cluster']
+    n_per_level = c['gemm_n_per_thread'] * c['gemm_n_level0_cluster'] * c['gemm_n_level1_cluster']
+    res['block_size'] = block_size
+    res['gemm_m_repeat'] = _np_div(m, m_per_level)
+    res['gemm_n_repeat'] = _np_div(n, n_per_level)
+    thread_tile_m = res['gemm_m_repeat'] * c['gemm_m_per_thread']
+    thread_tile_n = res['gemm_n_repeat'] * c['gemm_n_per_thread']
+    res['num_vgpr_accumulate_c'] = thread_tile_m * thread_tile_n
+    res['num_vgpr_accumulate_a'] = thread_tile_m
+    res['num_vgpr_accumulate_b'] = thread_tile_n
+    res['num_vgpr_global_load_a'] = np.prod(ta, axis = 1)
+    res['num_vgpr_global_load_b'] = np.prod(tb, axis = 1)
+    data_byte = np.where(c['precision'] == 'fp32', 4, 2)
+    lds_single = _np_next_pow2(_np_next_pow2(data_byte * k * m) + _np_next_pow2(data_byte * k * n))
+    res['lds_total'] = 2 * lds_single
+    res['coalescing_store_groups'] = np.maximum(2, (m * n) // (2 * _np_next_pow2(_np_next_pow2(k * m) + _np_next_pow2(k * n))))
+
+    ok = np.isin(c['direction'], ('fwd', 'bwd', 'wrw')) & np.isin(c['precision'], ('fp32', 'fp16', 'bf16'))
+    ok &= np.isin(nxe, (0, 1)) & np.isin(nxb, (1, 4, 16, 64, 256))
+    ok &= ~not_wrw | (_np_mod(n, nxb) == 0)
+    ok &= res['lds_total'] <= IGEMM_GTC_LDS_MAX
+    ok &= (_np_mod(m, m_per_level) == 0) & (_np_mod(n, n_per_level) == 0)
+    ok &= (res['gemm_m_repeat'] == 2) & (res['gemm_n_repeat'] == 2) & (_np_mod(block_size, n) == 0)
+    ok &= _np_mod(2 * c['gemm_m_per_thread'], _np_next_pow2(res['coalescing_store_groups'])) == 0
+    ok &= (np.prod(ca, axis = 1) == block_size) & (np.prod(cb, axis = 1) == block_size)
+    ok &= _np_lengths_ok(ta, ca, k, m) & _np_lengths_ok(tb, cb, k, n)
+    ok &= np.all(ta[:, :2] == tb[:, :2], axis = 1) & np.all(ca[:, :2] == cb[:, :2], axis = 1)
+    m_unmerge_ok = (ca[:, 2] == 1) & (ca[:, 3] != 1) & (ta[:, 2] != 1) & (ta[:, 3] == 1)
+    ok &= (c['gemm_m_unmerge_cluster'] != 1) | m_unmerge_ok
+    unmerge_sub_k = np.where((nxe != 0) & (_np_mod(k, nxe) == 0), _np_div(k, nxe), k)
+    ok &= _np_unmerge_ok(c['gemm_k_unmerge_cluster'], unmerge_sub_k, ta[:, :2], ca[:, :2])
+    ok &= ~not_wrw | _np_unmerge_ok(c['gemm_n_unmerge_cluster'], _np_div(n, nxb), tb[:, 2:], cb[:, 2:])
+    # coalescing store index can't be vectorized, only rows left are asked, same as igemm_gtc_tunable_sweep_t
+    for i in np.flatnonzero(ok):
+        ok[i] = igemm_gtc_coalescing_store_index_ok(igemm_gtc_candidate_to_dict(candidates[i]))
+    res['vgpr'] = _np_kernel_vgpr_count(candidates, ok, res)
+    return ok, res
@@ -556,6 +556,7 @@ class ctrl_2d_shared_store_t(object):
         self.src_order = 0  # 0-d0,d1, 1-d1,d0
 
 class macro_igemm_2d_shared_store_t(mc_base_t):
+    issues_cache = dict()
     def __init__(self, mc, ctrl):
         assert type(ctrl) is ctrl_2d_shared_store_t
         mc_base_t.__init__(self, mc)
@@ -586,40 +587,52 @@ class macro_igemm_2d_shared_store_t(mc_base_t):
 
     def __call__(self, v_src, v_sst_os):
         return '{} {}, {}'.format(self.name(), v_src, v_sst_os)
-    def emit(self):
+    def get_ds_writes(self):
+        '''
+        (ds_write instruction, source offset, lds offset, issues) of every write of this macro, in emit order.
+        both emit() and get_issues() walk this, so the counted issues are the emitted ones
+        '''
         ctrl = self.ctrl
         # assert ctrl.length_d1 == ctrl.vector_d1
         assert ctrl.precision == 'fp32', "TO BE supported"
-        
+        if ctrl.src_order != 0:
+            return      # unimplemented, nothing emitted for this order yet
+        if ctrl.length_d1 == ctrl.vector_d1:
+            ds_write = inst_ds_write_t(ctrl.vector_d1 * 4)
+            for i_d0 in range(ctrl.length_d0):
+                yield ds_write, i_d0 * ctrl.vector_d1, i_d0 * ctrl.stride_d0, ds_write.get_issues()
+        else:
+            assert ctrl.length_d1 % ctrl.vector_d1 == 0
+            assert ctrl.stride_d1 != 1
+            num_vector_d1 = ctrl.length_d1 // ctrl.vector_d1
+            ds_write2 = inst_ds_write2_likely_t(self.mc, 2, ctrl.vector_d1 * 4, ctrl.stride_d1)
+            for i_d0 in range(ctrl.length_d0):
+                for i_d1 in range(num_vector_d1 // 2):
+                    i_offset = i_d0 * ctrl.stride_d0 + 2* i_d1 * ctrl.stride_d1
+                    yield ds_write2, (i_d0 * ctrl.length_d1 + 2*i_d1)*ctrl.vector_d1, i_offset, ds_write2.get_issues(i_offset)
+
+    def emit(self):
         issue_cnt = 0
         with self._emit_macro_indented('.macro {} v_src, v_sst_os'.format(self.name())):
-            if ctrl.length_d1 == ctrl.vector_d1:
-                ds_write = inst_ds_write_t(ctrl.vector_d1 * 4)
-                if ctrl.src_order == 0:
-                    for i_d0 in range(ctrl.length_d0):
-                        self._emit(ds_write('\\v_sst_os', f'\\v_src+{i_d0*ctrl.vector_d1}', i_d0 * ctrl.stride_d0))
-                        issue_cnt += ds_write.get_issues()
-                else:
-                    assert "unimplemented"
-            else:
-                assert ctrl.length_d1 % ctrl.vector_d1 == 0
-                assert ctrl.stride_d1 != 1
-                num_vector_d1 = ctrl.length_d1 // ctrl.vector_d1
-                ds_write2 = inst_ds_write2_likely_t(self.mc, 2, ctrl.vector_d1 * 4, ctrl.stride_d1)
-                if ctrl.src_order == 0:
-                    for i_d0 in range(ctrl.length_d0):
-                        for i_d1 in range(num_vector_d1 // 2):
-                            i_offset = i_d0 * ctrl.stride_d0 + 2* i_d1 * ctrl.stride_d1
-                            self._emit(ds_write2('\\v_sst_os',
-                                    f'\\v_src+{(i_d0 * ctrl.length_d1 + 2*i_d1)*ctrl.vector_d1}',
-                                    i_offset))
-                            issue_cnt += ds_write2.get_issues(i_offset)
-                else:
-                    assert "unimplemented"
+            for ds_write, i_src, i_offset, issues in self.get_ds_writes():
+                self._emit(ds_write('\\v_sst_os', f'\\v_src+{i_src}', i_offset))
+                issue_cnt += issues
         self.issue_cnt = issue_cnt
     def get_issues(self):
-        #assert False, "tobe implemented"
-        #return self.ctrl.length_d0
-        with self._deferred_context():
-            self.emit()
-        return self.issue_cnt
+        '''
+        count ds_write issued by this macro from ctrl, without emitting the body.
+        memoized per ctrl signature, since every kernel rebuild the same ctrl many times.
+        ctrl emit() can't handle is still rejected, even if the signature is cached
+        '''
+        ctrl = self.ctrl
+        assert ctrl.precision == 'fp32', "TO BE supported"
+        if ctrl.length_d1 != ctrl.vector_d1:
+            assert ctrl.length_d1 % ctrl.vector_d1 == 0
+            assert ctrl.stride_d1 != 1
+        key = macro_cache_signature(ctrl)
+        if key not in self.issues_cache:
+            self.issues_cache[key] = sum(issues for _, _, _, issues in self.get_ds_writes())
+        return self.issues_cache[key]
+    def get_num_vgpr(self):
+        ''' number of source vgpr read by this macro '''
+        return self.ctrl.length_d0 * self.ctrl.length_d1
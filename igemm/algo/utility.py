@@ -213,6 +213,7 @@ class macro_c_clear_t(mc_base_t):
 class gpr_sequencer_t(object):
     def __init__(self, cnt = 0):
         self.cnt = cnt
+        self.steps = dict()     # start -> step, of every non-empty allocation
     def __call__(self, step = 0, alignment = 0):
         previous_cnt = self.cnt
         if alignment:
@@ -220,9 +221,13 @@ class gpr_sequencer_t(object):
             self.cnt = aligned_cnt
             previous_cnt = aligned_cnt
         self.cnt += step
+        if step:
+            self.steps[previous_cnt] = step
         return previous_cnt
     def get(self):
         return self.cnt
+    def get_step(self, start):
+        return self.steps.get(start, 0)
 
 class sym_t(object):
     '''
@@ -26,4 +26,15 @@
 from .compile import *
 from .config_parser import *
 from .amdgpu import *
-from .mc import *
\ No newline at end of file
+from .node import *
+from .mc import *
+from .profiler import *
+from .build_cache import *
+from .macro_cache import *
+from .scheduler import *
+from .gpr_alloc import *
+from .waitcnt import *
+from .emulator import *
+from .emulator_observer import *
+from .lds_bank import *
+from .gmem_coalescing import *
\ No newline at end of file
@@ -140,18 +140,64 @@ class amdgpu_arch_detail_t(object):
     def theoretical_bandwidth_gbps(self):
         return (self.mclk_mhz / 1000) * (self.memory_bus_width_bits / 8) * self.memory_op_per_cycle
 
-def amdgpu_calculate_occupancy(arch_detail, vgpr_per_thread, block_size, lds_per_block):
-    vgpr_per_block = vgpr_per_thread * block_size
-    if vgpr_per_block > arch_detail.vgpr_per_cu:
-        print('vgpr required:{} is larger than hw vgpr:{}'.format(vgpr_per_block, arch_detail.vgpr_per_cu))
-        return 0
-    blocks_consider_vgpr = arch_detail.vgpr_per_cu // vgpr_per_block
-    if lds_per_block > arch_detail.lds_size:
-        print('lds required:{} is larger than hw vgpr:{}'.format(lds_per_block, arch_detail.lds_size))
-        return 0
-    blocks_consider_lds = arch_detail.lds_size // lds_per_block
-
-    return min(blocks_consider_vgpr, blocks_consider_lds)
+AMDGPU_SIMD_PER_CU          = 4
+AMDGPU_VGPR_GRANULARITY     = 4
+AMDGPU_SGPR_GRANULARITY     = 16
+AMDGPU_LDS_GRANULARITY      = 512       # in byte
+
+AMDGPU_OCCUPANCY_LIMIT_VGPR     = 'vgpr'
+AMDGPU_OCCUPANCY_LIMIT_SGPR     = 'sgpr'
+AMDGPU_OCCUPANCY_LIMIT_LDS      = 'lds'
+AMDGPU_OCCUPANCY_LIMIT_WAVES    = 'waves'   # hardware max waves per cu
+
+def _amdgpu_round_up(x, granularity):
+    return (x + granularity - 1) // granularity * granularity
+
+def amdgpu_waves_per_block(arch_detail, block_size):
+    return (block_size + arch_detail.wavefront_size - 1) // arch_detail.wavefront_size
+
+def amdgpu_occupancy_limits(arch_detail, vgpr_per_thread, block_size, lds_per_block, sgpr_per_wave = 0):
+    '''
+    resource -> max workgroups per cu it allows. vgpr/sgpr are allocated per simd in granularity, and waves of a
+    workgroup are spread over simds of a cu. sgpr or lds of 0 is not a limit
+    '''
+    ad = arch_detail
+    waves_per_block = amdgpu_waves_per_block(ad, block_size)
+    vgpr_per_simd = ad.vgpr_per_cu // (AMDGPU_SIMD_PER_CU * ad.wavefront_size)
+    limits = dict()
+    limits[AMDGPU_OCCUPANCY_LIMIT_VGPR] = vgpr_per_simd // _amdgpu_round_up(vgpr_per_thread, AMDGPU_VGPR_GRANULARITY) * \
+                                            AMDGPU_SIMD_PER_CU // waves_per_block
+    if sgpr_per_wave != 0:
+        sgpr_per_simd = ad.sgpr_per_cu // AMDGPU_SIMD_PER_CU
+        limits[AMDGPU_OCCUPANCY_LIMIT_SGPR] = sgpr_per_simd // _amdgpu_round_up(sgpr_per_wave, AMDGPU_SGPR_GRANULARITY) * \
+                                            AMDGPU_SIMD_PER_CU // waves_per_block
+    if lds_per_block != 0:
+        limits[AMDGPU_OCCUPANCY_LIMIT_LDS] = ad.lds_size // _amdgpu_round_up(lds_per_block, AMDGPU_LDS_GRANULARITY)
+    limits[AMDGPU_OCCUPANCY_LIMIT_WAVES] = ad.max_waves_per_cu // waves_per_block
+    return limits
+
+def amdgpu_calculate_occupancy(arch_detail, vgpr_per_thread, block_size, lds_per_block, sgpr_per_wave = 0):
+    '''
+    max workgroups per cu
+    '''
+    return min(amdgpu_occupancy_limits(arch_detail, vgpr_per_thread, block_size, lds_per_block, sgpr_per_wave).values())
+
+def amdgpu_occupancy_max_resource(arch_detail, resource, block_size, blocks_per_cu):
+    '''
+    most vgpr per thread, sgpr per wave or lds per workgroup that still allows blocks_per_cu workgroups per cu.
+    inverse of amdgpu_occupancy_limits()
+    '''
+    ad = arch_detail
+    waves_per_simd = (blocks_per_cu * amdgpu_waves_per_block(ad, block_size) + AMDGPU_SIMD_PER_CU - 1) // AMDGPU_SIMD_PER_CU
+    if resource == AMDGPU_OCCUPANCY_LIMIT_VGPR:
+        vgpr_per_simd = ad.vgpr_per_cu // (AMDGPU_SIMD_PER_CU * ad.wavefront_size)
+        return vgpr_per_simd // waves_per_simd // AMDGPU_VGPR_GRANULARITY * AMDGPU_VGPR_GRANULARITY
+    if resource == AMDGPU_OCCUPANCY_LIMIT_SGPR:
+        sgpr_per_simd = ad.sgpr_per_cu // AMDGPU_SIMD_PER_CU
+        return sgpr_per_simd // waves_per_simd // AMDGPU_SGPR_GRANULARITY * AMDGPU_SGPR_GRANULARITY
+    if resource == AMDGPU_OCCUPANCY_LIMIT_LDS:
+        return ad.lds_size // blocks_per_cu // AMDGPU_LDS_GRANULARITY * AMDGPU_LDS_GRANULARITY
+    assert False, f'no amount of {resource} to free'
 
 def amdgpu_valid_occupancy_with_max_waves(arch_detail, block_size, occupancy):
     assert block_size >= arch_detail.wavefront_size and \
@@ -181,6 +227,59 @@ def amdgpu_get_gfx906_60cu():
     gfx906_60cu.memory_bus_width_bits = 4096
     return gfx906_60cu
 
+def amdgpu_get_gfx900_64cu():
+    gfx900_64cu = amdgpu_arch_detail_t()
+    gfx900_64cu.arch            = AMDGPU_ARCH_GFX900
+    gfx900_64cu.num_cu          = 64
+    gfx900_64cu.simd_per_cu     = 64
+    gfx900_64cu.sclk_mhz        = 1546
+    gfx900_64cu.mclk_mhz        = 945
+    gfx900_64cu.lds_size        = 65536
+    gfx900_64cu.lds_banks       = 32
+    gfx900_64cu.l1_size         = 16384
+    gfx900_64cu.l2_size         = 0
+    gfx900_64cu.mem_channels    = 0
+    gfx900_64cu.vgpr_per_cu     = 65536
+    gfx900_64cu.sgpr_per_cu     = 3200
+    gfx900_64cu.agpr_per_cu     = 0
+    gfx900_64cu.wavefront_size      = 64
+    gfx900_64cu.max_waves_per_cu    = 40
+    gfx900_64cu.fp32_fma_per_cycle  = 2
+    gfx900_64cu.memory_op_per_cycle = 2     # read write
+    gfx900_64cu.memory_bus_width_bits = 2048
+    return gfx900_64cu
+
+def amdgpu_get_gfx908_120cu():
+    gfx908_120cu = amdgpu_arch_detail_t()
+    gfx908_120cu.arch            = AMDGPU_ARCH_GFX908
+    gfx908_120cu.num_cu          = 120
+    gfx908_120cu.simd_per_cu     = 64
+    gfx908_120cu.sclk_mhz        = 1502
+    gfx908_120cu.mclk_mhz        = 1200
+    gfx908_120cu.lds_size        = 65536
+    gfx908_120cu.lds_banks       = 32
+    gfx908_120cu.l1_size         = 16384
+    gfx908_120cu.l2_size         = 0
+    gfx908_120cu.mem_channels    = 0
+    gfx908_120cu.vgpr_per_cu     = 65536
+    gfx908_120cu.sgpr_per_cu     = 3200
+    gfx908_120cu.agpr_per_cu     = 65536
+    gfx908_120cu.wavefront_size      = 64
+    gfx908_120cu.max_waves_per_cu    = 40
+    gfx908_120cu.fp32_fma_per_cycle  = 2
+    gfx908_120cu.memory_op_per_cycle = 2     # read write
+    gfx908_120cu.memory_bus_width_bits = 4096
+    return gfx908_120cu
+
+def amdgpu_get_arch_detail(arch):
+    if arch == AMDGPU_ARCH_GFX900:
+        return amdgpu_get_gfx900_64cu()
+    if arch == AMDGPU_ARCH_GFX906:
+        return amdgpu_get_gfx906_60cu()
+    if arch == AMDGPU_ARCH_GFX908:
+        return amdgpu_get_gfx908_120cu()
+    assert False
+
 class amdgpu_arch_config_t(object):
     '''
     config some of arch related feature
@@ -192,6 +291,9 @@ class amdgpu_arch_config_t(object):
         self.use_xdlops     = ad('use_sdlops', False)
         self.data_type      = ad('data_type', AMDGPU_PRECISION_FP32)
         self.code_object    = ad('code_object', AMDGPU_CODEOBJECT_V3)
+        self.schedule       = ad('schedule', False)     # latency-aware schedule of fma main loop
+        self.vgpr_alloc     = ad('vgpr_alloc', True)    # live range vgpr allocation, instead of linear layout
+        self.analytic_waitcnt = ad('analytic_waitcnt', True)    # s_waitcnt from dataflow, instead of hand written ones
 
 class amdgpu_kernel_code_t(object):
     '''
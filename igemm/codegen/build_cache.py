@@ -0,0 +1,145 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+import os
+import shutil
+import hashlib
+import tempfile
+
+BUILD_CACHE_DIR = '.igemm_cache'
+
+def build_cache_hash_file(file_name):
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def build_cache_hash_source_tree(root_dir, exts = ('.py',)):
+    '''
+    hash of every source file under root_dir, file path relative to root is part of the hash
+    '''
+    h = hashlib.sha1()
+    for cur_dir, dirs, files in os.walk(root_dir):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for f in sorted(files):
+            if os.path.splitext(f)[1] not in exts:
+                continue
+            file_name = os.path.join(cur_dir, f)
+            h.update(os.path.relpath(file_name, root_dir).encode('utf-8'))
+            h.update(build_cache_hash_file(file_name).encode('utf-8'))
+    return h.hexdigest()
+
+_build_cache_generator_hash = None
+def build_cache_generator_hash():
+    '''
+    hash of the python generator itself, any change of generator source invalidates all generated kernels
+    '''
+    global _build_cache_generator_hash
+    if _build_cache_generator_hash is None:
+        igemm_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        _build_cache_generator_hash = build_cache_hash_source_tree(igemm_dir)
+    return _build_cache_generator_hash
+
+class build_cache_t(object):
+    '''
+    content addressed cache. each entry is a directory named by sha1 of the key,
+    key is built from anything that affects the result (source content, flags, generator hash...)
+    '''
+    def __init__(self, cache_dir = BUILD_CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.hit = 0
+        self.miss = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_key(self, *items):
+        h = hashlib.sha1()
+        for item in items:
+            h.update(repr(item).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def get_entry(self, key, name):
+        return os.path.join(self.cache_dir, key[:2], key, name)
+
+    def _store(self, key, name, write_func):
+        entry = self.get_entry(key, name)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # write to temp file then rename, so concurrent builders never see a partial entry
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(entry))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_func(f)
+            os.replace(tmp_name, entry)
+        except BaseException:
+            os.remove(tmp_name)
+            raise
+        return entry
+
+    def exists(self, key, name = 'text'):
+        '''
+        probe without counting hit/miss, for entries stored next to a main one
+        '''
+        return os.path.exists(self.get_entry(key, name))
+
+    def load_text(self, key, name = 'text', count = True):
+        '''
+        count False for an entry that goes with a main one, only the main lookup is a hit or miss
+        '''
+        entry = self.get_entry(key, name)
+        if not os.path.exists(entry):
+            if count:
+                self.miss += 1
+            return None
+        if count:
+            self.hit += 1
+        with open(entry, 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def store_text(self, key, text, name = 'text'):
+        return self._store(key, name, lambda f: f.write(text.encode('utf-8')))
+
+    def load_file(self, key, target_file):
+        '''
+        copy cached file into target_file, return False if not cached
+        '''
+        entry = self.get_entry(key, 'file')
+        if not os.path.exists(entry):
+            self.miss += 1
+            return False
+        self.hit += 1
+        shutil.copy2(entry, target_file)
+        return True
+
+    def store_file(self, key, src_file):
+        def write_func(f):
+            with open(src_file, 'rb') as fs:
+                shutil.copyfileobj(fs, f)
+        entry = self._store(key, 'file', write_func)
+        shutil.copymode(src_file, entry)
+        return entry
+
+    def summary(self):
+        return f'cache {self.cache_dir}: {self.hit} hit, {self.miss} miss'
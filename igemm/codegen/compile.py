@@ -24,9 +24,12 @@
 # 
 ################################################################################
 import os
+import shlex
 import subprocess
+import concurrent.futures
 
 from .amdgpu import *
+from .build_cache import *
 
 IGEMM_HOST_USE_XDNN = False
 
@@ -34,17 +37,28 @@ def _check_hip_clang():
     return os.path.exists('/opt/rocm/llvm/bin/clang++')
 
 class compile_asm_t(object):
-    def __init__(self, mc, asm_file_name, target_hsaco = ''):
+    def __init__(self, mc, asm_file_name, target_hsaco = '', cache = None):
         self.asm_file_name = asm_file_name
         if target_hsaco == '':
             self.target_hsaco = os.path.splitext(asm_file_name)[0] + '.hsaco'
         else:
             self.target_hsaco = target_hsaco
         self.mc = mc
+        self.cache = cache
     def compile(self, **kwargs):
         # make sure mc output is closed
         self.mc.close()
-
+        if self.cache is None:
+            return self._compile(**kwargs)
+        key = self.cache.get_key('asm', self.mc.arch_config.arch, self.mc.arch_config.code_object,
+                    _check_hip_clang(), build_cache_hash_file(self.asm_file_name))
+        if self.cache.load_file(key, self.target_hsaco):
+            return True
+        rtn = self._compile(**kwargs)
+        if rtn:
+            self.cache.store_file(key, self.target_hsaco)
+        return rtn
+    def _compile(self, **kwargs):
         arch_str = amdgpu_arch_to_string(self.mc.arch_config.arch)
         use_hip_clang = _check_hip_clang()
         if use_hip_clang:
@@ -72,27 +86,148 @@ class compile_asm_t(object):
             print('err:{}'.format(e))
             return False
 
+def compile_get_default_asm_cmd(arch_config):
+    '''
+    assemble a single .s into relocatable object. {arch}, {src}, {obj} are filled per file
+    '''
+    if _check_hip_clang():
+        cmd = ['/opt/rocm/llvm/bin/clang++']
+    else:
+        cmd = ['/opt/rocm/hcc/bin/clang']
+    cmd += ['-x', 'assembler', '-target', 'amdgcn--amdhsa', '-mcpu={arch}']
+    if arch_config.code_object == AMDGPU_CODEOBJECT_V2:
+        cmd += ['-mno-code-object-v3']
+    cmd += ['-c', '{src}', '-o', '{obj}']
+    return ' '.join(cmd)
+
+def compile_get_default_link_cmd(arch_config):
+    '''
+    link all objects into one code object. {objs}, {target} are filled
+    '''
+    if _check_hip_clang():
+        return '/opt/rocm/llvm/bin/ld.lld -shared {objs} -o {target}'
+    return '/opt/rocm/hcc/bin/ld.lld -shared {objs} -o {target}'
+
+def compile_expand_cmd(cmd_template, **kwargs):
+    '''
+    split template like shell, then fill placeholders. a token of exactly "{objs}" expands to a list of files
+    '''
+    cmd = []
+    for token in shlex.split(cmd_template):
+        if token == '{objs}':
+            cmd += kwargs['objs']
+        else:
+            cmd.append(token.format(**kwargs))
+    return cmd
+
+def _compile_run_cmd(cmd, cwd = None):
+    try:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr = subprocess.STDOUT, cwd = cwd)
+        (out, _) = p.communicate()
+        if p.returncode != 0:
+            print('build fail:{}'.format(cmd))
+            print('{}'.format(out.decode('utf-8')))
+            return False
+        return True
+    except Exception as e:
+        print('fail to run cmd:{}'.format(cmd))
+        print('err:{}'.format(e))
+        return False
+
+class compile_split_asm_t(object):
+    '''
+    assemble every .s into its own object with a worker pool, then link objects into a single hsaco.
+    the assembler runs inside the directory of each .s, so a shared `.include` can be found by name.
+    '''
+    def __init__(self, arch_config, asm_file_list, target_hsaco, asm_cmd = None, link_cmd = None, jobs = 1, cache = None):
+        self.arch_config = arch_config
+        self.asm_file_list = asm_file_list
+        self.obj_file_list = [os.path.splitext(f)[0] + '.o' for f in asm_file_list]
+        self.target_hsaco = target_hsaco
+        self.asm_cmd = asm_cmd if asm_cmd else compile_get_default_asm_cmd(arch_config)
+        self.link_cmd = link_cmd if link_cmd else compile_get_default_link_cmd(arch_config)
+        self.jobs = jobs
+        self.cache = cache
+        self.include_hash = dict()      # dir -> hash of shared includes, .s only tracks them by name
+
+    def get_include_hash(self, asm_file_name):
+        asm_dir = os.path.dirname(os.path.abspath(asm_file_name))
+        if asm_dir not in self.include_hash:
+            self.include_hash[asm_dir] = build_cache_hash_source_tree(asm_dir, ('.inc',))
+        return self.include_hash[asm_dir]
+
+    def assemble(self, asm_file_name, obj_file_name):
+        arch_str = amdgpu_arch_to_string(self.arch_config.arch)
+        cmd = compile_expand_cmd(self.asm_cmd, arch = arch_str,
+                    src = os.path.abspath(asm_file_name), obj = os.path.abspath(obj_file_name))
+        if self.cache:
+            key = self.cache.get_key('split_asm', self.asm_cmd, arch_str, self.get_include_hash(asm_file_name),
+                    build_cache_hash_file(asm_file_name))
+            if self.cache.load_file(key, obj_file_name):
+                return True
+        rtn = _compile_run_cmd(cmd, cwd = os.path.dirname(os.path.abspath(asm_file_name)))
+        if rtn and self.cache:
+            self.cache.store_file(key, obj_file_name)
+        return rtn
+
+    def link(self):
+        cmd = compile_expand_cmd(self.link_cmd, objs = [os.path.abspath(f) for f in self.obj_file_list],
+                    target = os.path.abspath(self.target_hsaco))
+        if self.cache:
+            key = self.cache.get_key('link', self.link_cmd, [build_cache_hash_file(f) for f in self.obj_file_list])
+            if self.cache.load_file(key, self.target_hsaco):
+                return True
+        rtn = _compile_run_cmd(cmd)
+        if rtn and self.cache:
+            self.cache.store_file(key, self.target_hsaco)
+        return rtn
+
+    def compile(self, **kwargs):
+        for asm_file_name in self.asm_file_list:
+            self.get_include_hash(asm_file_name)     # compute once, before entering threads
+        # each job is only a subprocess, thread is enough
+        with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, self.jobs)) as executor:
+            rtn_list = list(executor.map(self.assemble, self.asm_file_list, self.obj_file_list))
+        if not all(rtn_list):
+            return False
+        return self.link()
+
 class compile_disass_t(object):
-    def __init__(self, mc, hsaco_file_name, target_disass = ''):
+    def __init__(self, mc, hsaco_file_name, target_disass = '', cache = None, disass_cmd = None):
         self.hsaco_file_name = hsaco_file_name
         if target_disass == '':
             self.target_disass = os.path.splitext(hsaco_file_name)[0] + '.disass.s'
         else:
             self.target_disass = target_disass
         self.mc = mc
+        self.cache = cache
+        self.disass_cmd = disass_cmd    # template, {arch}, {src} are filled. output is taken from stdout
     def compile(self, **kwargs):
+        if self.cache is None:
+            return self._compile(**kwargs)
+        key = self.cache.get_key('disass', self.mc.arch_config.arch, _check_hip_clang(), self.disass_cmd,
+                    build_cache_hash_file(self.hsaco_file_name))
+        if self.cache.load_file(key, self.target_disass):
+            return True
+        rtn = self._compile(**kwargs)
+        if rtn:
+            self.cache.store_file(key, self.target_disass)
+        return rtn
+    def _compile(self, **kwargs):
         arch_str = amdgpu_arch_to_string(self.mc.arch_config.arch)
         use_hip_clang = _check_hip_clang()
-        if use_hip_clang:
+        if self.disass_cmd:
+            cmd = compile_expand_cmd(self.disass_cmd, arch = arch_str, src = self.hsaco_file_name)
+        elif use_hip_clang:
             cmd = ['/opt/rocm/llvm/bin/llvm-objdump']
             cmd += ['--disassemble']
             cmd += ['--mcpu={}'.format(arch_str)]
+            cmd += ['{}'.format(self.hsaco_file_name)]
         else:
             cmd = ['/opt/rocm/hcc/bin/llvm-objdump']
             cmd += ['-disassemble']
             cmd += ['-mcpu={}'.format(arch_str)]
-
-        cmd += ['{}'.format(self.hsaco_file_name)]
+            cmd += ['{}'.format(self.hsaco_file_name)]
         # cmd += ['>', '{}'.format(self.target_disass)]
         try:
             fp = open(self.target_disass, "w")
@@ -113,7 +248,7 @@ class compile_disass_t(object):
                 sys.exit()
 
 class compile_host_t(object):
-    def __init__(self, arch_config, host_cpp, target_exec = ''):
+    def __init__(self, arch_config, host_cpp, target_exec = '', cache = None):
         self.host_cpp = host_cpp
         if target_exec == '':
             if type(host_cpp) is str:
@@ -125,7 +260,27 @@ class compile_host_t(object):
         else:
             self.target_exec = target_exec
         self.arch_config = arch_config
+        self.cache = cache
+    def get_source_hash(self):
+        '''
+        includes are not tracked, so every header next to the sources is part of the hash
+        '''
+        host_cpp = [self.host_cpp] if type(self.host_cpp) is str else self.host_cpp
+        src_dirs = sorted(set(os.path.dirname(os.path.abspath(src)) for src in host_cpp))
+        return [build_cache_hash_file(src) for src in host_cpp] + \
+                [build_cache_hash_source_tree(d, ('.h', '.hpp')) for d in src_dirs]
     def compile(self, **kwargs):
+        if self.cache is None:
+            return self._compile(**kwargs)
+        key = self.cache.get_key('host', self.arch_config.arch, _check_hip_clang(), IGEMM_HOST_USE_XDNN,
+                    sorted(kwargs.items()), self.get_source_hash())
+        if self.cache.load_file(key, self.target_exec):
+            return True
+        rtn = self._compile(**kwargs)
+        if rtn:
+            self.cache.store_file(key, self.target_exec)
+        return rtn
+    def _compile(self, **kwargs):
         arch_str = amdgpu_arch_to_string(self.arch_config.arch)
         use_hip_clang = _check_hip_clang()
         xdnnroot ='2f6f70742f696e74656c2f696e74656c6f6e656170692f6f6e65444e4e2f6c61746573742f6370755f676f6d702f'
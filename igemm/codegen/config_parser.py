@@ -59,6 +59,26 @@ class config_content_t(object):
             for key in section:
                 print('  {} = {} (type:{})'.format(key, section[key], type(section[key])))
     
+    def write(self, file_name):
+        '''
+        write back in the format config_parser_t (and the c++ parser of host driver) reads
+        '''
+        def value_str(value):
+            if type(value) is str:
+                return '\'{}\''.format(value)
+            if type(value) in (list, tuple):
+                return '[{}]'.format(', '.join(value_str(v) for v in value))
+            if type(value) is range:
+                return '({}, {}, {})'.format(value.start, value.stop, value.step)
+            return '{}'.format(value)
+        with open(file_name, 'w') as f:
+            for section in self:
+                f.write('[{}]\n'.format(section.get_name()))
+                for key in section:
+                    if key != 'name':
+                        f.write('{:<25}= {}\n'.format(key, value_str(section[key])))
+                f.write('\n')
+
     def get_section(self, section_name):
         section_list = []
         for section in self:
@@ -0,0 +1,1042 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+# functional emulator of the gcn instruction subset emitted by igemm kernels. assembler macros, .rept and symbols
+# are expanded, then every wave is run with its 64 lanes as numpy vectors. waves of several workgroups are
+# batched into one array, so every instruction is a single numpy op on (waves, 64) registers.
+# only results are modeled, not timing. load data is returned to registers at the s_waitcnt that covers it,
+# so a missing wait shows up as a wrong result, like on a busy gpu.
+# waves of a workgroup run in lockstep between barriers, so a missing s_barrier never gives a wrong result.
+# instead each lds dword keeps the wave and barrier epoch of its last write and read (emulator_lds_t), and access
+# to data of another wave in the same epoch is reported. lds store takes effect at issue, so a s_barrier before
+# the lgkmcnt wait of the store is not found.
+import re
+import struct
+import collections
+from .node import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None   # emulator is not available, codegen does not need it
+
+EMULATOR_WAVE_SIZE          = 64
+EMULATOR_NUM_SGPR           = 104
+EMULATOR_WORKGROUP_BATCH    = 16            # workgroups run together in one set of register arrays
+EMULATOR_MAX_INSTS          = 10000000      # per wave group, guard against a kernel that never ends
+
+_emulator_re_sym = re.compile(r'0x[0-9a-fA-F]+|\d+|\.?[A-Za-z_][\w.]*')
+_emulator_re_assign = re.compile(r'^(\.?[A-Za-z_][\w.]*)\s*=\s*(.+)$')
+_emulator_re_reg = re.compile(r'^([vs])\[([^:\]]+)(?::([^\]]+))?\]$')
+_emulator_re_reg_phy = re.compile(r'^([vs])(\d+)$')
+_emulator_re_arg = re.compile(r'\.name:\s*(\w+)\s*,\s*\.size:\s*(\d+)\s*,\s*\.offset:\s*(\d+)\s*,\s*\.value_kind:\s*(\w+)')
+
+def _emulator_eval(text, symbols = None):
+    '''
+    integer value of an assembler expression, symbols are replaced first
+    '''
+    if symbols:
+        text = _emulator_re_sym.sub(lambda m: str(symbols.get(m.group(0), m.group(0))), text)
+    return int(eval(text.replace('/', '//'), {'__builtins__' : {}}, {}))
+
+class emulator_kernel_t(object):
+    '''
+    expanded instructions of one kernel, with what is needed to launch it
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.insts = list()         # list of emulator_inst_t
+        self.labels = dict()        # label -> index of next instruction
+        self.lds_size = 0
+        self.user_sgpr_count = 0
+        self.vgpr_count = 0
+        self.sgpr_count = 0
+        self.block_size = 0
+        self.kernarg_size = 0
+        self.args = list()          # (name, size, offset, value_kind)
+
+    def get_kernarg(self, values):
+        '''
+        kernel argument segment from dict of arg name -> value, missing one is 0
+        '''
+        kernarg = bytearray(self.kernarg_size)
+        for name, size, offset, _ in self.args:
+            v = int(values.get(name, 0))
+            struct.pack_into('<Q' if size == 8 else '<I', kernarg, offset, v & ((1 << (size * 8)) - 1))
+        return bytes(kernarg)
+
+class emulator_inst_t(object):
+    __slots__ = ('text', 'opcode', 'operands', 'mods', 'func')
+    def __init__(self, text, opcode, operands, mods):
+        self.text = text
+        self.opcode = opcode
+        self.operands = operands        # list of ('v', index, count), ('s', index, count), ('vcc',), ('exec',), ('imm', value), ('sym', text)
+        self.mods = mods                # modifier name -> value (True if no value)
+        self.func = None
+
+def _emulator_decode_operand(text):
+    text = text.strip()
+    if text in ('vcc', 'exec'):
+        return (text,)
+    m = _emulator_re_reg_phy.match(text)
+    if m:
+        return (m.group(1), int(m.group(2)), 1)
+    m = _emulator_re_reg.match(text)
+    if m:
+        lo = _emulator_eval(m.group(2))
+        hi = _emulator_eval(m.group(3)) if m.group(3) else lo
+        return (m.group(1), lo, hi - lo + 1)
+    try:
+        return ('imm', _emulator_eval(text))
+    except (SyntaxError, NameError, TypeError):
+        pass
+    try:
+        return ('imm', struct.unpack('<I', struct.pack('<f', float(text)))[0])
+    except ValueError:
+        return ('sym', text)
+
+def _emulator_decode_inst(text):
+    stmt = ir_parse_line(text)
+    assert type(stmt) is inst_t, f'not an instruction: "{text}"'
+    operands = [_emulator_decode_operand(str(o)) for o in stmt.dst + stmt.src]
+    mods = dict()
+    for m in stmt.mod:
+        mods[m.name] = True if m.value is None else (m.value if type(m.value) is int else _emulator_eval(m.value))
+    return emulator_inst_t(text, stmt.opcode, operands, mods)
+
+def emulator_expand(text):
+    '''
+    run macros, .rept and symbol assignments of assembly text, return list of lines where instruction
+    operands only have numbers. metadata is passed through as is
+    '''
+    symbols = dict()
+    macros = dict()
+    result = list()
+    def sub(s):
+        return _emulator_re_sym.sub(lambda m: str(symbols.get(m.group(0), m.group(0))), s)
+
+    def run(lines):
+        i = 0
+        while i < len(lines):
+            line = lines[i]
+            i += 1
+            s = line.split(';')[0].strip()
+            if not s:
+                continue
+            tokens = s.split(None, 1)
+            if tokens[0] == '.amdgpu_metadata':
+                while True:
+                    result.append(line.rstrip())
+                    if line.strip() == '.end_amdgpu_metadata' or i >= len(lines):
+                        break
+                    line = lines[i]
+                    i += 1
+                continue
+            if tokens[0] == '.macro':
+                head = [t for t in re.split(r'[,\s]+', tokens[1]) if t]
+                body = list()
+                while lines[i].split(';')[0].strip() != '.endm':
+                    body.append(lines[i])
+                    i += 1
+                i += 1
+                macros[head[0]] = ([p.split('=')[0] for p in head[1:]], body)
+                continue
+            if tokens[0] == '.rept':
+                depth, body = 1, list()
+                while True:
+                    t = lines[i].split(';')[0].strip()
+                    i += 1
+                    if t.startswith('.rept'):
+                        depth += 1
+                    elif t == '.endr':
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    body.append(lines[i - 1])
+                for _ in range(_emulator_eval(tokens[1], symbols)):
+                    run(body)
+                continue
+            if tokens[0] in ('.set', '.equ'):
+                name, expr = tokens[1].split(',', 1)
+                symbols[name.strip()] = _emulator_eval(expr, symbols)
+                continue
+            m = _emulator_re_assign.match(s)
+            if m:
+                symbols[m.group(1)] = _emulator_eval(m.group(2), symbols)
+                continue
+            if tokens[0] in macros:
+                params, body = macros[tokens[0]]
+                args = [a.strip() for a in tokens[1].split(',')] if len(tokens) > 1 else []
+                assert len(args) <= len(params), f'too many arguments for macro {tokens[0]}: "{s}"'
+                args = dict(zip(params, args))
+                run([re.sub(r'\\(\w+)', lambda m: args.get(m.group(1), ''), l) for l in body])
+                continue
+            assert tokens[0] not in ('.include', '.if', '.ifdef', '.ifndef', '.irp'), f'directive not supported by emulator: "{s}"'
+            result.append(s if tokens[0].startswith('.') or s.endswith(':') else tokens[0] + (' ' + sub(tokens[1]) if len(tokens) > 1 else ''))
+    run(text.split('\n'))
+    return result
+
+def emulator_parse(text):
+    '''
+    dict of kernel name -> emulator_kernel_t, from assembly text of code object v3
+    '''
+    lines = emulator_expand(text)
+    globls = {l.split()[1] for l in lines if l.startswith('.globl')}
+    kernels = dict()
+    kernel = None
+    meta_kernel = None
+    desc_kernel = None
+    in_meta = False
+    for line in lines:
+        if line.strip() in ('.amdgpu_metadata', '.end_amdgpu_metadata'):
+            in_meta = line.strip() == '.amdgpu_metadata'
+            continue
+        if in_meta:
+            name = line.strip().split(':', 1)[1].strip() if line.strip().startswith(('- .name:', '.name:')) else None
+            m = _emulator_re_arg.search(line)
+            if name in kernels:
+                meta_kernel = kernels[name]
+            elif meta_kernel is not None and line.strip().startswith('.reqd_workgroup_size'):
+                meta_kernel.block_size = int(line.split('[')[1].split(',')[0])
+            elif meta_kernel is not None and line.strip().startswith('.kernarg_segment_size'):
+                meta_kernel.kernarg_size = int(line.split(':')[1])
+            elif meta_kernel is not None and m:
+                meta_kernel.args.append((m.group(1), int(m.group(2)), int(m.group(3)), m.group(4)))
+            continue
+        if line.endswith(':') and not line.startswith('.'):
+            name = line[:-1]
+            if name in globls:
+                kernel = kernels[name] = emulator_kernel_t(name)
+            else:
+                assert kernel is not None, f'label {name} outside of kernel'
+                kernel.labels[name] = len(kernel.insts)
+            continue
+        tokens = line.split()
+        if tokens[0] == '.amdhsa_kernel':
+            desc_kernel = kernels[tokens[1]]
+        elif tokens[0] == '.end_amdhsa_kernel':
+            desc_kernel = None
+        elif desc_kernel is not None:
+            value = int(tokens[1], 0)
+            if tokens[0] == '.amdhsa_group_segment_fixed_size':
+                desc_kernel.lds_size = value
+            elif tokens[0] == '.amdhsa_next_free_vgpr':
+                desc_kernel.vgpr_count = value
+            elif tokens[0] == '.amdhsa_next_free_sgpr':
+                desc_kernel.sgpr_count = value
+            elif tokens[0] == '.amdhsa_user_sgpr_kernarg_segment_ptr':
+                desc_kernel.user_sgpr_count += 2 * value
+            elif tokens[0].startswith('.amdhsa_user_sgpr_'):
+                assert value == 0, f'only kernarg segment ptr is supported as user sgpr, {line}'
+        elif not line.startswith('.') and kernel is not None:
+            kernel.insts.append(_emulator_decode_inst(line))
+    for kernel in kernels.values():
+        assert kernel.block_size > 0, f'no workgroup size in metadata of {kernel.name}'
+        for inst in kernel.insts:
+            inst.func = _emulator_compile(kernel, inst)
+    return kernels
+
+class emulator_memory_t(object):
+    '''
+    global memory. every buffer starts at its own 4GB aligned address, so a pointer tells its buffer
+    '''
+    def __init__(self):
+        self.buffers = list()       # (name, uint32 words)
+
+    def alloc(self, name, data):
+        '''
+        copy data (numpy array or bytes) into a new buffer, return its address
+        '''
+        raw = data.tobytes() if hasattr(data, 'tobytes') else bytes(data)
+        raw += b'\0' * (-len(raw) % 4)
+        self.buffers.append((name, np.frombuffer(raw, dtype = np.uint32).copy()))
+        return len(self.buffers) << 32
+
+    def get(self, address, dtype = None):
+        words = self.buffers[(address >> 32) - 1][1]
+        return words if dtype is None else words.view(dtype)
+
+def _emulator_pack(mask):
+    '''
+    (waves, 64) bool -> (waves,) uint64, lane 0 in bit 0
+    '''
+    return np.packbits(mask, axis = 1, bitorder = 'little').view('<u8').reshape(-1)
+
+def _emulator_unpack(bits):
+    return np.unpackbits(np.asarray(bits, dtype = '<u8').view(np.uint8).reshape(-1, 8), axis = 1, bitorder = 'little').astype(bool)
+
+class emulator_waves_t(object):
+    '''
+    register state of a group of waves that are at the same pc
+    '''
+    def __init__(self, num_waves, num_vgpr):
+        self.V = np.zeros((num_vgpr, num_waves, EMULATOR_WAVE_SIZE), dtype = np.uint32)
+        self.F = self.V.view(np.float32)
+        self.S = np.zeros((EMULATOR_NUM_SGPR, num_waves), dtype = np.uint32)
+        self.exec = np.ones((num_waves, EMULATOR_WAVE_SIZE), dtype = bool)
+        self.exec_full = True
+        self.vcc = np.zeros((num_waves, EMULATOR_WAVE_SIZE), dtype = bool)
+        self.scc = np.zeros(num_waves, dtype = bool)
+        self.wg = np.zeros(num_waves, dtype = np.int64)     # row of lds, index of workgroup in batch
+        self.wg_id = np.zeros(num_waves, dtype = np.int64)  # workgroup id in grid
+        self.wave = np.arange(num_waves)                    # index of wave in batch, owner of lds access
+        self.pc = 0
+        self.num_insts = 0
+        self.pending = {'vm' : collections.deque(), 'lgkm' : collections.deque()}
+
+    def set_exec(self, mask):
+        self.exec = mask
+        self.exec_full = bool(mask.all())
+
+    def write_v(self, index, value):
+        if self.exec_full:
+            self.V[index] = value
+        else:
+            np.copyto(self.V[index], value, where = self.exec)
+
+    def wait(self, counter, count):
+        q = self.pending[counter]
+        while len(q) > count:
+            q.popleft()()
+
+    def flush(self):
+        self.wait('vm', 0)
+        self.wait('lgkm', 0)
+
+    def take(self, waves):
+        '''
+        new group of the given waves, in flight memory is completed first
+        '''
+        self.flush()
+        w = emulator_waves_t.__new__(emulator_waves_t)
+        w.V = self.V[:, waves].copy()
+        w.F = w.V.view(np.float32)
+        w.S = self.S[:, waves].copy()
+        w.set_exec(self.exec[waves].copy())
+        w.vcc = self.vcc[waves].copy()
+        w.scc = self.scc[waves].copy()
+        w.wg = self.wg[waves]
+        w.wg_id = self.wg_id[waves]
+        w.wave = self.wave[waves]
+        w.pc = self.pc
+        w.num_insts = self.num_insts
+        w.pending = {'vm' : collections.deque(), 'lgkm' : collections.deque()}
+        return w
+
+class emulator_error_t(AssertionError):
+    '''
+    kernel did something the hardware would not do right, e.g. access out of lds or buffer
+    '''
+    pass
+
+def _emulator_fail(inst, w, lanes, message):
+    waves = np.nonzero(lanes.any(axis = 1))[0]
+    lane = int(np.argmax(lanes[waves[0]]))
+    raise emulator_error_t(f'{message}, workgroup {int(w.wg_id[waves[0]])}, wave lane {lane}, at "{inst.text}"')
+
+# operand access, every getter is built once per instruction and called with the wave group
+def _emulator_src_u32(op):
+    kind = op[0]
+    if kind == 'v':
+        i = op[1]
+        return lambda w: w.V[i]
+    if kind == 's':
+        i = op[1]
+        return lambda w: w.S[i][:, None]
+    if kind == 'imm':
+        c = np.uint32(op[1] & 0xffffffff)
+        return lambda w: c
+    assert False, f'operand {op} can not be a 32 bit source'
+
+def _emulator_src_f32(op):
+    kind = op[0]
+    if kind == 'v':
+        i = op[1]
+        return lambda w: w.F[i]
+    if kind == 's':
+        i = op[1]
+        return lambda w: w.S[i].view(np.float32)[:, None]
+    if kind == 'imm':
+        c = np.uint32(op[1] & 0xffffffff).view(np.float32)
+        return lambda w: c
+    assert False, f'operand {op} can not be a float source'
+
+def _emulator_src_s32(op):
+    kind = op[0]
+    if kind == 's':
+        i = op[1]
+        return lambda w: w.S[i]
+    if kind == 'imm':
+        c = np.uint32(op[1] & 0xffffffff)
+        return lambda w: c
+    assert False, f'operand {op} can not be a scalar source'
+
+def _emulator_src_s64(op):
+    kind = op[0]
+    if kind == 'exec':
+        return lambda w: _emulator_pack(w.exec)
+    if kind == 'vcc':
+        return lambda w: _emulator_pack(w.vcc)
+    if kind == 's':
+        i = op[1]
+        return lambda w: w.S[i].astype(np.uint64) | (w.S[i + 1].astype(np.uint64) << np.uint64(32))
+    if kind == 'imm':
+        c = np.uint64(op[1] & 0xffffffffffffffff)
+        return lambda w: np.full(w.S.shape[1], c, dtype = np.uint64)
+    assert False, f'operand {op} can not be a 64 bit scalar source'
+
+def _emulator_dst_s64(op):
+    kind = op[0]
+    if kind == 'exec':
+        return lambda w, v: w.set_exec(_emulator_unpack(v))
+    if kind == 'vcc':
+        def set_vcc(w, v):
+            w.vcc = _emulator_unpack(v)
+        return set_vcc
+    if kind == 's':
+        i = op[1]
+        def set_s(w, v):
+            w.S[i] = (v & np.uint64(0xffffffff)).astype(np.uint32)
+            w.S[i + 1] = (v >> np.uint64(32)).astype(np.uint32)
+        return set_s
+    assert False, f'operand {op} can not be a 64 bit scalar destination'
+
+def _emulator_src_mask(op):
+    kind = op[0]
+    if kind == 'vcc':
+        return lambda w: w.vcc
+    if kind == 'exec':
+        return lambda w: w.exec
+    get = _emulator_src_s64(op)
+    return lambda w: _emulator_unpack(get(w))
+
+def _emulator_dst_mask(op):
+    kind = op[0]
+    if kind == 'vcc':
+        def set_vcc(w, m):
+            w.vcc = m
+        return set_vcc
+    if kind == 'exec':
+        return lambda w, m: w.set_exec(m)
+    set64 = _emulator_dst_s64(op)
+    return lambda w, m: set64(w, _emulator_pack(m))
+
+def _emulator_u64(a):
+    return np.asarray(a).astype(np.uint64)
+
+def _emulator_i32(a):
+    return np.asarray(a, dtype = np.uint32).view(np.int32)
+
+def _emulator_i24(a):
+    return (np.asarray(a, dtype = np.uint32) << np.uint32(8)).view(np.int32) >> 8
+
+def _emulator_shift(a):
+    return np.asarray(a, dtype = np.uint32) & np.uint32(31)
+
+def _emulator_cvt_u32(a):
+    with np.errstate(invalid = 'ignore'):
+        return np.nan_to_num(np.clip(np.trunc(np.asarray(a, dtype = np.float64)), 0, 4294967295.0), nan = 0).astype(np.uint32)
+
+def _emulator_cvt_i32(a):
+    with np.errstate(invalid = 'ignore'):
+        return np.nan_to_num(np.clip(np.trunc(np.asarray(a, dtype = np.float64)), -2147483648.0, 2147483647.0), nan = 0).astype(np.int32).view(np.uint32)
+
+def _emulator_rcp(a):
+    with np.errstate(divide = 'ignore'):
+        return np.float32(1.0) / a
+
+_EMULATOR_VOP_U32 = {
+    'v_mov_b32'         : lambda a: a,
+    'v_not_b32'         : lambda a: ~a,
+    'v_add_u32'         : lambda a, b: a + b,
+    'v_sub_u32'         : lambda a, b: a - b,
+    'v_subrev_u32'      : lambda a, b: b - a,
+    'v_add_i32'         : lambda a, b: a + b,
+    'v_sub_i32'         : lambda a, b: a - b,
+    'v_and_b32'         : lambda a, b: a & b,
+    'v_or_b32'          : lambda a, b: a | b,
+    'v_xor_b32'         : lambda a, b: a ^ b,
+    'v_lshlrev_b32'     : lambda a, b: b << _emulator_shift(a),
+    'v_lshrrev_b32'     : lambda a, b: b >> _emulator_shift(a),
+    'v_ashrrev_i32'     : lambda a, b: (_emulator_i32(b) >> _emulator_shift(a).astype(np.int32)).view(np.uint32),
+    'v_mul_lo_u32'      : lambda a, b: a * b,
+    'v_mul_hi_u32'      : lambda a, b: ((_emulator_u64(a) * _emulator_u64(b)) >> np.uint64(32)).astype(np.uint32),
+    'v_mul_u32_u24'     : lambda a, b: (a & np.uint32(0xffffff)) * (b & np.uint32(0xffffff)),
+    'v_mul_i32_i24'     : lambda a, b: (_emulator_i24(a) * _emulator_i24(b)).view(np.uint32),
+    'v_min_u32'         : np.minimum,
+    'v_max_u32'         : np.maximum,
+    'v_min_i32'         : lambda a, b: np.minimum(_emulator_i32(a), _emulator_i32(b)).view(np.uint32),
+    'v_max_i32'         : lambda a, b: np.maximum(_emulator_i32(a), _emulator_i32(b)).view(np.uint32),
+    'v_add3_u32'        : lambda a, b, c: a + b + c,
+    'v_add_lshl_u32'    : lambda a, b, c: (a + b) << _emulator_shift(c),
+    'v_lshl_add_u32'    : lambda a, b, c: (a << _emulator_shift(b)) + c,
+    'v_lshl_or_b32'     : lambda a, b, c: (a << _emulator_shift(b)) | c,
+    'v_and_or_b32'      : lambda a, b, c: (a & b) | c,
+    'v_or3_b32'         : lambda a, b, c: a | b | c,
+    'v_mad_u32_u24'     : lambda a, b, c: (a & np.uint32(0xffffff)) * (b & np.uint32(0xffffff)) + c,
+    'v_mad_i32_i24'     : lambda a, b, c: (_emulator_i24(a) * _emulator_i24(b)).view(np.uint32) + c,
+    'v_cvt_f32_u32'     : lambda a: np.asarray(a, dtype = np.uint32).astype(np.float32).view(np.uint32),
+    'v_cvt_f32_i32'     : lambda a: _emulator_i32(a).astype(np.float32).view(np.uint32),
+}
+
+_EMULATOR_VOP_F32 = {
+    'v_mul_f32'         : lambda a, b: a * b,
+    'v_add_f32'         : lambda a, b: a + b,
+    'v_sub_f32'         : lambda a, b: a - b,
+    'v_subrev_f32'      : lambda a, b: b - a,
+    'v_max_f32'         : np.maximum,
+    'v_min_f32'         : np.minimum,
+    'v_rcp_f32'         : _emulator_rcp,
+    'v_fma_f32'         : lambda a, b, c: (np.float64(1) * a * b + c).astype(np.float32),
+    'v_mad_f32'         : lambda a, b, c: a * b + c,
+}
+
+_EMULATOR_VOP_CVT_F32 = {
+    'v_cvt_u32_f32'     : _emulator_cvt_u32,
+    'v_cvt_i32_f32'     : _emulator_cvt_i32,
+}
+
+_EMULATOR_CMP = {
+    'eq' : np.equal, 'ne' : np.not_equal, 'lg' : np.not_equal, 'gt' : np.greater,
+    'ge' : np.greater_equal, 'lt' : np.less, 'le' : np.less_equal,
+}
+
+_EMULATOR_SOP_U32 = {
+    's_mov_b32'         : lambda a: a,
+    's_not_b32'         : lambda a: ~a,
+    's_mul_i32'         : lambda a, b: a * b,
+    's_mul_hi_u32'      : lambda a, b: ((_emulator_u64(a) * _emulator_u64(b)) >> np.uint64(32)).astype(np.uint32),
+    's_lshl_b32'        : lambda a, b: a << _emulator_shift(b),
+    's_lshr_b32'        : lambda a, b: a >> _emulator_shift(b),
+    's_ashr_i32'        : lambda a, b: (_emulator_i32(a) >> _emulator_shift(b).astype(np.int32)).view(np.uint32),
+    's_and_b32'         : lambda a, b: a & b,
+    's_or_b32'          : lambda a, b: a | b,
+    's_xor_b32'         : lambda a, b: a ^ b,
+    's_min_u32'         : np.minimum,
+    's_max_u32'         : np.maximum,
+    's_min_i32'         : lambda a, b: np.minimum(_emulator_i32(a), _emulator_i32(b)).view(np.uint32),
+    's_max_i32'         : lambda a, b: np.maximum(_emulator_i32(a), _emulator_i32(b)).view(np.uint32),
+}
+_EMULATOR_SOP_SCC_NZ = {'s_lshl_b32', 's_lshr_b32', 's_ashr_i32', 's_and_b32', 's_or_b32', 's_xor_b32', 's_not_b32'}
+
+_EMULATOR_SOP_B64 = {
+    's_mov_b64'         : lambda a: a,
+    's_not_b64'         : lambda a: ~a,
+    's_and_b64'         : lambda a, b: a & b,
+    's_or_b64'          : lambda a, b: a | b,
+    's_xor_b64'         : lambda a, b: a ^ b,
+    's_andn2_b64'       : lambda a, b: a & ~b,
+    's_orn2_b64'        : lambda a, b: a | ~b,
+}
+
+_EMULATOR_SAVEEXEC = {
+    's_and_saveexec_b64'    : lambda s, e: s & e,
+    's_or_saveexec_b64'     : lambda s, e: s | e,
+    's_xor_saveexec_b64'    : lambda s, e: s ^ e,
+    's_andn2_saveexec_b64'  : lambda s, e: s & ~e,
+}
+
+def _emulator_compile_valu(inst):
+    op, opr = inst.opcode, inst.operands
+    if op in _EMULATOR_VOP_U32 or op in _EMULATOR_VOP_F32 or op in _EMULATOR_VOP_CVT_F32:
+        f = _EMULATOR_VOP_U32.get(op) or _EMULATOR_VOP_F32.get(op) or _EMULATOR_VOP_CVT_F32[op]
+        is_f32 = op in _EMULATOR_VOP_F32
+        srcs = [(_emulator_src_f32 if is_f32 or op in _EMULATOR_VOP_CVT_F32 else _emulator_src_u32)(o) for o in opr[1:]]
+        d = opr[0][1]
+        if is_f32:
+            def run(w):
+                with np.errstate(all = 'ignore'):
+                    w.write_v(d, np.asarray(f(*[s(w) for s in srcs]), dtype = np.float32).view(np.uint32))
+            return run
+        return lambda w: w.write_v(d, f(*[s(w) for s in srcs]))
+    if op in ('v_mac_f32', 'v_fmac_f32'):
+        d, a, b = opr[0][1], _emulator_src_f32(opr[1]), _emulator_src_f32(opr[2])
+        fused = op == 'v_fmac_f32'
+        def run(w):
+            with np.errstate(all = 'ignore'):
+                acc = (np.float64(1) * a(w) * b(w) + w.F[d]).astype(np.float32) if fused else w.F[d] + a(w) * b(w)
+            w.write_v(d, acc.view(np.uint32))
+        return run
+    if op in ('v_add_co_u32', 'v_sub_co_u32', 'v_subrev_co_u32', 'v_addc_co_u32', 'v_subb_co_u32'):
+        d, carry = opr[0][1], _emulator_dst_mask(opr[1])
+        a, b = _emulator_src_u32(opr[2]), _emulator_src_u32(opr[3])
+        cin = _emulator_src_mask(opr[4]) if op in ('v_addc_co_u32', 'v_subb_co_u32') else None
+        def run(w):
+            x, y = _emulator_u64(a(w)), _emulator_u64(b(w))
+            if op == 'v_subrev_co_u32':
+                x, y = y, x
+            c = cin(w).astype(np.uint64) if cin else np.uint64(0)
+            if op in ('v_add_co_u32', 'v_addc_co_u32'):
+                r = x + y + c
+                out = (r >> np.uint64(32)) != 0
+            else:
+                r = x - y - c
+                out = y + c > x
+            w.write_v(d, (r & np.uint64(0xffffffff)).astype(np.uint32))
+            carry(w, np.broadcast_to(out, w.exec.shape) & w.exec)
+        return run
+    if op.startswith(('v_cmp_', 'v_cmpx_')):
+        _, kind, cmp, dtype = op.split('_')
+        f = _EMULATOR_CMP[cmp]
+        dst = _emulator_dst_mask(opr[0])
+        a, b = _emulator_src_u32(opr[1]), _emulator_src_u32(opr[2])
+        conv = _emulator_i32 if dtype == 'i32' else (lambda x: x)
+        def run(w):
+            m = f(conv(a(w)), conv(b(w))) & w.exec
+            dst(w, m)
+            if kind == 'cmpx':
+                w.set_exec(m)
+        return run
+    if op == 'v_cndmask_b32':
+        d, a, b = opr[0][1], _emulator_src_u32(opr[1]), _emulator_src_u32(opr[2])
+        mask = _emulator_src_mask(opr[3] if len(opr) > 3 else ('vcc',))
+        return lambda w: w.write_v(d, np.where(mask(w), b(w), a(w)))
+    if op == 'v_readfirstlane_b32':
+        d, src = opr[0][1], opr[1][1]
+        def run(w):
+            lane = np.argmax(w.exec, axis = 1)
+            w.S[d] = w.V[src][np.arange(w.V.shape[1]), lane]
+        return run
+    assert False, f'vector instruction not supported by emulator: "{inst.text}"'
+
+def _emulator_compile_salu(kernel, inst):
+    op, opr = inst.opcode, inst.operands
+    if op in _EMULATOR_SOP_U32:
+        f = _EMULATOR_SOP_U32[op]
+        d, srcs = opr[0][1], [_emulator_src_s32(o) for o in opr[1:]]
+        scc_nz = op in _EMULATOR_SOP_SCC_NZ
+        def run(w):
+            w.S[d] = f(*[s(w) for s in srcs])
+            if scc_nz:
+                w.scc = w.S[d] != 0
+        return run
+    if op in ('s_add_u32', 's_addc_u32', 's_sub_u32', 's_subb_u32'):
+        d, a, b = opr[0][1], _emulator_src_s32(opr[1]), _emulator_src_s32(opr[2])
+        def run(w):
+            x, y = _emulator_u64(a(w)), _emulator_u64(b(w))
+            c = w.scc.astype(np.uint64) if op in ('s_addc_u32', 's_subb_u32') else np.uint64(0)
+            if op in ('s_add_u32', 's_addc_u32'):
+                r = x + y + c
+                w.scc = (r >> np.uint64(32)) != 0
+            else:
+                r = x - y - c
+                w.scc = y + c > x
+            w.S[d] = (r & np.uint64(0xffffffff)).astype(np.uint32)
+        return run
+    if op in ('s_add_i32', 's_sub_i32'):
+        d, a, b = opr[0][1], _emulator_src_s32(opr[1]), _emulator_src_s32(opr[2])
+        def run(w):
+            x, y = _emulator_i32(a(w)).astype(np.int64), _emulator_i32(b(w)).astype(np.int64)
+            r = x + y if op == 's_add_i32' else x - y
+            w.scc = (r < -2**31) | (r >= 2**31)
+            w.S[d] = (r & 0xffffffff).astype(np.uint32)
+        return run
+    if op in _EMULATOR_SOP_B64:
+        f = _EMULATOR_SOP_B64[op]
+        dst, srcs = _emulator_dst_s64(opr[0]), [_emulator_src_s64(o) for o in opr[1:]]
+        def run(w):
+            r = f(*[s(w) for s in srcs])
+            dst(w, r)
+            if op != 's_mov_b64':
+                w.scc = r != 0
+        return run
+    if op in _EMULATOR_SAVEEXEC:
+        f = _EMULATOR_SAVEEXEC[op]
+        dst, src = _emulator_dst_s64(opr[0]), _emulator_src_s64(opr[1])
+        def run(w):
+            e = _emulator_pack(w.exec)
+            r = f(src(w), e)
+            dst(w, e)
+            w.set_exec(_emulator_unpack(r))
+            w.scc = r != 0
+        return run
+    if op == 's_cmov_b32':
+        d, a = opr[0][1], _emulator_src_s32(opr[1])
+        def run(w):
+            w.S[d] = np.where(w.scc, a(w), w.S[d])
+        return run
+    if op == 's_cselect_b32':
+        d, a, b = opr[0][1], _emulator_src_s32(opr[1]), _emulator_src_s32(opr[2])
+        def run(w):
+            w.S[d] = np.where(w.scc, a(w), b(w))
+        return run
+    if op.startswith('s_cmp_'):
+        _, _, cmp, dtype = op.split('_')
+        f = _EMULATOR_CMP[cmp]
+        a, b = _emulator_src_s32(opr[0]), _emulator_src_s32(opr[1])
+        conv = _emulator_i32 if dtype == 'i32' else (lambda x: x)
+        def run(w):
+            w.scc = np.broadcast_to(f(conv(a(w)), conv(b(w))), w.scc.shape)
+        return run
+    if op.startswith('s_load_dword'):
+        ndw = int(op[len('s_load_dwordx'):]) if op.startswith('s_load_dwordx') else 1
+        d, base, off = opr[0][1], _emulator_src_s64(opr[1]), _emulator_src_s32(opr[2])
+        def run(w, memory):
+            addr = base(w) + _emulator_u64(off(w))
+            data = np.stack([_emulator_load(memory, inst, w, addr[:, None] + np.uint64(4 * j),
+                                np.ones((len(addr), 1), dtype = bool), 'scalar load')[:, 0] for j in range(ndw)])
+            def done():
+                w.S[d : d + ndw] = data
+            w.pending['lgkm'].append(done)
+        return run
+    if op == 's_waitcnt':
+        counts = [(c, inst.mods[c]) for c in ('vmcnt', 'lgkmcnt') if c in inst.mods]
+        def run(w):
+            for c, n in counts:
+                w.wait(c[:-3], n)
+        return run
+    if op in ('s_nop', 's_setprio', 's_sleep', 's_dcache_wb', 's_dcache_inv'):
+        return lambda w: None
+    assert False, f'scalar instruction not supported by emulator: "{inst.text}"'
+
+def _emulator_load(memory, inst, w, addr, active, what):
+    '''
+    uint32 at each byte address (waves, lanes) of global memory. every active address must be inside the
+    buffer its pointer is from, that is what a gpu page fault (or silent corruption) would be
+    '''
+    addr = np.asarray(addr, dtype = np.uint64)
+    buf = (addr >> np.uint64(32)).astype(np.int64) - 1
+    off = (addr & np.uint64(0xffffffff)).astype(np.int64)
+    result = np.zeros(addr.shape, dtype = np.uint32)
+    for b in np.unique(buf[active]):
+        lanes = active & (buf == b)
+        if b < 0 or b >= len(memory.buffers):
+            _emulator_fail(inst, w, lanes, f'{what} from unknown address')
+        name, words = memory.buffers[b]
+        bad = lanes & ((off < 0) | (off + 4 > words.size * 4) | (off % 4 != 0))
+        if bad.any():
+            _emulator_fail(inst, w, bad, f'{what} out of buffer {name} ({words.size * 4} bytes) at offset {int(off[bad][0])}')
+        result[lanes] = words[off[lanes] >> 2]
+    return result
+
+def emulator_get_buffer_access(inst):
+    '''
+    (dwords per lane, function of wave group -> (byte address, in range mask) of every lane) of a buffer instruction
+    '''
+    op, opr = inst.opcode, inst.operands
+    assert 'idxen' not in inst.mods, f'idxen is not supported by emulator, "{inst.text}"'
+    ndw = {'dword' : 1, 'dwordx2' : 2, 'dwordx3' : 3, 'dwordx4' : 4}[op.split('_')[-1]]
+    rsrc = opr[2][1]
+    voffset = _emulator_src_u32(opr[1]) if 'offen' in inst.mods else None
+    soffset = _emulator_src_s32(opr[3])
+    return ndw, lambda w: _emulator_buffer_addr(w, inst, rsrc, soffset, voffset)
+
+def _emulator_buffer_addr(w, inst, rsrc, soffset, voffset):
+    '''
+    address of every lane and mask of lanes in range of the resource. raw buffer (stride 0), range check of
+    gfx9 is on voffset + inst offset against num_records, soffset is not part of it
+    '''
+    S = w.S
+    base = S[rsrc].astype(np.uint64) | ((S[rsrc + 1] & np.uint32(0xffff)).astype(np.uint64) << np.uint64(32))
+    assert not (S[rsrc + 1] >> np.uint32(16)).any(), f'buffer with stride is not supported by emulator, "{inst.text}"'
+    offset = (voffset(w).astype(np.uint64) if voffset else np.uint64(0)) + np.uint64(inst.mods.get('offset', 0))
+    in_range = offset < S[rsrc + 2][:, None].astype(np.uint64)
+    addr = base[:, None] + _emulator_u64(soffset(w)).reshape(-1, 1) + offset
+    return np.broadcast_to(addr, w.exec.shape), np.broadcast_to(in_range, w.exec.shape)
+
+def _emulator_compile_vmem(inst):
+    op, opr = inst.opcode, inst.operands
+    ndw, get_addr = emulator_get_buffer_access(inst)
+    data_reg = opr[0][1]
+    if op.startswith('buffer_load'):
+        def run(w, memory):
+            addr, in_range = get_addr(w)
+            active = w.exec & in_range
+            data = [_emulator_load(memory, inst, w, addr + np.uint64(4 * j), active, 'buffer load') for j in range(ndw)]
+            exec_mask = w.exec.copy()
+            def done():
+                # out of range lane gets 0, like hardware
+                for j in range(ndw):
+                    np.copyto(w.V[data_reg + j], data[j], where = exec_mask)
+            w.pending['vm'].append(done)
+        return run
+    if op.startswith('buffer_store'):
+        def run(w, memory):
+            addr, in_range = get_addr(w)
+            active = w.exec & in_range
+            for j in range(ndw):
+                a = addr + np.uint64(4 * j)
+                _emulator_load(memory, inst, w, a, active, 'buffer store')     # bounds check
+                buf = (a[active] >> np.uint64(32)).astype(np.int64) - 1
+                off = (a[active] & np.uint64(0xffffffff)).astype(np.int64) >> 2
+                values = w.V[data_reg + j][active]
+                for b in np.unique(buf):
+                    memory.buffers[b][1][off[buf == b]] = values[buf == b]
+            w.pending['vm'].append(lambda: None)
+        return run
+    assert False, f'memory instruction not supported by emulator: "{inst.text}"'
+
+EMULATOR_LDS_EPOCH_SHIFT = 20         # stamp of lds access is epoch << shift | (wave in batch + 1)
+EMULATOR_LDS_WAVES = (1 << EMULATOR_LDS_EPOCH_SHIFT) - 1    # reader of a dword read by more than one wave
+
+class emulator_lds_t(object):
+    '''
+    lds of every workgroup in batch, one row each. waves of a group run in lockstep, so a missing s_barrier or a
+    cross wave race never gives a wrong value here. instead, the wave that last wrote and read each dword is kept
+    with the barrier epoch of the access, and touching data another wave accessed in the same epoch is reported
+    '''
+    def __init__(self, num_wg, lds_size):
+        self.data = np.zeros((num_wg, max(lds_size // 4, 1)), dtype = np.uint32)
+        self.epoch = 0                                                  # count of s_barrier passed
+        self.write_stamp = np.full(self.data.size, -1, dtype = np.int64)
+        self.read_stamp = np.full(self.data.size, -1, dtype = np.int64)
+
+    def barrier(self):
+        self.epoch += 1
+        assert self.epoch < (1 << (63 - EMULATOR_LDS_EPOCH_SHIFT))
+
+    def access(self, inst, w, index, write):
+        '''
+        record read or write of (dwords, waves, 64) dword index by active lanes, fail if another wave wrote (or, for
+        write, read) the same dword with no s_barrier in between
+        '''
+        mask = np.broadcast_to(w.exec, index.shape)
+        flat = (np.broadcast_to(w.wg[:, None], index.shape)[mask] * self.data.shape[1] + index[mask])
+        base = self.epoch << EMULATOR_LDS_EPOCH_SHIFT
+        stamp = base + 1 + np.broadcast_to(w.wave[:, None], index.shape)[mask]
+        ws = self.write_stamp[flat]
+        race = (ws >= base) & (ws != stamp)
+        if write:
+            rs = self.read_stamp[flat]
+            race |= (rs >= base) & (rs != stamp)
+        if race.any():
+            lanes = np.zeros(mask.shape, dtype = bool)
+            lanes[mask] = race
+            _emulator_fail(inst, w, lanes.any(axis = 0), f'lds {"write" if write else "read"} of dword ' +
+                    f'{int(index[mask][race][0])} accessed by another wave without s_barrier in between')
+        if write:
+            self.write_stamp[flat] = stamp
+            # lanes of different waves on the same dword in one instruction, the last assignment wins
+            race = self.write_stamp[flat] != stamp
+            if race.any():
+                lanes = np.zeros(mask.shape, dtype = bool)
+                lanes[mask] = race
+                _emulator_fail(inst, w, lanes.any(axis = 0), f'lds write of dword {int(index[mask][race][0])} by more than one wave')
+        else:
+            rs = self.read_stamp[flat]
+            self.read_stamp[flat] = np.where((rs < base) | (rs == stamp), stamp, base + EMULATOR_LDS_WAVES)
+            mixed = flat[self.read_stamp[flat] != stamp]
+            self.read_stamp[mixed] = base + EMULATOR_LDS_WAVES
+
+def _emulator_lds_index(kernel, inst, w, addr, nbytes):
+    active = w.exec
+    bad = active & ((addr % 4 != 0) | (addr.astype(np.int64) + nbytes > kernel.lds_size))
+    if bad.any():
+        _emulator_fail(inst, w, bad, f'lds access out of {kernel.lds_size} bytes at {int(addr[bad][0])}')
+    return np.where(active, addr >> np.uint32(2), 0).astype(np.int64)
+
+def emulator_get_lds_access(inst):
+    '''
+    (address vgpr, dwords per lane, [(offset in byte, first data register of the dwords)]) of a ds instruction.
+    read2/write2 has 2 accesses
+    '''
+    op, opr = inst.opcode, inst.operands
+    dw = {'b32' : 1, 'b64' : 2, 'b96' : 3, 'b128' : 4}[op.split('_')[-1]]
+    if op.startswith(('ds_read2', 'ds_write2')):
+        stride = dw * (64 if 'st64' in op else 1)
+        pieces = [(inst.mods.get('offset0', 0) * stride * 4, 0), (inst.mods.get('offset1', 0) * stride * 4, dw)]
+    else:
+        pieces = [(inst.mods.get('offset', 0), 0)]
+    return opr[1][1] if op.startswith('ds_read') else opr[0][1], dw, pieces
+
+def _emulator_compile_lds(kernel, inst):
+    op, opr = inst.opcode, inst.operands
+    addr_reg, dw, pieces = emulator_get_lds_access(inst)
+    if op.startswith('ds_read'):
+        d = opr[0][1]
+        def run(w, lds):
+            rows = w.wg[:, None]
+            data = list()
+            indices = list()
+            for offset, r in pieces:
+                index = _emulator_lds_index(kernel, inst, w, w.V[addr_reg] + np.uint32(offset), dw * 4)
+                for j in range(dw):
+                    indices.append(index + j)
+                    data.append((d + r + j, lds.data[rows, index + j]))
+            lds.access(inst, w, np.stack(indices), False)
+            exec_mask = w.exec.copy()
+            def done():
+                for reg, value in data:
+                    np.copyto(w.V[reg], value, where = exec_mask)
+            w.pending['lgkm'].append(done)
+        return run
+    srcs = [o[1] for o in opr[1:]]
+    def run(w, lds):
+        rows = np.broadcast_to(w.wg[:, None], w.exec.shape)[w.exec]
+        indices = list()
+        for (offset, _), src in zip(pieces, srcs):
+            index = _emulator_lds_index(kernel, inst, w, w.V[addr_reg] + np.uint32(offset), dw * 4)
+            indices.extend(index + j for j in range(dw))
+        lds.access(inst, w, np.stack(indices), True)
+        for (offset, _), src in zip(pieces, srcs):
+            index = _emulator_lds_index(kernel, inst, w, w.V[addr_reg] + np.uint32(offset), dw * 4)[w.exec]
+            for j in range(dw):
+                lds.data[rows, index + j] = w.V[src + j][w.exec]
+        w.pending['lgkm'].append(lambda: None)
+    return run
+
+# return value of branch/barrier/end instruction, to the scheduler
+EMULATOR_BARRIER    = 1
+EMULATOR_END        = 2
+
+def _emulator_compile_branch(kernel, inst):
+    op, opr = inst.opcode, inst.operands
+    if op == 's_endpgm':
+        return lambda w: EMULATOR_END
+    if op == 's_barrier':
+        return lambda w: EMULATOR_BARRIER
+    label = opr[0][1]
+    assert label in kernel.labels, f'unknown label {label} in {kernel.name}'
+    target = kernel.labels[label]
+    if op == 's_branch':
+        def run(w):
+            w.pc = target
+        return run
+    cond = {
+        's_cbranch_scc0'    : lambda w: ~w.scc,
+        's_cbranch_scc1'    : lambda w: w.scc,
+        's_cbranch_execz'   : lambda w: ~w.exec.any(axis = 1),
+        's_cbranch_execnz'  : lambda w: w.exec.any(axis = 1),
+        's_cbranch_vccz'    : lambda w: ~(w.vcc & w.exec).any(axis = 1),
+        's_cbranch_vccnz'   : lambda w: (w.vcc & w.exec).any(axis = 1),
+    }[op]
+    def run(w):
+        taken = cond(w)
+        if taken.all():
+            w.pc = target
+        elif taken.any():
+            return (taken, target)      # waves do not agree, scheduler splits the group
+    return run
+
+def _emulator_compile(kernel, inst):
+    category = ir_get_category(inst.opcode)
+    if category == IR_CATEGORY_VALU:
+        return _emulator_compile_valu(inst)
+    if category == IR_CATEGORY_LDS:
+        f = _emulator_compile_lds(kernel, inst)
+        f.lds = True
+        return f
+    if category == IR_CATEGORY_VMEM:
+        f = _emulator_compile_vmem(inst)
+        f.memory = True
+        f.vmem = True
+        return f
+    if category in (IR_CATEGORY_BRANCH, IR_CATEGORY_BARRIER):
+        return _emulator_compile_branch(kernel, inst)
+    f = _emulator_compile_salu(kernel, inst)
+    if category == IR_CATEGORY_SMEM:
+        f.memory = True
+    return f
+
+class emulator_t(object):
+    '''
+    run one kernel of emulator_parse() on an emulator_memory_t. lds_observer(inst, w)/vmem_observer(inst, w) if
+    given, is called before every lds/buffer instruction, with the registers it reads its address from
+    '''
+    def __init__(self, kernel, memory, workgroup_batch = EMULATOR_WORKGROUP_BATCH, lds_observer = None, vmem_observer = None):
+        assert np is not None, 'numpy is needed for emulator'
+        self.kernel = kernel
+        self.memory = memory
+        self.workgroup_batch = workgroup_batch
+        self.num_insts = 0
+        # bind memory/lds to instructions once, the main loop then only calls f(w)
+        self.calls = list()
+        self.lds = None
+        for inst in kernel.insts:
+            f = inst.func
+            if getattr(f, 'vmem', False) and vmem_observer:
+                def call(w, f = f, inst = inst):
+                    vmem_observer(inst, w)
+                    return f(w, self.memory)
+                self.calls.append(call)
+            elif getattr(f, 'memory', False):
+                self.calls.append(lambda w, f = f: f(w, self.memory))
+            elif getattr(f, 'lds', False) and lds_observer:
+                def call(w, f = f, inst = inst):
+                    lds_observer(inst, w)
+                    return f(w, self.lds)
+                self.calls.append(call)
+            elif getattr(f, 'lds', False):
+                self.calls.append(lambda w, f = f: f(w, self.lds))
+            else:
+                self.calls.append(f)
+
+    def launch(self, grid_size, kernarg):
+        '''
+        run grid_size workgroups, kernarg is bytes of kernel argument segment
+        '''
+        kernarg_addr = self.memory.alloc('kernarg', kernarg)
+        for first in range(0, grid_size, self.workgroup_batch):
+            self.run_batch(list(range(first, min(grid_size, first + self.workgroup_batch))), kernarg_addr)
+
+    def run_batch(self, wg_ids, kernarg_addr):
+        k = self.kernel
+        waves_per_wg = (k.block_size + EMULATOR_WAVE_SIZE - 1) // EMULATOR_WAVE_SIZE
+        num_waves = len(wg_ids) * waves_per_wg
+        w = emulator_waves_t(num_waves, max(k.vgpr_count, 1))
+        w.wg = np.repeat(np.arange(len(wg_ids)), waves_per_wg)
+        w.wg_id = np.repeat(np.array(wg_ids, dtype = np.int64), waves_per_wg)
+        tid = (np.arange(num_waves) % waves_per_wg)[:, None] * EMULATOR_WAVE_SIZE + np.arange(EMULATOR_WAVE_SIZE)
+        w.V[0] = tid
+        w.set_exec(tid < k.block_size)
+        w.S[0] = kernarg_addr & 0xffffffff
+        w.S[1] = kernarg_addr >> 32
+        w.S[k.user_sgpr_count] = w.wg_id
+        self.lds = emulator_lds_t(len(wg_ids), k.lds_size)
+
+        runnable, at_barrier = [w], []
+        while runnable or at_barrier:
+            if not runnable:
+                # every group still alive is at a barrier
+                runnable, at_barrier = at_barrier, []
+                self.lds.barrier()
+            g = runnable.pop()
+            r = self.run_group(g)
+            if r == EMULATOR_BARRIER:
+                at_barrier.append(g)
+            elif r != EMULATOR_END:
+                taken, target = r
+                a, b = g.take(np.nonzero(taken)[0]), g.take(np.nonzero(~taken)[0])
+                a.pc = target
+                runnable.extend([a, b])
+
+    def run_group(self, w):
+        insts, calls = self.kernel.insts, self.calls
+        num_insts = len(insts)
+        while True:
+            assert w.pc < num_insts, f'{self.kernel.name} runs past the last instruction'
+            pc = w.pc
+            w.pc += 1
+            r = calls[pc](w)
+            w.num_insts += 1
+            if r is not None:
+                self.num_insts += w.num_insts
+                w.num_insts = 0
+                if r == EMULATOR_END:
+                    w.flush()
+                return r
+            if w.num_insts > EMULATOR_MAX_INSTS:
+                raise emulator_error_t(f'{self.kernel.name} does not end after {EMULATOR_MAX_INSTS} instructions, at "{insts[pc].text}"')
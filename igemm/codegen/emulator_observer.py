@@ -0,0 +1,99 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+# base of analyzers the emulator calls before every lds/buffer instruction, with the registers at issue.
+# lane addresses are the ones the emitted code computes, they are not derived again from ctrl_thread_mapping_t
+# or the lds layout of the tunable: igemm_bwd_gtc_t turns those into shift/mask arithmetic the emulator runs as is,
+# so the analysis always sees the layout the kernel really has. the limitation is it needs numpy, a problem to
+# run on, and a kernel the emulator can run (code object v3, bwd)
+from .emulator import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def emulator_observer_count_distinct(x):
+    '''
+    number of distinct non negative values in every row of x, inactive lanes are given negative value
+    '''
+    x = np.sort(x, axis = 1)
+    return ((x >= 0) & np.concatenate([np.ones((len(x), 1), dtype = bool), x[:, 1:] != x[:, :-1]], axis = 1)).sum(axis = 1)
+
+class emulator_observer_t(object):
+    '''
+    lds_observer/vmem_observer of emulator_t. observe() gives counts of one instruction summed over waves, which are
+    accumulated per instruction. call add_launch() after every launch, so totals can be given per workgroup
+    '''
+    def __init__(self):
+        self.stats = dict()         # emulator_inst_t -> list of counts of observe()
+        self.num_workgroups = 0
+
+    def __call__(self, inst, w):
+        counts = self.observe(inst, w)
+        stat = self.stats.setdefault(inst, [0] * len(counts))
+        for i, c in enumerate(counts):
+            stat[i] += c
+
+    def observe(self, inst, w):
+        '''
+        list of counts of inst, on every wave of w
+        '''
+        assert False
+
+    def add_launch(self, grid_size, memory):
+        self.num_workgroups += grid_size
+
+    def get_per_workgroup(self, index):
+        '''
+        count at index of observe(), of all instructions, per workgroup
+        '''
+        return sum(s[index] for s in self.stats.values()) / max(self.num_workgroups, 1)
+
+    def get_waste(self, stat):
+        '''
+        how much worse than ideal an instruction is, 0 if it is ideal
+        '''
+        assert False
+
+    def get_worst(self):
+        '''
+        list of (inst, *counts) that are not ideal, worst first
+        '''
+        worst = [(inst, *s) for inst, s in self.stats.items() if self.get_waste(s) > 0]
+        return sorted(worst, key = lambda x: self.get_waste(x[1:]), reverse = True)
+
+    def get_summary(self):
+        assert False
+
+    def get_inst_summary(self, stat):
+        assert False
+
+    def report(self, top = 3):
+        '''
+        one line per kernel, then the worst instructions
+        '''
+        return [self.get_summary()] + [f'    {self.get_inst_summary(x[1:])}: "{x[0].text}"' for x in self.get_worst()[:top]]
@@ -0,0 +1,104 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+# global memory coalescing of buffer instructions, see emulator_observer.py for where lane addresses come from
+from .emulator_observer import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+GMEM_COALESCING_SEGMENT_BYTES   = 64        # one memory transaction
+GMEM_COALESCING_LINE_BYTES      = 128       # l2 cache line
+
+def gmem_coalescing_segments(addr, active, dw):
+    '''
+    (segments, bytes) every wave touches with one request, addr/active are (waves, 64) byte address and lanes
+    that really access memory. bytes are distinct ones, lanes of the same address are counted once
+    '''
+    dword = (np.asarray(addr, dtype = np.int64) >> 2)[:, :, None] + np.arange(dw)
+    dword = np.where(active[:, :, None], dword, -1).reshape(len(dword), -1)
+    segment = np.where(dword >= 0, dword // (GMEM_COALESCING_SEGMENT_BYTES // 4), -1)
+    return emulator_observer_count_distinct(segment), 4 * emulator_observer_count_distinct(dword)
+
+class gmem_coalescing_t(emulator_observer_t):
+    '''
+    transactions of every buffer instruction of a kernel, counts are [requests, segments, ideal segments, bytes].
+    l2 footprint of a workgroup is collected as well
+    '''
+    def __init__(self):
+        super().__init__()
+        self.lines = list()         # (workgroup id, l2 line address) of current launch
+        self.footprint = dict()     # buffer name -> bytes of l2 lines touched, summed over workgroups
+
+    def observe(self, inst, w):
+        ndw, get_addr = emulator_get_buffer_access(inst)
+        addr, in_range = get_addr(w)
+        active = w.exec & in_range
+        segments, nbytes = gmem_coalescing_segments(addr, active, ndw)
+        ideal = -(-nbytes // GMEM_COALESCING_SEGMENT_BYTES)
+        line = (addr.astype(np.int64)[:, :, None] + 4 * np.arange(ndw)) // GMEM_COALESCING_LINE_BYTES
+        wg = np.broadcast_to(w.wg_id[:, None, None], line.shape)
+        mask = np.broadcast_to(active[:, :, None], line.shape)
+        self.lines.append(np.unique(np.stack([wg[mask], line[mask]], axis = 1), axis = 0))
+        return [int(active.any(axis = 1).sum()), int(segments.sum()), int(ideal.sum()), int(nbytes.sum())]
+
+    def add_launch(self, grid_size, memory):
+        '''
+        close footprint of the launch just run, memory tells name of the buffer of an address
+        '''
+        if self.lines:
+            lines = np.unique(np.concatenate(self.lines), axis = 0)[:, 1]
+            buf = (lines * GMEM_COALESCING_LINE_BYTES) >> 32
+            for b, count in zip(*np.unique(buf, return_counts = True)):
+                name = memory.buffers[int(b) - 1][0]
+                self.footprint[name] = self.footprint.get(name, 0) + int(count) * GMEM_COALESCING_LINE_BYTES
+        self.lines = list()
+        super().add_launch(grid_size, memory)
+
+    def get_transactions(self):
+        '''
+        (transactions, ideal transactions, wasted bytes) of all buffer instructions, per workgroup
+        '''
+        segments = self.get_per_workgroup(1)
+        return segments, self.get_per_workgroup(2), segments * GMEM_COALESCING_SEGMENT_BYTES - self.get_per_workgroup(3)
+
+    def get_waste(self, stat):
+        return stat[1] - stat[2]
+
+    def get_summary(self):
+        segments, ideal, wasted = self.get_transactions()
+        n = max(self.num_workgroups, 1)
+        fetched = segments * GMEM_COALESCING_SEGMENT_BYTES
+        footprint = ' '.join(f'{name}:{nbytes / n / 1024:.1f}KB' for name, nbytes in self.footprint.items())
+        return f'gmem:{segments:.0f} transactions/wg, {segments / ideal if ideal else 1.0:.2f}x of coalesced, ' + \
+                    f'{100 * wasted / fetched if fetched else 0:.0f}% bytes wasted, l2 footprint/wg {footprint}'
+
+    def get_inst_summary(self, stat):
+        requests, s, i, nbytes = stat
+        return f'{s / requests:.2f} transactions/request (coalesced {i / requests:.2f}), ' + \
+                    f'{100 * (1 - nbytes / (s * GMEM_COALESCING_SEGMENT_BYTES)):.0f}% wasted, {requests} requests'
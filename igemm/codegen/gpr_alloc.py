@@ -0,0 +1,131 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# liveness of named register ranges over recorded ir, and allocator that lets ranges
+# not live at the same time share physical registers.
+import re
+from .node import *
+
+def _gpr_alloc_get_loops(ir):
+    '''
+    list of (first, last) stmt index of loop, from backward branch and .rept/.endr
+    '''
+    labels = dict()
+    loops = []
+    rept = []
+    for i, stmt in enumerate(ir):
+        if type(stmt) is label_t:
+            labels[stmt.name] = i
+        elif type(stmt) is text_t:
+            directive = stmt.text.split(None, 1)[0] if stmt.text.strip() else ''
+            if directive == '.rept':
+                rept.append(i)
+            elif directive == '.endr' and rept:
+                loops.append((rept.pop(), i))
+        elif type(stmt) is inst_t and stmt.category == IR_CATEGORY_BRANCH and stmt.src:
+            target = str(stmt.src[-1])
+            if target in labels:
+                loops.append((labels[target], i))
+    return loops
+
+def gpr_get_live_ranges(ir, names, kind = 'v'):
+    '''
+    first and last stmt index where each name (symbol of register range) is referenced. source of store
+    is read at issue on gfx9 (same model as waitcnt), so its range ends at the store.
+    physical register (e.g. v0) is returned with int key. a range crossing a loop covers
+    the whole loop. return (ranges, extents), extents is name -> max offset + 1 referenced by instruction
+    '''
+    names = set(names)
+    re_name = re.compile(r'(?<![\w\\.])([A-Za-z_]\w*)\b')
+    re_phy = re.compile(rf'(?<![\w\\]){kind}(?:(\d+)\b|\[(\d+)\])')
+    ranges = dict()
+    extents = dict()
+    def touch(key, i):
+        if key in ranges:
+            ranges[key][1] = max(ranges[key][1], i)
+        else:
+            ranges[key] = [i, i]
+
+    for i, stmt in enumerate(ir):
+        if type(stmt) is not inst_t:
+            continue
+        for o in stmt.dst + stmt.src:
+            if type(o) is opr_reg_t and o.kind == kind and o.offset is not None:
+                if o.base == '':
+                    for r in range(o.offset, o.offset + o.count):
+                        touch(r, i)
+                    continue
+                if o.base in names:
+                    extents[o.base] = max(extents.get(o.base, 0), o.offset + o.count)
+        # anything else, including macro argument and register expression, is matched by text
+        text = stmt.to_str()
+        if stmt.comment:
+            text = text[:len(text) - len(stmt.comment)]
+        text = text[len(stmt.opcode):]
+        for n in re_name.findall(text):
+            if n in names:
+                touch(n, i)
+        for m in re_phy.finditer(text):
+            touch(int(m.group(1) if m.group(1) else m.group(2)), i)
+
+    loops = _gpr_alloc_get_loops(ir)
+    changed = True
+    while changed:
+        changed = False
+        for first, last in loops:
+            for r in ranges.values():
+                if r[0] <= last and r[1] >= first and (r[0] > first or r[1] < last):
+                    r[0], r[1] = min(r[0], first), max(r[1], last)
+                    changed = True
+    return ranges, extents
+
+class gpr_alloc_t(object):
+    '''
+    first fit by start of live range. physical registers are pinned where they are.
+    '''
+    def __init__(self):
+        self.requests = []      # (name, size, alignment, live_range)
+        self.fixed = []         # (offset, size, live_range)
+        self.count = 0
+    def add(self, name, size, alignment, live_range):
+        self.requests.append((name, size, alignment, live_range))
+    def add_fixed(self, offset, size, live_range):
+        self.fixed.append((offset, size, live_range))
+    def __call__(self):
+        allocated = dict()
+        active = [(offset, size, live_range) for offset, size, live_range in self.fixed]
+        self.count = max([offset + size for offset, size, _ in self.fixed] + [0])
+        for name, size, alignment, live_range in sorted(self.requests, key = lambda r: (r[3][0], -r[1], r[0])):
+            # last use and new define in the same instruction can't share, so overlap is inclusive
+            busy = sorted((o, o + s) for o, s, lr in active if lr[0] <= live_range[1] and lr[1] >= live_range[0])
+            offset = 0
+            for b_start, b_end in busy:
+                if offset + size <= b_start:
+                    break
+                offset = max(offset, (b_end + alignment - 1) // alignment * alignment)
+            allocated[name] = offset
+            active.append((offset, size, live_range))
+            self.count = max(self.count, offset + size)
+        return allocated
@@ -0,0 +1,84 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+# lds bank conflict of ds instructions, see emulator_observer.py for where lane addresses come from
+from .emulator_observer import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LDS_BANK_NUM            = 32
+LDS_BANK_BYTES          = 4
+LDS_BANK_PHASE_BYTES    = LDS_BANK_NUM * LDS_BANK_BYTES     # lds serves this many bytes of a wave per cycle
+
+def lds_bank_cycles(addr, active, dw):
+    '''
+    (cycles, conflict free cycles) of one access for every wave, addr/active are (waves, 64) byte address and exec.
+    lanes are served in phases of 128 bytes (32 lanes of b32, 16 of b64, 8 of b96/b128), a phase takes as many
+    cycles as the most distinct dwords falling into one bank. lanes reading the same dword are broadcast
+    '''
+    lanes_per_phase = LDS_BANK_PHASE_BYTES // (LDS_BANK_BYTES * (4 if dw == 3 else dw))
+    num_waves = addr.shape[0]
+    dword = (np.asarray(addr, dtype = np.int64) >> 2)[:, :, None] + np.arange(dw)
+    dword = np.where(active[:, :, None], dword, -1).reshape(-1, lanes_per_phase * dw)
+    dword = np.sort(dword, axis = 1)
+    distinct = (dword >= 0) & np.concatenate([np.ones((len(dword), 1), dtype = bool), dword[:, 1:] != dword[:, :-1]], axis = 1)
+    # inactive lanes and repeated dwords go into an extra bank that is not counted
+    bank = np.where(distinct, dword % LDS_BANK_NUM, LDS_BANK_NUM) + (LDS_BANK_NUM + 1) * np.arange(len(dword))[:, None]
+    degree = np.bincount(bank.ravel(), minlength = len(dword) * (LDS_BANK_NUM + 1)).reshape(len(dword), -1)[:, :LDS_BANK_NUM].max(axis = 1)
+    degree = degree.reshape(num_waves, -1)
+    return degree.sum(axis = 1), (degree > 0).sum(axis = 1)
+
+class lds_bank_t(emulator_observer_t):
+    '''
+    bank conflict of every ds instruction of a kernel, counts are [issues, cycles, conflict free cycles]
+    '''
+    def observe(self, inst, w):
+        addr_reg, dw, pieces = emulator_get_lds_access(inst)
+        cycles, ideal = 0, 0
+        for offset, _ in pieces:
+            c, i = lds_bank_cycles(w.V[addr_reg] + np.uint32(offset), w.exec, dw)
+            cycles, ideal = cycles + int(c.sum()), ideal + int(i.sum())
+        return [int(w.exec.any(axis = 1).sum()), cycles, ideal]
+
+    def get_cycles(self):
+        '''
+        (cycles, conflict free cycles) of all lds instructions, per workgroup
+        '''
+        return self.get_per_workgroup(1), self.get_per_workgroup(2)
+
+    def get_waste(self, stat):
+        return stat[1] - stat[2]
+
+    def get_summary(self):
+        cycles, ideal = self.get_cycles()
+        return f'lds:{cycles:.0f} cycles/wg, {cycles / ideal if ideal else 1.0:.2f}x of conflict free'
+
+    def get_inst_summary(self, stat):
+        issues, c, i = stat
+        return f'{c / i:.2f}-way, {(c - i) / max(self.num_workgroups, 1):.0f} conflict cycles/wg, {issues} issues'
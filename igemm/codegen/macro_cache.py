@@ -0,0 +1,94 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+from .build_cache import *
+
+def macro_cache_signature(value, visiting = None):
+    '''
+    hashable value of everything a macro body may depend on, with a stable repr so it can also
+    be part of a build cache key. mc and emit functions injected by mc are skipped. an object met
+    again inside itself is recorded by type only, value of unknown type is rejected since repr() of
+    it may differ run by run (address) or miss content
+    '''
+    if value is None or type(value) in (bool, int, float, str):
+        return value
+    visiting = visiting if visiting is not None else set()
+    if id(value) in visiting:
+        return ('<cycle>', type(value).__name__)
+    visiting.add(id(value))
+    if type(value) in (list, tuple):
+        signature = tuple(macro_cache_signature(v, visiting) for v in value)
+    elif type(value) is dict:
+        signature = tuple(sorted((k, macro_cache_signature(v, visiting)) for k, v in value.items()))
+    elif hasattr(value, '__dict__'):
+        signature = (type(value).__name__,) + tuple(sorted((k, macro_cache_signature(v, visiting)) for k, v in vars(value).items()
+                    if k != 'mc' and not callable(v)))
+    else:
+        assert False, f'can not make macro cache signature of {type(value).__name__} value {value!r}'
+    visiting.remove(id(value))
+    return signature
+
+class macro_cache_t(object):
+    '''
+    rendered text of macro, keyed by name(), parameters of the macro object, arch and indent.
+    memory part is shared by every instance in this process. if build_cache_t is given, text is
+    also kept there (with generator hash in the key), so following runs skip rendering as well
+    '''
+    memo = dict()
+    def __init__(self, cache = None):
+        # own build_cache_t on the same directory, hit/miss of macro do not mix with kernels
+        self.cache = build_cache_t(cache.cache_dir) if cache else None
+        self.hit = 0
+        self.miss = 0
+
+    def get_key(self, mc, macro):
+        return (macro.name(), macro_cache_signature(macro), macro_cache_signature(mc.arch_config), mc.emitter.get_indent())
+
+    def render(self, mc, macro):
+        key = self.get_key(mc, macro)
+        text = self.memo.get(key)
+        if text is None and self.cache:
+            disk_key = self.cache.get_key('macro', key, build_cache_generator_hash())
+            text = self.cache.load_text(disk_key)
+            if text is None:
+                text = self._render(mc, macro)
+                self.cache.store_text(disk_key, text)
+            else:
+                self.hit += 1
+        elif text is None:
+            text = self._render(mc, macro)
+        else:
+            self.hit += 1
+        self.memo[key] = text
+        return text
+
+    def _render(self, mc, macro):
+        self.miss += 1
+        with mc.deferred_context():
+            macro.emit()
+        return mc.get_deferred().join()
+
+    def summary(self):
+        return f'macro cache: {self.hit} hit, {self.miss} miss'
@@ -23,9 +23,13 @@
 #  SOFTWARE.
 # 
 ################################################################################
+import re
 import sys
 import inspect
 from copy import deepcopy
+from .node import *
+from .macro_cache import *
+from .profiler import *
 
 class _mc_indent_context_manager_t(object):
     def __init__(self, indent, enter_func=None, exit_func=None):
@@ -67,12 +71,54 @@ class _mc_indent_t(object):
     def get(self):
         return self.level
 
+class mc_rope_t(object):
+    '''
+    append-only list of string chunks. a chunk can be another rope, which is kept as a
+    reference instead of being flattened, so nested deferred buffers cost O(1) to splice.
+    the whole tree is joined only once, when the final string is requested.
+    '''
+    __slots__ = ('chunks',)
+    def __init__(self):
+        self.chunks = []
+    def append(self, s):
+        self.chunks.append(s)
+    def iter_chunks(self):
+        # iterative walk, deferred blocks can be nested deeply
+        stack = [iter(self.chunks)]
+        while stack:
+            for c in stack[-1]:
+                if type(c) is mc_rope_t:
+                    stack.append(iter(c.chunks))
+                    break
+                yield c
+            else:
+                stack.pop()
+    def join(self):
+        return ''.join(self.iter_chunks())
+    def __str__(self):
+        return self.join()
+    def __len__(self):
+        return sum(len(c) for c in self.iter_chunks())
+    def __bool__(self):
+        return any(len(c) != 0 for c in self.iter_chunks())
+    def __add__(self, other):
+        return self.join() + other
+    def __radd__(self, other):
+        return other + self.join()
+
 class mc_emit_to_string_t(object):
     def __init__(self, indent = _mc_indent_t(4)):
         self.indent = indent
-        self.string_buffer = ''
+        self.rope = mc_rope_t()
+        self.string_buffer = None       # joined lazily from rope
     def emit(self, s):
-        self.string_buffer += self.indent() + s + '\n'
+        if type(s) is mc_rope_t:
+            self.rope.append(self.indent())
+            self.rope.append(s)
+            self.rope.append('\n')
+        else:
+            self.rope.append(self.indent() + s + '\n')
+        self.string_buffer = None
     def open(self):
         pass
     def close(self):
@@ -84,7 +130,14 @@ class mc_emit_to_string_t(object):
     def dec_indent(self):
         self.indent.dec()
     def get_buffer(self):
+        if self.string_buffer is None:
+            # join once, and keep the joined string as the only chunk
+            self.string_buffer = self.rope.join()
+            self.rope = mc_rope_t()
+            self.rope.append(self.string_buffer)
         return self.string_buffer
+    def get_rope(self):
+        return self.rope
     def set_indent(self, level):
         self.indent.set(level)
     def get_indent(self):
@@ -94,7 +147,7 @@ class mc_emit_to_iostream_t(object):
     def __init__(self, indent = _mc_indent_t(4)):
         self.indent = indent
     def emit(self, s):
-        print(self.indent() + s)
+        print(self.indent() + str(s))
     def open(self):
         pass
     def close(self):
@@ -120,7 +173,12 @@ class mc_emit_to_file_t(object):
         self.close()
     def emit(self, s):
         if self.f:
-            self.f.write(self.indent() + s + '\n')
+            if type(s) is mc_rope_t:
+                self.f.write(self.indent())
+                self.f.writelines(s.iter_chunks())
+                self.f.write('\n')
+            else:
+                self.f.write(self.indent() + s + '\n')
     def open(self):
         if self.f == None:
             try:
@@ -151,14 +209,17 @@ class mc_deferred_emit_t(object):
     '''
     def __init__(self, upper_emitter):
         self.indent = upper_emitter.indent  # manage the indent here
-        self.buffer = ''
+        self.rope = mc_rope_t()
         self.is_first_line = True
     def emit(self, s):
         if self.is_first_line:
-            self.buffer += s
+            self.rope.append(s)
             self.is_first_line = False
+        elif type(s) is mc_rope_t:
+            self.rope.append('\n' + self.indent())
+            self.rope.append(s)
         else:
-            self.buffer += '\n' + self.indent() + s
+            self.rope.append('\n' + self.indent() + s)
     def open(self):
         pass
     def close(self):
@@ -174,7 +235,51 @@ class mc_deferred_emit_t(object):
     def get_indent(self):
         return self.indent.get()
     def get_buffer(self):
-        return self.buffer
+        return self.rope.join()
+    def get_rope(self):
+        return self.rope
+
+class mc_emit_to_ir_t(object):
+    '''
+    parse emitted text into ir statements, indent is kept inside each statement
+    '''
+    def __init__(self, upper_emitter):
+        self.indent = upper_emitter.indent
+        self.ir = ir_t()
+    def emit(self, s):
+        self.ir.extend(ir_parse(s, len(self.indent())))
+    def open(self):
+        pass
+    def close(self):
+        pass
+    def indent_context(self, enter_func=None, exit_func=None):
+        return _mc_indent_context_manager_t(self.indent, enter_func, exit_func)
+    def inc_indent(self):
+        self.indent.inc()
+    def dec_indent(self):
+        self.indent.dec()
+    def set_indent(self, level):
+        self.indent.set(level)
+    def get_indent(self):
+        return self.indent.get()
+    def get_ir(self):
+        return self.ir
+
+class mc_macro_reference_t(object):
+    '''
+    record names that may be macro invocations in emitted text.
+    a macro invocation is always the first token of a line, and macro names all start with '.',
+    so directives like .set/.text are also collected, and only filtered out against known macros later.
+    '''
+    _first_token = re.compile(r'^[ \t]*(\.[A-Za-z_][\w.]*)', re.M)
+    def __init__(self, *text):
+        self.referenced = set()
+        for t in text:
+            self.scan(t)
+    def scan(self, text):
+        self.referenced.update(self._first_token.findall(str(text)))
+    def __contains__(self, name):
+        return name in self.referenced
 
 class mc_asm_printer_t(object):
     '''
@@ -184,15 +289,46 @@ class mc_asm_printer_t(object):
         self.emitter = emitter
         self.emitter.open()
         self.deferred_buffer = ''
+        self.recorded_ir = None
+        self.profiler = None                # mc_profiler_t, by set_profiler()
         self.global_bucket = set()          # for uniqueness
         self.unique_emitter_dict = dict()
         self.arch_config = arch_config
+        self.macro_cache = macro_cache_t()  # driver may replace it with one backed by build cache
 
         if type(emitter) is mc_emit_to_file_t:
             self.emit_license()
             self.emit('; generated by igemm_codegen.py')
             self.emit(';')
 
+    def set_profiler(self, profiler):
+        '''
+        count text emitted and time the work of mc and of every mc_base_t created after this.
+        without profiler, nothing is wrapped
+        '''
+        self.profiler = profiler
+        def counted(name, func):
+            def wrapper(*args):
+                profiler.count(args[0] if args else '')
+                return profiler.call(name, func, *args, event = False)
+            return wrapper
+        def timed(name, func, replay):
+            def wrapper(*args, **kwargs):
+                return profiler.call(name, func, *args, replay = replay, **kwargs)
+            return wrapper
+        for name in ('emit', 'emit_front', 'emit_empty_line'):
+            setattr(self, name, counted(f'mc_asm_printer_t.{name}', getattr(self, name)))
+        for name in ('render_macro', 'emit_ir', 'emit_all_unique', 'emit_referenced_unique'):
+            setattr(self, name, timed(f'mc_asm_printer_t.{name}', getattr(self, name), True if name in MC_PROFILER_REPLAY_METHODS else None))
+
+    def profile_kernel_context(self, name):
+        '''
+        time and text of generating a kernel, nothing if no profiler
+        '''
+        if self.profiler:
+            return self.profiler.kernel_context(name)
+        return _mc_indent_context_manager_t(None)
+
     def emit_license(self):
         self.emit('/*******************************************************************************')
         self.emit(' *')
@@ -236,7 +372,42 @@ class mc_asm_printer_t(object):
     def emit_all_unique(self):
         # Note! sort by name here!
         for k, v in sorted(self.unique_emitter_dict.items()):
-            v.emit()
+            self.emit(self.render_macro(v))
+
+    def emit_referenced_unique(self, macro_reference):
+        '''
+        only emit macros reachable from names in macro_reference (mc_macro_reference_t).
+        every macro is rendered once to find what it invokes itself, then emitted with
+        dependency first. macros without dependency between them are still sorted by name.
+        '''
+        body = dict()
+        deps = dict()
+        pending = sorted(k for k in self.unique_emitter_dict if k in macro_reference)
+        while pending:
+            k = pending.pop()
+            if k in body:
+                continue
+            body[k] = self.render_macro(self.unique_emitter_dict[k])
+            ref = mc_macro_reference_t(body[k])
+            deps[k] = sorted(d for d in self.unique_emitter_dict if d != k and d in ref)
+            pending.extend(d for d in deps[k] if d not in body)
+
+        emitted = set()
+        def emit_with_deps(k):
+            if k in emitted:
+                return
+            emitted.add(k)
+            for d in deps[k]:
+                emit_with_deps(d)
+            self.emit(body[k])
+        for k in sorted(body):
+            emit_with_deps(k)
+
+    def render_macro(self, macro):
+        '''
+        text of macro.emit() at current indent, taken from macro_cache if the same macro is already rendered
+        '''
+        return self.macro_cache.render(self, macro)
 
     # def emit_unique(self, e):
     #     if e.name() in self.global_bucket:
@@ -287,12 +458,37 @@ class mc_asm_printer_t(object):
                 self.outter.emitter = self.deferred_emitter
             def __exit__(self, type, value, traceback):
                 self.outter.emitter = self.original_emitter
-                self.outter.deferred_buffer = self.deferred_emitter.get_buffer()
+                self.outter.deferred_buffer = self.deferred_emitter.get_rope()    # splice later, no flatten here
         return deferred_context_t(self)
 
     def get_deferred(self):
         return self.deferred_buffer
 
+    def record_context(self):
+        '''
+        like deferred_context, but emitted text is parsed into ir_t, which can be analyzed/reordered,
+        then printed by emit_ir()
+        '''
+        class record_context_t(object):
+            def __init__(self, outter):
+                self.outter = outter
+                self.original_emitter = outter.emitter
+                self.record_emitter = mc_emit_to_ir_t(self.original_emitter)
+            def __enter__(self):
+                self.outter.emitter = self.record_emitter
+            def __exit__(self, type, value, traceback):
+                self.outter.emitter = self.original_emitter
+                self.outter.recorded_ir = self.record_emitter.get_ir()
+        return record_context_t(self)
+
+    def get_recorded(self):
+        return self.recorded_ir
+
+    def emit_ir(self, ir):
+        # every statement carries absolute indent
+        for stmt in ir:
+            self.emit_front(stmt.emit_str())
+
     def inject(self, other):
         '''
         useful to inject some control func here
@@ -312,6 +508,9 @@ class mc_asm_printer_t(object):
         other._indent_context = self.indent_context
         other._deferred_context = self.deferred_context
         other._get_deferred = self.get_deferred
+        other._record_context = self.record_context
+        other._get_recorded = self.get_recorded
+        other._emit_ir = self.emit_ir
         other._insert_unique = self.insert_unique
 
 class mc_base_t(object):
@@ -321,3 +520,5 @@ class mc_base_t(object):
     def __init__(self, mc):
         self.mc = mc
         mc.inject(self)
+        if mc.profiler:
+            mc.profiler.instrument(type(self))
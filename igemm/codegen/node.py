@@ -24,35 +24,378 @@
 # 
 ################################################################################
 # simple implementation of node, used for better organize and schedule
-# basically, every instruction arg to be accept is string
+# an emitted text line is parsed into one statement. instructions keep typed operands,
+# everything else (comments, directives, metadata) is kept as raw text, so printing is lossless for them.
+import re
 
+IR_CATEGORY_VALU        = 'valu'
+IR_CATEGORY_SALU        = 'salu'
+IR_CATEGORY_SMEM        = 'smem'
+IR_CATEGORY_VMEM        = 'vmem'
+IR_CATEGORY_LDS         = 'lds'
+IR_CATEGORY_WAITCNT     = 'waitcnt'
+IR_CATEGORY_BARRIER     = 'barrier'
+IR_CATEGORY_BRANCH      = 'branch'
+IR_CATEGORY_MACRO       = 'macro'       # invocation of assembler macro, operands are not interpreted
+
+IR_CATEGORY_ALL = [IR_CATEGORY_VALU, IR_CATEGORY_SALU, IR_CATEGORY_SMEM, IR_CATEGORY_VMEM, IR_CATEGORY_LDS,
+                    IR_CATEGORY_WAITCNT, IR_CATEGORY_BARRIER, IR_CATEGORY_BRANCH, IR_CATEGORY_MACRO]
+
+# directives that start with '.' but are not macro invocation
+IR_DIRECTIVES = {'.set', '.text', '.globl', '.p2align', '.type', '.include', '.macro', '.endm', '.rept', '.endr',
+                '.if', '.ifdef', '.ifndef', '.else', '.elseif', '.endif', '.rodata', '.section', '.size', '.long',
+                '.short', '.byte', '.quad', '.align', '.weak', '.data', '.error', '.warning', '.print', '.irp', '.irpc',
+                '.exitm', '.purgem', '.equ', '.equiv', '.fill', '.space', '.string', '.ascii', '.asciz'}
+IR_DIRECTIVE_PREFIXES = ('.amdhsa_', '.end_', '.amdgpu_', '.hsa_', '.amd_')
 
 class node_t(object):
     '''
     base class for all node
     '''
-    pass
-
-
+    __slots__ = ()
 
 class operand_t(node_t):
     '''
     can be sgpr, vgpr, immediate, modifier
     '''
+    __slots__ = ()
+
+class opr_reg_t(operand_t):
+    '''
+    register or register range, e.g. v[v_c+3], s[s_p_out:s_p_out+3], v0.
+    base is symbol name ('' for physical register), offset is int, or None if expression can't be parsed,
+    then expr keeps the original text inside the bracket.
+    '''
+    __slots__ = ('kind', 'base', 'offset', 'count', 'expr')
+    def __init__(self, kind, base, offset, count = 1, expr = None):
+        self.kind = kind            # 'v', 's', 'a'
+        self.base = base
+        self.offset = offset
+        self.count = count
+        self.expr = expr
+    def __str__(self):
+        if self.expr is not None:
+            return f'{self.kind}[{self.expr}]'
+        if self.base == '' and self.count == 1:
+            return f'{self.kind}{self.offset}'
+        start = _ir_reg_expr(self.base, self.offset)
+        if self.count == 1:
+            return f'{self.kind}[{start}]'
+        return f'{self.kind}[{start}:{_ir_reg_expr(self.base, self.offset + self.count - 1)}]'
+    def get_units(self):
+        '''
+        list of (kind, base, index) for every 32bit register touched, None if not analyzable
+        '''
+        if self.offset is None:
+            return None
+        return [(self.kind, self.base, self.offset + i) for i in range(self.count)]
+
+class opr_imm_t(operand_t):
+    __slots__ = ('value', 'text')
+    def __init__(self, value, text):
+        self.value = value
+        self.text = text
+    def __str__(self):
+        return self.text
 
+class opr_sym_t(operand_t):
+    '''
+    special register (vcc, exec, m0...), label, macro argument or any other expression
+    '''
+    __slots__ = ('text',)
+    def __init__(self, text):
+        self.text = text
+    def __str__(self):
+        return self.text
 
+class opr_mod_t(operand_t):
+    '''
+    modifier, e.g. offen, offset:16, offset0:1, vmcnt(0)
+    '''
+    __slots__ = ('name', 'value', 'text')
+    def __init__(self, name, value, text):
+        self.name = name
+        self.value = value
+        self.text = text
+    def __str__(self):
+        return self.text
 
 class stmt_t(node_t):
     '''
-    statement can be a single 
+    statement can be a single line of asm. indent is number of leading spaces
+    '''
+    __slots__ = ('indent',)
+    def __init__(self, indent):
+        self.indent = indent
+    def emit_str(self):
+        return ' ' * self.indent + self.to_str()
+
+class text_t(stmt_t):
+    '''
+    comment, empty line, directive, or anything not interpreted
     '''
-    def __init__(self):
+    __slots__ = ('text',)
+    def __init__(self, text, indent = 0):
+        stmt_t.__init__(self, indent)
+        self.text = text
+    def to_str(self):
+        return self.text
 
-class inst_t(node_t):
-    def __init__(self, name):
-        assert type(name) is str
+class label_t(stmt_t):
+    __slots__ = ('name', 'comment')
+    def __init__(self, name, indent = 0, comment = ''):
+        stmt_t.__init__(self, indent)
         self.name = name
-    def __call__(self, *args):
-        return
-    def emit(self):
-        
\ No newline at end of file
+        self.comment = comment
+    def to_str(self):
+        return f'{self.name}:' + (f' {self.comment}' if self.comment else '')
+
+class inst_t(stmt_t):
+    '''
+    single instruction, or macro invocation. dst are registers written, src are read,
+    mod are modifiers. comment keeps the trailing "; ..." if any.
+    raw is the text as parsed, printed as is to keep the original format. any pass that changes
+    operands should set raw to None, then canonical form is printed
+    '''
+    __slots__ = ('opcode', 'dst', 'src', 'mod', 'category', 'comment', 'raw')
+    def __init__(self, opcode, dst = None, src = None, mod = None, indent = 0, comment = '', raw = None):
+        stmt_t.__init__(self, indent)
+        assert type(opcode) is str
+        self.opcode = opcode
+        self.dst = dst if dst else []
+        self.src = src if src else []
+        self.mod = mod if mod else []
+        self.category = ir_get_category(opcode)
+        self.comment = comment
+        self.raw = raw
+    def to_str(self):
+        if self.raw is not None:
+            return self.raw
+        s = self.opcode
+        operands = ', '.join(str(o) for o in self.dst + self.src)
+        if operands:
+            s += ' ' + operands
+        if self.mod:
+            s += ' ' + ' '.join(str(m) for m in self.mod)
+        if self.comment:
+            s += ' ' + self.comment
+        return s
+    def get_mod(self, name):
+        for m in self.mod:
+            if m.name == name:
+                return m
+        return None
+    def get_reads(self):
+        # mac/fmac accumulate into dst
+        if self.opcode in ('v_mac_f32', 'v_fmac_f32', 'v_mac_f16', 'v_fmac_f16'):
+            return self.dst + self.src
+        return self.src
+    def get_writes(self):
+        return self.dst
+
+def _ir_reg_expr(base, offset):
+    if base == '':
+        return f'{offset}'
+    return base if offset == 0 else f'{base}+{offset}'
+
+_ir_re_sym_offset = re.compile(r'^\s*(?:(\\?[A-Za-z_]\w*)|(\d+))((?:\s*[+-]\s*\d+)*)\s*$')
+_ir_re_offset_term = re.compile(r'([+-])\s*(\d+)')
+
+def _ir_parse_reg_expr(expr):
+    '''
+    "v_c+3" -> ('v_c', 3), "v_c+4+1" -> ('v_c', 5), "12" -> ('', 12), otherwise None
+    '''
+    m = _ir_re_sym_offset.match(expr)
+    if not m:
+        return None
+    offset = int(m.group(2)) if m.group(2) else 0
+    for sign, value in _ir_re_offset_term.findall(m.group(3)):
+        offset += -int(value) if sign == '-' else int(value)
+    return (m.group(1) if m.group(1) else ''), offset
+
+_ir_re_reg = re.compile(r'^([vsa])\[(.+)\]$')
+_ir_re_reg_phy = re.compile(r'^([vsa])(\d+)$')
+_ir_re_mod = re.compile(r'^([A-Za-z_]\w*)(?::(.+)|\((.*)\))$')
+_ir_mod_keywords = {'offen', 'idxen', 'glc', 'slc', 'lds', 'tfe', 'dlc', 'gds', 'addr64', 'nv', 'clamp'}
+
+def ir_parse_operand(text):
+    text = text.strip()
+    m = _ir_re_reg_phy.match(text)
+    if m:
+        return opr_reg_t(m.group(1), '', int(m.group(2)))
+    m = _ir_re_reg.match(text)
+    if m:
+        kind, inner = m.group(1), m.group(2)
+        if ':' in inner:
+            lo, hi = inner.split(':', 1)
+            p_lo, p_hi = _ir_parse_reg_expr(lo), _ir_parse_reg_expr(hi)
+            if p_lo and p_hi and p_lo[0] == p_hi[0] and p_hi[1] >= p_lo[1]:
+                return opr_reg_t(kind, p_lo[0], p_lo[1], p_hi[1] - p_lo[1] + 1)
+        else:
+            p = _ir_parse_reg_expr(inner)
+            if p:
+                return opr_reg_t(kind, p[0], p[1])
+        return opr_reg_t(kind, None, None, 1, inner)
+    try:
+        return opr_imm_t(int(text, 0), text)
+    except ValueError:
+        pass
+    try:
+        return opr_imm_t(float(text), text)
+    except ValueError:
+        pass
+    return opr_sym_t(text)
+
+def _ir_split_top_level(text, sep):
+    '''
+    split at sep (None for whitespace), but not inside [] or ()
+    '''
+    parts = []
+    depth = 0
+    cur = ''
+    for c in text:
+        if c in '[(':
+            depth += 1
+        elif c in '])':
+            depth -= 1
+        if depth == 0 and (c == sep or (sep is None and c in ' \t')):
+            parts.append(cur)
+            cur = ''
+        else:
+            cur += c
+    parts.append(cur)
+    return [p.strip() for p in parts if p.strip() != '']
+
+def ir_get_category(opcode):
+    if opcode.startswith('.'):
+        return IR_CATEGORY_MACRO
+    if opcode.startswith('v_'):
+        return IR_CATEGORY_VALU
+    if opcode.startswith('ds_'):
+        return IR_CATEGORY_LDS
+    if opcode.startswith(('buffer_', 'global_', 'flat_', 'tbuffer_', 'scratch_')):
+        return IR_CATEGORY_VMEM
+    if opcode == 's_waitcnt' or opcode.startswith('s_waitcnt_'):
+        return IR_CATEGORY_WAITCNT
+    if opcode == 's_barrier':
+        return IR_CATEGORY_BARRIER
+    if opcode.startswith(('s_branch', 's_cbranch', 's_setpc', 's_swappc', 's_endpgm')):
+        return IR_CATEGORY_BRANCH
+    if opcode.startswith(('s_load_', 's_buffer_load_', 's_store_', 's_buffer_store_', 's_dcache_')):
+        return IR_CATEGORY_SMEM
+    return IR_CATEGORY_SALU
+
+def ir_get_num_dst(opcode):
+    '''
+    how many leading operands are written
+    '''
+    if opcode.startswith(('buffer_store', 'global_store', 'flat_store', 'tbuffer_store', 'scratch_store',
+                        'ds_write', 's_store', 's_buffer_store', 's_cmp', 's_bitcmp', 's_waitcnt', 's_barrier',
+                        's_branch', 's_cbranch', 's_endpgm', 's_nop', 's_setprio', 's_sleep', 'v_cmpx', 's_dcache')):
+        return 0
+    if opcode.startswith(('v_add_co_', 'v_sub_co_', 'v_subrev_co_', 'v_addc_co_', 'v_subb_co_', 'v_subbrev_co_',
+                        'v_mad_u64_u32', 'v_mad_i64_i32', 'v_div_scale')):
+        return 2
+    return 1
+
+def ir_is_macro_invocation(token):
+    if not re.match(r'^\.[A-Za-z_][\w.]*$', token):
+        return False
+    return token not in IR_DIRECTIVES and not token.startswith(IR_DIRECTIVE_PREFIXES)
+
+_ir_re_opcode = re.compile(r'^(v|s|ds|buffer|global|flat|tbuffer|scratch)_[a-z0-9_]+$')
+_ir_re_label = re.compile(r'^([A-Za-z_.$][\w.$]*):(\s*(;.*)?)$')
+
+def ir_parse_line(line, indent = 0):
+    '''
+    parse a single line (without newline) into a statement. indent is added to the leading spaces of line
+    '''
+    stripped = line.lstrip(' ')
+    indent += len(line) - len(stripped)
+    body, comment = stripped, ''
+    if ';' in stripped:
+        i = stripped.index(';')
+        body, comment = stripped[:i].rstrip(), stripped[i:]
+    tokens = body.split(None, 1)
+    if not tokens:
+        return text_t(stripped, indent)
+    m = _ir_re_label.match(stripped)
+    if m:
+        return label_t(m.group(1), indent, m.group(3) if m.group(3) else '')
+    opcode = tokens[0]
+    if not (_ir_re_opcode.match(opcode) or ir_is_macro_invocation(opcode)):
+        return text_t(stripped, indent)
+    if len(tokens) > 1 and tokens[1].lstrip().startswith('='):
+        return text_t(stripped, indent)     # symbol assignment like ".itr_k = 0"
+
+    operands = []
+    mods = []
+    if len(tokens) > 1:
+        pieces = _ir_split_top_level(tokens[1], ',')
+        if pieces:
+            last = _ir_split_top_level(pieces[-1], None)
+            pieces = pieces[:-1] + last[:1]
+            for t in last[1:]:
+                mods.append(t)
+            # modifier can also be separated by comma, like "offset0:0, offset1:4", or be the only one, like "vmcnt(0)"
+            if ir_get_category(opcode) != IR_CATEGORY_MACRO:
+                while pieces and _ir_is_mod_text(pieces[-1]):
+                    mods.insert(0, pieces.pop())
+        operands = pieces
+    if ir_get_category(opcode) == IR_CATEGORY_MACRO:
+        # macro arguments are kept as symbols, all treated as read
+        return inst_t(opcode, [], [opr_sym_t(o) for o in operands + mods], [], indent, comment, stripped)
+    operands = [ir_parse_operand(o) for o in operands]
+    mods = [_ir_parse_mod(t) for t in mods]
+    num_dst = ir_get_num_dst(opcode)
+    return inst_t(opcode, operands[:num_dst], operands[num_dst:], mods, indent, comment, stripped)
+
+def _ir_is_mod_text(text):
+    return text in _ir_mod_keywords or _ir_re_mod.match(text) is not None
+
+def _ir_parse_mod(text):
+    m = _ir_re_mod.match(text)
+    if not m:
+        return opr_mod_t(text, None, text)
+    value = m.group(2) if m.group(2) is not None else m.group(3)
+    try:
+        value = int(value, 0)
+    except ValueError:
+        pass
+    return opr_mod_t(m.group(1), value, text)
+
+def ir_parse(text, indent = 0):
+    '''
+    parse multi-line text into list of statement. indent is applied to first line only,
+    following lines are assumed to already carry their own indent (as deferred buffer does)
+    '''
+    stmts = []
+    for i, line in enumerate(str(text).split('\n')):
+        stmts.append(ir_parse_line(line, indent if i == 0 else 0))
+    return stmts
+
+class ir_t(node_t):
+    '''
+    flat list of statement, printed back line by line
+    '''
+    __slots__ = ('stmts',)
+    def __init__(self, stmts = None):
+        self.stmts = stmts if stmts else []
+    def __iter__(self):
+        return iter(self.stmts)
+    def __len__(self):
+        return len(self.stmts)
+    def append(self, stmt):
+        self.stmts.append(stmt)
+    def extend(self, stmts):
+        self.stmts.extend(stmts)
+    def get_insts(self):
+        return [s for s in self.stmts if type(s) is inst_t]
+    def count_by_category(self):
+        cnt = {c : 0 for c in IR_CATEGORY_ALL}
+        for s in self.stmts:
+            if type(s) is inst_t:
+                cnt[s.category] += 1
+        return cnt
+    def emit_str(self):
+        return '\n'.join(s.emit_str() for s in self.stmts)
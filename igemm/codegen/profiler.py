@@ -0,0 +1,196 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# opt-in profiling of code generation, wall time and text emitted by every emitter class and by every kernel
+import os
+import json
+import time
+import inspect
+
+# methods instrumented in every mc_base_t subclass, by name or by prefix
+MC_PROFILER_METHODS = ('__call__', 'expand')
+MC_PROFILER_METHOD_PREFIXES = ('emit', 'prepare_', 'do_')
+# methods that emit text already produced and counted elsewhere, e.g. recorded body or rendered macro
+MC_PROFILER_REPLAY_METHODS = ('emit_ir', 'emit_all_unique', 'emit_referenced_unique', 'emit_kernel_buffers')
+
+_mc_profiler_instrumented = set()       # classes whose methods are already wrapped in this process
+
+class _mc_profiler_frame_t(object):
+    __slots__ = ('name', 'start', 'child', 'lines', 'bytes', 'replay')
+    def __init__(self, name, start, replay):
+        self.name = name
+        self.start = start
+        self.child = 0.0
+        self.lines = 0
+        self.bytes = 0
+        self.replay = replay
+
+class mc_profiler_t(object):
+    '''
+    set by mc_asm_printer_t.set_profiler(). every instrumented call is a frame, time of a frame is exclusive of
+    the instrumented calls inside it. lines/bytes are counted where text is produced, without indent, and go to the
+    innermost frame that is not mc itself. with trace, every frame except the emit of mc is kept as chrome trace event
+    '''
+    def __init__(self, trace = False):
+        self.trace = trace
+        self.stats = dict()     # name -> [calls, self seconds, total seconds, lines, bytes]
+        self.kernels = dict()   # kernel name -> [seconds, lines, bytes]
+        self.events = list()
+        self.stack = list()
+        self.kernel = None      # [name, start, lines, bytes] of kernel being generated
+
+    def fork(self):
+        '''
+        empty profiler with the same option, for a worker process. merge() it back after
+        '''
+        return mc_profiler_t(self.trace)
+
+    def merge(self, other):
+        for name, s in other.stats.items():
+            stat = self.stats.setdefault(name, [0, 0.0, 0.0, 0, 0])
+            for i, v in enumerate(s):
+                stat[i] += v
+        for name, k in other.kernels.items():
+            kernel = self.kernels.setdefault(name, [0.0, 0, 0])
+            for i, v in enumerate(k):
+                kernel[i] += v
+        self.events.extend(other.events)
+
+    def instrument(self, cls):
+        '''
+        wrap methods of cls and of its bases, once per class. a wrapped method only costs a check if mc of the
+        object has no profiler
+        '''
+        for c in cls.__mro__:
+            if c in _mc_profiler_instrumented or c is object:
+                continue
+            _mc_profiler_instrumented.add(c)
+            for attr, method in list(vars(c).items()):
+                if inspect.isfunction(method) and (attr in MC_PROFILER_METHODS or attr.startswith(MC_PROFILER_METHOD_PREFIXES)):
+                    setattr(c, attr, _mc_profiler_wrap(f'{c.__qualname__}.{attr}', method, attr in MC_PROFILER_REPLAY_METHODS))
+
+    def enter(self, name, replay = None):
+        '''
+        replay None to inherit from the enclosing frame
+        '''
+        if replay is None:
+            replay = self.stack[-1].replay if self.stack else False
+        self.stack.append(_mc_profiler_frame_t(name, time.perf_counter(), replay))
+
+    def leave(self, event = True):
+        frame = self.stack.pop()
+        end = time.perf_counter()
+        total = end - frame.start
+        if self.stack:
+            self.stack[-1].child += total
+        stat = self.stats.setdefault(frame.name, [0, 0.0, 0.0, 0, 0])
+        stat[0] += 1
+        stat[1] += total - frame.child
+        if all(f.name != frame.name for f in self.stack):
+            stat[2] += total        # recursive call is already in total of the outer one
+        stat[3] += frame.lines
+        stat[4] += frame.bytes
+        if self.trace and event:
+            self.events.append({'name' : frame.name, 'cat' : 'emit', 'ph' : 'X', 'ts' : frame.start * 1e6, 'dur' : total * 1e6,
+                    'pid' : os.getpid(), 'tid' : 0, 'args' : {'lines' : frame.lines, 'bytes' : frame.bytes}})
+
+    def call(self, name, func, *args, replay = None, event = True, **kwargs):
+        self.enter(name, replay)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.leave(event)
+
+    def count(self, text):
+        '''
+        text about to be emitted, str only. a rope is deferred text spliced, already counted when produced
+        '''
+        if type(text) is not str or (self.stack and self.stack[-1].replay):
+            return
+        lines = text.count('\n') + 1
+        nbytes = len(text) + lines
+        if self.stack:
+            self.stack[-1].lines += lines
+            self.stack[-1].bytes += nbytes
+        if self.kernel:
+            self.kernel[2] += lines
+            self.kernel[3] += nbytes
+
+    def kernel_context(self, name):
+        class kernel_context_t(object):
+            def __init__(self, profiler):
+                self.profiler = profiler
+            def __enter__(self):
+                self.profiler.kernel = [name, time.perf_counter(), 0, 0]
+            def __exit__(self, type, value, traceback):
+                _, start, lines, nbytes = self.profiler.kernel
+                end = time.perf_counter()
+                kernel = self.profiler.kernels.setdefault(name, [0.0, 0, 0])
+                kernel[0] += end - start
+                kernel[1] += lines
+                kernel[2] += nbytes
+                if self.profiler.trace:
+                    self.profiler.events.append({'name' : name, 'cat' : 'kernel', 'ph' : 'X', 'ts' : start * 1e6, 'dur' : (end - start) * 1e6,
+                            'pid' : os.getpid(), 'tid' : 1, 'args' : {'lines' : lines, 'bytes' : nbytes}})
+                self.profiler.kernel = None
+        return kernel_context_t(self)
+
+    def report(self, top = 20):
+        '''
+        frames sorted by exclusive time, then kernels sorted by time. 0 top for all
+        '''
+        calls = sum(s[0] for s in self.stats.values())
+        seconds = sum(s[1] for s in self.stats.values())
+        lines = sum(s[3] for s in self.stats.values())
+        nbytes = sum(s[4] for s in self.stats.values())
+        # worker processes are merged, so time can be more than wall time with --jobs
+        report = [f'profile: {seconds:.3f}s in {calls} calls, {lines} lines, {nbytes} bytes emitted',
+                f"{'self(s)':>10}{'total(s)':>10}{'calls':>9}{'lines':>9}{'bytes':>11}  name"]
+        stats = sorted(self.stats.items(), key = lambda s: s[1][1], reverse = True)
+        for name, (c, s, t, l, b) in stats[:top] if top else stats:
+            report.append(f'{s:>10.3f}{t:>10.3f}{c:>9}{l:>9}{b:>11}  {name}')
+        if self.kernels:
+            report.append(f"{'time(s)':>10}{'lines':>9}{'bytes':>11}  kernel")
+            kernels = sorted(self.kernels.items(), key = lambda k: k[1][0], reverse = True)
+            for name, (t, l, b) in kernels[:top] if top else kernels:
+                report.append(f'{t:>10.3f}{l:>9}{b:>11}  {name}')
+        return '\n'.join(report)
+
+    def write_trace(self, file_name):
+        '''
+        chrome trace json, can be loaded by chrome://tracing or perfetto
+        '''
+        with open(file_name, 'w') as f:
+            json.dump({'traceEvents' : self.events, 'displayTimeUnit' : 'ms'}, f)
+
+def _mc_profiler_wrap(name, method, replay):
+    def wrapper(obj, *args, **kwargs):
+        profiler = obj.mc.profiler
+        if profiler is None:
+            return method(obj, *args, **kwargs)
+        return profiler.call(name, method, obj, *args, replay = True if replay else False, **kwargs)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
@@ -0,0 +1,328 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+# latency-aware list scheduler over ir_t. only straight-line valu/salu/lds/vmem code is reordered,
+# anything else (label, directive, macro, barrier, branch, exec write, vmcnt wait...) is a fence that nothing moves
+# across. macros must be expanded before, see ir_macro_table_t.expand_ir(). lgkmcnt waits and comment lines inside
+# scheduled block are dropped, waits are re-computed from the new order.
+from .node import *
+from .amdgpu import *
+
+# (issue, latency) in cycles, seen from a single wave. rough numbers from public micro-benchmarks,
+# only the relative size matters for scheduling
+AMDGPU_LATENCY_TABLE = {
+    AMDGPU_ARCH_GFX900 : {
+        IR_CATEGORY_VALU : (4, 4),
+        IR_CATEGORY_SALU : (4, 4),
+        IR_CATEGORY_SMEM : (4, 200),
+        IR_CATEGORY_LDS  : (4, 64),
+        IR_CATEGORY_VMEM : (4, 520),
+        'ds_read_b64'    : (4, 72),
+        'ds_read_b128'   : (8, 88),
+        'ds_write_b128'  : (8, 88),
+    },
+    AMDGPU_ARCH_GFX906 : {
+        IR_CATEGORY_VALU : (4, 4),
+        IR_CATEGORY_SALU : (4, 4),
+        IR_CATEGORY_SMEM : (4, 200),
+        IR_CATEGORY_LDS  : (4, 64),
+        IR_CATEGORY_VMEM : (4, 480),
+        'ds_read_b64'    : (4, 72),
+        'ds_read_b128'   : (8, 88),
+        'ds_write_b128'  : (8, 88),
+    },
+    AMDGPU_ARCH_GFX908 : {
+        IR_CATEGORY_VALU : (4, 4),
+        IR_CATEGORY_SALU : (4, 4),
+        IR_CATEGORY_SMEM : (4, 180),
+        IR_CATEGORY_LDS  : (4, 64),
+        IR_CATEGORY_VMEM : (4, 440),
+        'ds_read_b64'    : (4, 68),
+        'ds_read_b128'   : (8, 80),
+        'ds_write_b128'  : (8, 80),
+    },
+}
+
+IR_SCHEDULE_CATEGORIES = (IR_CATEGORY_VALU, IR_CATEGORY_SALU, IR_CATEGORY_LDS, IR_CATEGORY_VMEM)
+# salu of plain alu only, others (s_nop, s_setprio, s_sendmsg...) have side effects not seen in operands
+IR_SCHEDULE_SALU = ('s_add', 's_sub', 's_mul', 's_lshl', 's_lshr', 's_ashr', 's_and', 's_or', 's_xor', 's_not',
+                    's_mov', 's_cmp', 's_cselect', 's_min', 's_max', 's_bfe', 's_bfm')
+IR_SPECIAL_REGS = ('vcc', 'vcc_lo', 'vcc_hi', 'exec', 'exec_lo', 'exec_hi', 'm0', 'scc')
+
+class amdgpu_latency_t(object):
+    def __init__(self, arch):
+        assert arch in AMDGPU_LATENCY_TABLE, f'no latency table for {amdgpu_arch_to_string(arch)}'
+        self.table = AMDGPU_LATENCY_TABLE[arch]
+    def get(self, inst):
+        if inst.opcode in self.table:
+            return self.table[inst.opcode]
+        if inst.category in self.table:
+            return self.table[inst.category]
+        return (4, 4)
+    def issue(self, inst):
+        return self.get(inst)[0]
+    def latency(self, inst):
+        return self.get(inst)[1]
+
+def ir_get_units(operands):
+    '''
+    set of register units touched by operands, None if any of them can't be analyzed
+    '''
+    units = set()
+    for o in operands:
+        if type(o) is opr_reg_t:
+            u = o.get_units()
+            if u is None:
+                return None
+            units.update(u)
+        elif type(o) is opr_sym_t and o.text in IR_SPECIAL_REGS:
+            units.add(('sym', o.text))
+    return units
+
+def ir_get_waitcnt(inst):
+    '''
+    (vmcnt, lgkmcnt) of a s_waitcnt, None for counter not waited
+    '''
+    vmcnt = inst.get_mod('vmcnt')
+    lgkmcnt = inst.get_mod('lgkmcnt')
+    return (vmcnt.value if vmcnt else None, lgkmcnt.value if lgkmcnt else None)
+
+class _ir_sched_node_t(object):
+    def __init__(self, index, inst, latency):
+        self.index = index
+        self.inst = inst
+        self.reads = ir_get_units(inst.get_reads())
+        self.writes = ir_get_units(inst.get_writes())
+        if inst.category == IR_CATEGORY_SALU:
+            # scc is not an operand, take every salu as reading and writing it
+            self.reads.add(('sym', 'scc'))
+            self.writes.add(('sym', 'scc'))
+        self.issue, self.latency = latency.get(inst)
+        self.preds = []         # (node, edge latency)
+        self.succs = []
+        self.height = 0
+        self.start = 0
+
+class ir_scheduler_t(object):
+    '''
+    list scheduler. within every block between fences, instructions are ordered by earliest
+    possible issue cycle, ties broken by longest latency path to the end of block.
+    lds and vmem instructions keep their relative order, so every counter based wait after
+    the block still sees the same outstanding instructions.
+    '''
+    def __init__(self, arch_config):
+        self.arch_config = arch_config
+        self.latency = amdgpu_latency_t(arch_config.arch)
+
+    def is_schedulable(self, stmt):
+        if type(stmt) is not inst_t or stmt.category not in IR_SCHEDULE_CATEGORIES:
+            return False
+        if stmt.opcode.startswith(('v_cmpx', 'v_readlane', 'v_writelane', 'v_readfirstlane')):
+            return False
+        if stmt.category == IR_CATEGORY_SALU and (not stmt.opcode.startswith(IR_SCHEDULE_SALU) or 'saveexec' in stmt.opcode):
+            return False
+        reads, writes = ir_get_units(stmt.get_reads()), ir_get_units(stmt.get_writes())
+        if reads is None or writes is None:
+            return False
+        # every vector instruction reads exec without naming it
+        if any(u[0] == 'sym' and u[1].startswith('exec') for u in writes):
+            return False
+        # valu writing sgpr/vcc may need wait states we don't model
+        return not (stmt.category == IR_CATEGORY_VALU and any(u[0] != 'v' for u in writes))
+
+    def is_dropped(self, stmt):
+        '''
+        statements re-created after scheduling: empty lines and lgkmcnt only waits. comment lines are dropped too,
+        as they can't be placed in the new order
+        '''
+        if type(stmt) is text_t:
+            return stmt.text.strip() == '' or stmt.text.strip().startswith(';')
+        if type(stmt) is inst_t and stmt.category == IR_CATEGORY_WAITCNT:
+            vmcnt, lgkmcnt = ir_get_waitcnt(stmt)
+            return vmcnt is None and lgkmcnt is not None
+        return False
+
+    def split_blocks(self, ir):
+        '''
+        list of (is_block, [stmt]). a block holds schedulable and dropped statements only
+        '''
+        regions = []
+        for stmt in ir:
+            is_block = self.is_schedulable(stmt) or self.is_dropped(stmt)
+            if regions and regions[-1][0] == is_block:
+                regions[-1][1].append(stmt)
+            else:
+                regions.append((is_block, [stmt]))
+        return regions
+
+    def build_dag(self, insts):
+        nodes = [_ir_sched_node_t(i, inst, self.latency) for i, inst in enumerate(insts)]
+        for j, nj in enumerate(nodes):
+            for ni in nodes[:j]:
+                edge = None
+                if ni.writes & nj.reads:
+                    edge = ni.latency                       # raw
+                elif ni.writes & nj.writes or ni.reads & nj.writes:
+                    edge = 0                                # waw, war
+                elif ni.inst.category == nj.inst.category and nj.inst.category in (IR_CATEGORY_LDS, IR_CATEGORY_VMEM):
+                    edge = 0                                # keep memory order
+                if edge is not None:
+                    nj.preds.append((ni, edge))
+                    ni.succs.append((nj, edge))
+        for n in reversed(nodes):
+            n.height = max([n.latency] + [e + s.height for s, e in n.succs])
+        return nodes
+
+    def schedule_block(self, insts, ready_time):
+        '''
+        ready_time is dict of unit -> cycle, for data still in flight when block starts
+        '''
+        nodes = self.build_dag(insts)
+        scheduled = []
+        done = set()
+        t = 0
+        while len(scheduled) != len(nodes):
+            best = None
+            for n in nodes:
+                if n.index in done or any(p.index not in done for p, _ in n.preds):
+                    continue
+                est = max([t] + [p.start + e for p, e in n.preds] + [ready_time.get(u, 0) for u in n.reads])
+                key = (est, -n.height, n.index)
+                if best is None or key < best[0]:
+                    best = (key, n)
+            n = best[1]
+            n.start = best[0][0]
+            t = n.start + n.issue
+            done.add(n.index)
+            scheduled.append(n.inst)
+        return scheduled
+
+    def insert_waitcnt(self, insts, lgkm_queue, indent):
+        '''
+        put lgkmcnt wait before every instruction touching a register still loaded by lds.
+        lgkm_queue is list of unit set of outstanding lds instructions, oldest first, updated in place.
+        None in queue is instruction can't be analyzed, which is waited by anyone
+        '''
+        result = []
+        for inst in insts:
+            touched = ir_get_units(inst.get_reads()) | ir_get_units(inst.get_writes())
+            last = -1
+            for i, units in enumerate(lgkm_queue):
+                if units is None or units & touched:
+                    last = i
+            if last >= 0:
+                cnt = len(lgkm_queue) - last - 1
+                result.append(ir_parse_line(f's_waitcnt lgkmcnt({cnt})', indent))
+                del lgkm_queue[:last + 1]
+            if inst.category == IR_CATEGORY_LDS:
+                lgkm_queue.append(ir_get_units(inst.get_writes()))
+            result.append(inst)
+        return result
+
+    def __call__(self, ir, lgkm_pending = None):
+        '''
+        return scheduled ir_t. lgkm_pending is list of lds inst_t still outstanding when ir starts, oldest first
+        '''
+        lgkm_queue = [ir_get_units(i.get_writes()) for i in (lgkm_pending if lgkm_pending else [])]
+        ready_time = dict()
+        for i, inst in enumerate(lgkm_pending if lgkm_pending else []):
+            for u in ir_get_units(inst.get_writes()):
+                ready_time[u] = 4 * i + self.latency.latency(inst)
+        scheduled = ir_t()
+        for is_block, stmts in self.split_blocks(ir):
+            if not is_block:
+                for stmt in stmts:
+                    if type(stmt) is inst_t and stmt.category in (IR_CATEGORY_WAITCNT, IR_CATEGORY_LDS, IR_CATEGORY_SMEM):
+                        # fence touching lgkm counter, queue from here is unknown
+                        if stmt.category == IR_CATEGORY_WAITCNT:
+                            lgkmcnt = ir_get_waitcnt(stmt)[1]
+                            if lgkmcnt is not None:
+                                del lgkm_queue[:max(len(lgkm_queue) - lgkmcnt, 0)]
+                        else:
+                            lgkm_queue.append(ir_get_units(stmt.get_writes()))
+                    scheduled.append(stmt)
+                ready_time = dict()
+                continue
+            insts = [s for s in stmts if not self.is_dropped(s)]
+            if not insts:
+                continue
+            # outstanding lds count at end of block in original order, the fence after may rely on it
+            orig_queue = list(lgkm_queue)
+            for stmt in stmts:
+                if type(stmt) is inst_t and stmt.category == IR_CATEGORY_WAITCNT:
+                    del orig_queue[:max(len(orig_queue) - ir_get_waitcnt(stmt)[1], 0)]
+                elif type(stmt) is inst_t and stmt.category == IR_CATEGORY_LDS:
+                    orig_queue.append(ir_get_units(stmt.get_writes()))
+            insts = self.schedule_block(insts, ready_time)
+            scheduled.extend(self.insert_waitcnt(insts, lgkm_queue, insts[0].indent))
+            if len(lgkm_queue) > len(orig_queue):
+                scheduled.append(ir_parse_line(f's_waitcnt lgkmcnt({len(orig_queue)})', insts[0].indent))
+                del lgkm_queue[:len(lgkm_queue) - len(orig_queue)]
+            ready_time = dict()
+        return scheduled
+
+    def predict_stall(self, ir, lgkm_pending = None, repeat = 1):
+        '''
+        in-order issue simulation, return stall cycles waiting on data or counters.
+        memory instructions complete in order per counter. ir is run repeat times back to back, like a .rept
+        '''
+        t = 0
+        stall = 0
+        reg_ready = dict()
+        queue = {'lgkm' : [], 'vm' : []}       # completion cycle, oldest first
+        def issue_mem(inst, start, counter):
+            done = start + self.latency.latency(inst)
+            if queue[counter]:
+                done = max(done, queue[counter][-1])
+            queue[counter].append(done)
+        for inst in (lgkm_pending if lgkm_pending else []):
+            issue_mem(inst, t, 'lgkm')
+            t += self.latency.issue(inst)
+        t = 0
+        for _ in range(repeat):
+            for stmt in ir:
+                if type(stmt) is not inst_t:
+                    continue
+                start = t
+                if stmt.category == IR_CATEGORY_WAITCNT:
+                    for counter, cnt in zip(('vm', 'lgkm'), ir_get_waitcnt(stmt)):
+                        if cnt is not None and len(queue[counter]) > cnt:
+                            start = max(start, queue[counter][len(queue[counter]) - cnt - 1])
+                            del queue[counter][:len(queue[counter]) - cnt]
+                elif stmt.category in (IR_CATEGORY_VALU, IR_CATEGORY_SALU):
+                    reads = ir_get_units(stmt.get_reads())
+                    if reads:
+                        start = max([start] + [reg_ready.get(u, 0) for u in reads])
+                stall += start - t
+                if stmt.category in (IR_CATEGORY_LDS, IR_CATEGORY_SMEM):
+                    issue_mem(stmt, start, 'lgkm')
+                elif stmt.category == IR_CATEGORY_VMEM:
+                    issue_mem(stmt, start, 'vm')
+                elif stmt.category in (IR_CATEGORY_VALU, IR_CATEGORY_SALU):
+                    for u in (ir_get_units(stmt.get_writes()) or []):
+                        reg_ready[u] = start + self.latency.latency(stmt)
+                t = start + self.latency.issue(stmt)
+        return stall
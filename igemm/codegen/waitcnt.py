@@ -0,0 +1,379 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# s_waitcnt computed from dataflow of outstanding memory instructions, instead of counting issues by hand
+import re
+import copy
+from .node import *
+from .scheduler import *
+
+# largest count can be encoded in s_waitcnt (gfx9). distance beyond is kept at this value,
+# waiting for it still makes sure anything older is done
+IR_WAITCNT_MAX = {'vm' : 63, 'lgkm' : 15}
+
+def _ir_waitcnt_is_int(tokens):
+    try:
+        return len(tokens) == 1 and int(tokens[0], 0) >= 0
+    except ValueError:
+        return False
+
+class ir_macro_table_t(object):
+    '''
+    body of known macros, so invocation can be expanded into instructions for analysis.
+    only straight-line body is expanded, macro with .rept/.if/symbol assignment stays opaque
+    '''
+    parsed = dict()                 # rendered text -> (params, body, opaque_memory, raw), shared by every table
+    def __init__(self, macro_list = None):
+        self.macros = dict()        # name -> (params, [stmt]), stmt is None if not straight-line
+        self.raw = dict()           # name -> [stmt] of body as is, for walk()
+        self.opaque_memory = set()  # name of not straight-line macro, that may issue memory instruction or wait
+        for macro in (macro_list if macro_list else []):
+            self.add(macro)
+
+    def add(self, macro):
+        if macro.name() in self.macros:
+            return
+        text = macro.mc.render_macro(macro)
+        if text not in self.parsed:
+            self.parsed[text] = self.parse(macro.name(), text)
+        params, body, opaque_memory, raw = self.parsed[text]
+        if opaque_memory:
+            self.opaque_memory.add(macro.name())
+        self.macros[macro.name()] = (params, body)
+        self.raw[macro.name()] = raw
+
+    def parse(self, name, text):
+        stmts = ir_parse(text)
+        head = [s for s in stmts if type(s) is text_t and s.text.startswith('.macro')]
+        assert head, f'no .macro in body of {name}'
+        tokens = head[0].text.split(None, 2)
+        params = [p.split('=')[0] for p in re.split(r'[,\s]+', tokens[2]) if p] if len(tokens) > 2 else []
+        body = stmts[stmts.index(head[0]) + 1:]
+        body = [s for s in body if not (type(s) is text_t and (s.text.startswith('.endm') or s.text.strip() == '' or s.text.startswith(';')))]
+        raw = body
+        opaque_memory = False
+        if any(type(s) is not inst_t for s in body):
+            opaque_memory = any(type(s) is inst_t and s.category not in (IR_CATEGORY_VALU, IR_CATEGORY_SALU) for s in body)
+            body = None
+        return params, body, opaque_memory, raw
+
+    def is_register_only(self, name):
+        '''
+        known macro, that only does alu on its arguments
+        '''
+        return name in self.macros and name not in self.opaque_memory
+
+    def expand(self, inst):
+        '''
+        list of inst_t of a macro invocation, nested invocation also expanded. None if unknown
+        '''
+        if inst.opcode not in self.macros:
+            return None
+        params, body = self.macros[inst.opcode]
+        args = [str(o) for o in inst.src]
+        if body is None or len(args) != len(params):
+            return None
+        args = dict(zip(params, args))
+        insts = []
+        for stmt in body:
+            text = re.sub(r'\\(\w+)', lambda m: args.get(m.group(1), m.group(0)), stmt.to_str())
+            i = ir_parse_line(text, inst.indent)
+            if i.category == IR_CATEGORY_MACRO:
+                nested = self.expand(i)
+                if nested is None:
+                    return None
+                insts.extend(nested)
+            else:
+                insts.append(i)
+        return insts
+
+    def get_rept_body(self, inst):
+        '''
+        statements of a macro invocation for walk(), with arguments substituted. body can have .rept of constant count
+        and symbol assignment besides instructions. None if unknown or other directive in body
+        '''
+        if inst.opcode not in self.raw:
+            return None
+        params = self.macros[inst.opcode][0]
+        args = [str(o) for o in inst.src]
+        if len(args) != len(params):
+            return None
+        args = dict(zip(params, args))
+        stmts = []
+        for stmt in self.raw[inst.opcode]:
+            s = ir_parse_line(re.sub(r'\\(\w+)', lambda m: args.get(m.group(1), m.group(0)), stmt.to_str()), inst.indent)
+            if type(s) is text_t:
+                tokens = s.text.split()
+                if tokens[0] == '.rept' and not _ir_waitcnt_is_int(tokens[1:]):
+                    return None
+                if tokens[0] not in ('.rept', '.endr') and (len(tokens) < 2 or tokens[1] != '='):
+                    return None
+            elif type(s) is not inst_t:
+                return None
+            stmts.append(s)
+        return stmts
+
+    def walk(self, stmts, visit, repeat = 1):
+        '''
+        visit(inst, times) for every instruction of stmts, .rept of constant count is unrolled into times, and macro
+        invocation is walked into, nested ones as well. invocation that can not be walked into is visited as is
+        '''
+        times = [repeat]
+        for stmt in stmts:
+            if type(stmt) is text_t:
+                tokens = stmt.text.split()
+                if tokens and tokens[0] == '.rept':
+                    assert _ir_waitcnt_is_int(tokens[1:]), f'can not walk into "{stmt.text}"'
+                    times.append(times[-1] * int(tokens[1], 0))
+                elif tokens and tokens[0] == '.endr':
+                    times.pop()
+            elif type(stmt) is inst_t:
+                body = self.get_rept_body(stmt) if stmt.category == IR_CATEGORY_MACRO else None
+                if body is None:
+                    visit(stmt, times[-1])
+                else:
+                    self.walk(body, visit, times[-1])
+
+    def expand_ir(self, ir):
+        '''
+        copy of ir, every invocation that can be expanded is replaced by its instructions
+        '''
+        expanded = ir_t()
+        for stmt in ir:
+            insts = self.expand(stmt) if type(stmt) is inst_t and stmt.category == IR_CATEGORY_MACRO else None
+            expanded.extend(insts if insts is not None else [stmt])
+        return expanded
+
+class _ir_waitcnt_state_t(object):
+    '''
+    per counter, key -> how many instructions of that counter are issued after the newest one owning the key.
+    key is a register unit written, ('lds',) for lds instruction, ('any', kind) for register of unknown offset.
+    smem returns out of order, so while any is outstanding lgkm can only be waited to 0
+    '''
+    def __init__(self):
+        self.dist = {'vm' : dict(), 'lgkm' : dict()}
+        self.smem = False
+    def __eq__(self, other):
+        return other is not None and self.dist == other.dist and self.smem == other.smem
+    def merge(self, other):
+        if other is None:
+            return copy.deepcopy(self)
+        merged = _ir_waitcnt_state_t()
+        for counter in self.dist:
+            d = dict(self.dist[counter])
+            for k, v in other.dist[counter].items():
+                d[k] = min(d[k], v) if k in d else v
+            merged.dist[counter] = d
+        merged.smem = self.smem or other.smem
+        return merged
+    def wait(self, counter, cnt):
+        self.dist[counter] = {k : v for k, v in self.dist[counter].items() if v < cnt}
+        if counter == 'lgkm' and cnt == 0:
+            self.smem = False
+    def issue(self, counter, keys, smem = False):
+        d = {k : min(v + 1, IR_WAITCNT_MAX[counter]) for k, v in self.dist[counter].items()}
+        for k in keys:
+            d[k] = 0
+        self.dist[counter] = d
+        self.smem = self.smem or smem
+
+def _ir_waitcnt_merge(a, b):
+    if a is None:
+        return copy.deepcopy(b)
+    return a.merge(b)
+
+class ir_waitcnt_t(object):
+    '''
+    drop every s_waitcnt of the ir, then put the minimal vmcnt/lgkmcnt before each instruction
+    that touches a register still in flight, or a barrier with lds still outstanding.
+    state at labels and .rept is merged from every path to a fixed point, so a single wait serves all iterations.
+    symbols is name -> (kind, index, size) of register symbols, to see through aliases
+    '''
+    def __init__(self, arch_config, macro_table = None, symbols = None):
+        self.arch_config = arch_config
+        self.macro_table = macro_table if macro_table else ir_macro_table_t()
+        self.symbols = symbols if symbols else dict()
+
+    def get_units(self, operands):
+        '''
+        (set of unit, set of kind with unknown offset)
+        '''
+        units, kinds = set(), set()
+        for o in operands:
+            if type(o) is opr_reg_t:
+                if o.offset is None:
+                    kinds.add(o.kind)
+                    continue
+                kind, base, offset = o.kind, o.base, o.offset
+                if base in self.symbols:
+                    kind, base, offset = self.symbols[base][0], '', self.symbols[base][1] + offset
+                units.update((kind, base, offset + i) for i in range(o.count))
+            elif type(o) is opr_sym_t:
+                if o.text in IR_SPECIAL_REGS:
+                    units.add(('sym', o.text))
+                else:
+                    # macro argument, may touch anywhere in the allocation of symbols it refers to
+                    for t in re.findall(r'[A-Za-z_]\w*', o.text):
+                        if t in self.symbols:
+                            kind, index, size = self.symbols[t]
+                            units.update((kind, '', index + i) for i in range(size))
+        return units, kinds
+
+    def get_access(self, insts):
+        '''
+        (read units, read kinds, write units, write kinds) of instruction list
+        '''
+        ru, rk, wu, wk = set(), set(), set(), set()
+        for inst in insts:
+            u, k = self.get_units(inst.get_reads())
+            ru |= u; rk |= k
+            u, k = self.get_units(inst.get_writes())
+            wu |= u; wk |= k
+        return ru, rk, wu, wk
+
+    def get_need(self, state, counter, access):
+        ru, rk, wu, wk = access
+        need = None
+        for key, d in state.dist[counter].items():
+            if key[0] == 'lds':
+                continue
+            if key[0] == 'any':
+                hit = key[1] in rk or key[1] in wk or any(u[0] == key[1] for u in ru | wu)
+            else:
+                hit = key in ru or key in wu or key[0] in rk or key[0] in wk
+            if hit:
+                need = d if need is None else min(need, d)
+        if need is not None and counter == 'lgkm' and state.smem:
+            need = 0
+        return need
+
+    def get_lds_need(self, state):
+        if ('lds',) not in state.dist['lgkm']:
+            return None
+        return 0 if state.smem else state.dist['lgkm'][('lds',)]
+
+    def issue(self, state, inst):
+        if inst.category == IR_CATEGORY_WAITCNT:
+            for counter, cnt in zip(('vm', 'lgkm'), ir_get_waitcnt(inst)):
+                if cnt is not None:
+                    state.wait(counter, cnt)
+            return
+        if inst.category not in (IR_CATEGORY_VMEM, IR_CATEGORY_LDS, IR_CATEGORY_SMEM):
+            return
+        # source of store is read at issue on gfx9, so only registers written are tracked
+        wu, wk = self.get_units(inst.get_writes())
+        keys = set(wu) | set(('any', k) for k in wk)
+        if inst.category == IR_CATEGORY_LDS:
+            keys.add(('lds',))
+        state.issue('vm' if inst.category == IR_CATEGORY_VMEM else 'lgkm', keys, inst.category == IR_CATEGORY_SMEM)
+
+    def is_dropped(self, stmt):
+        if type(stmt) is not inst_t or stmt.category != IR_CATEGORY_WAITCNT:
+            return False
+        return all(m.name in ('vmcnt', 'lgkmcnt') for m in stmt.mod)
+
+    def step(self, state, stmt):
+        '''
+        (vmcnt, lgkmcnt) needed before stmt, state is updated past stmt. cnt is -1 for full fence after
+        '''
+        insts = [stmt]
+        access = self.get_access(insts)
+        if stmt.category == IR_CATEGORY_MACRO:
+            insts = self.macro_table.expand(stmt)
+            if insts is None and not self.macro_table.is_register_only(stmt.opcode):
+                # opaque macro, wait everything before, and after since it may issue memory itself
+                need = [0 if state.dist[c] else None for c in ('vm', 'lgkm')]
+                state.wait('vm', 0)
+                state.wait('lgkm', 0)
+                return need, True
+            if insts is None:
+                # every argument may be read or written
+                insts = []
+                access = (access[0], access[1], access[0], access[1])
+            else:
+                access = self.get_access(insts)
+        need = [self.get_need(state, c, access) for c in ('vm', 'lgkm')]
+        if any(i.category == IR_CATEGORY_BARRIER for i in insts):
+            lds_need = self.get_lds_need(state)
+            if lds_need is not None:
+                need[1] = lds_need if need[1] is None else min(need[1], lds_need)
+        for c, n in zip(('vm', 'lgkm'), need):
+            if n is not None:
+                state.wait(c, n)
+        for inst in insts:
+            self.issue(state, inst)
+        return need, False
+
+    def sweep(self, ir, label_in, rept_back, result = None):
+        state = _ir_waitcnt_state_t()
+        rept_stack = []
+        for i, stmt in enumerate(ir):
+            if type(stmt) is label_t:
+                state = _ir_waitcnt_merge(state, label_in.get(stmt.name))
+            elif type(stmt) is text_t:
+                directive = stmt.text.split(None, 1)[0] if stmt.text.strip() else ''
+                if directive == '.rept':
+                    rept_stack.append((i, copy.deepcopy(state)))
+                    state = _ir_waitcnt_merge(state, rept_back.get(i))
+                elif directive == '.endr' and rept_stack:
+                    i_rept, entry = rept_stack.pop()
+                    rept_back[i_rept] = _ir_waitcnt_merge(rept_back.get(i_rept), state)
+                    state = _ir_waitcnt_merge(state, entry)
+            if self.is_dropped(stmt):
+                continue
+            if result is not None:
+                result.append(stmt)
+            if type(stmt) is not inst_t or state is None:
+                continue
+            need, fence = self.step(state, stmt)
+            if result is not None:
+                wait = ' '.join(f'{c}cnt({n})' for c, n in zip(('vm', 'lgkm'), need) if n is not None)
+                if wait:
+                    result.insert(len(result) - 1, ir_parse_line(f's_waitcnt {wait}', stmt.indent))
+                if fence:
+                    result.append(ir_parse_line('s_waitcnt vmcnt(0) lgkmcnt(0)', stmt.indent))
+            if stmt.category == IR_CATEGORY_BRANCH:
+                if stmt.src and type(stmt.src[-1]) is opr_sym_t:
+                    target = stmt.src[-1].text
+                    label_in[target] = _ir_waitcnt_merge(label_in.get(target), state)
+                if stmt.opcode in ('s_branch', 's_endpgm'):
+                    state = None
+
+    def __call__(self, ir):
+        label_in, rept_back = dict(), dict()
+        while True:
+            previous = (copy.deepcopy(label_in), copy.deepcopy(rept_back))
+            self.sweep(ir, label_in, rept_back)
+            if (label_in, rept_back) == previous:
+                break
+        result = []
+        self.sweep(ir, label_in, rept_back, result)
+        return ir_t(result)
+
+    def predict_stall(self, ir):
+        '''
+        wait cycles of a single pass over ir with macros expanded, by the latency model of scheduler
+        '''
+        return ir_scheduler_t(self.arch_config).predict_stall(self.macro_table.expand_ir(ir))
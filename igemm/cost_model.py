@@ -0,0 +1,218 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+import math
+from .codegen import *
+from .algo import *
+
+COST_MODEL_BOUND_COMPUTE    = 'compute'
+COST_MODEL_BOUND_MEMORY     = 'memory'
+
+def _cost_model_div_ceil(x, y):
+    return (x + y - 1) // y
+
+# conv_param_t argument -> default, for problem string like "n=128,c=1024,hi=17,wi=17,k=1024,x=7,px=3"
+COST_MODEL_PROBLEM_DEFAULT = {'n' : 1, 'g' : 1, 'c' : 1, 'hi' : 1, 'wi' : 1, 'k' : 1, 'y' : 1, 'x' : 1,
+                            'py' : 0, 'px' : 0, 'sy' : 1, 'sx' : 1, 'dy' : 1, 'dx' : 1, 'ho' : -1, 'wo' : -1,
+                            'direction' : 'bwd', 'precision' : 'fp32'}
+
+def cost_model_parse_problem(problem_string):
+    args = dict(COST_MODEL_PROBLEM_DEFAULT)
+    for item in problem_string.replace(' ', '').split(','):
+        if not item:
+            continue
+        key, value = item.split('=')
+        assert key in args, f'unknown key "{key}" in problem "{problem_string}"'
+        args[key] = value if key in ('direction', 'precision') else int(value)
+    args['direction'] = conv_string_to_direction(args['direction'])
+    return conv_param_t(**args)
+
+def cost_model_problem_string(conv_param):
+    return f'n={conv_param.n},c={conv_param.c},hi={conv_param.hi},wi={conv_param.wi},k={conv_param.k},' + \
+            f'y={conv_param.y},x={conv_param.x},py={conv_param.py},px={conv_param.px},sy={conv_param.sy},sx={conv_param.sx},' + \
+            f'dy={conv_param.dy},dx={conv_param.dx},g={conv_param.g},direction={conv_direction_to_string(conv_param.direction)},precision={conv_param.precision}'
+
+def cost_model_gemm_shapes(conv_param):
+    '''
+    list of (gemm_m, gemm_n, gemm_k), one per gemm of a group. bwd is split into y_tilda*x_tilda gemms
+    the same way as igemm_bwd_gtc_driver.h, and gemm_k may be 0 for some of them
+    '''
+    p = conv_param
+    c, k = p.c // p.g, p.k // p.g
+    if p.direction == CONV_DIRECTION_FWD:
+        return [(k, p.n * p.ho * p.wo, c * p.y * p.x)]
+    if p.direction == CONV_DIRECTOIN_WRW:
+        return [(k, c * p.y * p.x, p.n * p.ho * p.wo)]
+    y_tilda = p.sy // math.gcd(p.sy, p.dy)
+    x_tilda = p.sx // math.gcd(p.sx, p.dx)
+    y_dot = _cost_model_div_ceil(p.y, y_tilda)
+    x_dot = _cost_model_div_ceil(p.x, x_tilda)
+    h_tilda = p.ho + _cost_model_div_ceil(p.dy * (p.y - 1), p.sy)
+    w_tilda = p.wo + _cost_model_div_ceil(p.dx * (p.x - 1), p.sx)
+    h_tilda_left = max(0, p.py - p.dy * (y_tilda - 1)) // p.sy
+    w_tilda_left = max(0, p.px - p.dx * (x_tilda - 1)) // p.sx
+    h_tilda_right = min(h_tilda, _cost_model_div_ceil(p.py + p.hi - 1, p.sy) + 1)
+    w_tilda_right = min(w_tilda, _cost_model_div_ceil(p.px + p.wi - 1, p.sx) + 1)
+    gemm_n = p.n * (h_tilda_right - h_tilda_left) * (w_tilda_right - w_tilda_left)
+    shapes = list()
+    for i_y_tilda in range(y_tilda):
+        for i_x_tilda in range(x_tilda):
+            y_dot_slice = y_dot if (i_y_tilda + 1) * y_dot <= p.y else p.y % y_dot
+            x_dot_slice = x_dot if (i_x_tilda + 1) * x_dot <= p.x else p.x % x_dot
+            shapes.append((c, gemm_n, k * y_dot_slice * x_dot_slice))
+    return shapes
+
+def cost_model_is_applicable(conv_param, tunable):
+    p = conv_param
+    if tunable.direction != conv_direction_to_string(p.direction) or tunable.precision != p.precision:
+        return False
+    if tunable.nxe == 0:
+        # 1x1 special, no filter/stride/pad handling in kernel
+        return p.y == 1 and p.x == 1 and p.py == 0 and p.px == 0 and p.sy == 1 and p.sx == 1
+    if tunable.direction == 'bwd' and tunable.tensor_b_thread_lengths[2] != 1 and p.n % tunable.unmerge_sub_n != 0:
+        # n is unmerged to n0*n1 with a fixed n0 stride, there is no range check along n0
+        return False
+    return True
+
+class cost_model_estimate_t(object):
+    '''
+    estimation of one kernel on one problem. time is in us, bytes are global memory traffic
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.grid_size = 0
+        self.launches = 0
+        self.flop = 0               # useful, 2*m*n*k
+        self.flop_issued = 0        # including padding of gemm m/n/k up to the tile
+        self.padding_waste = 0.0
+        self.bytes_per_block = 0
+        self.bytes = 0
+        self.arithmetic_intensity = 0.0
+        self.blocks_per_cu = 0
+        self.waves_per_simd = 0.0
+        self.compute_us = 0.0
+        self.memory_us = 0.0
+        self.time_us = 0.0
+        self.bound = COST_MODEL_BOUND_COMPUTE
+
+    def tflops(self):
+        return self.flop / (self.time_us * 1e6) if self.time_us else 0.0
+
+class cost_model_t(object):
+    '''
+    for amdgpu
+    analytic roofline of igemm kernels. every block loads its whole a/b tile along gemm_k and stores its c tile,
+    with no reuse between blocks in cache, so bigger tiles move less bytes. a cu shares its fma rate among the
+    resident blocks, and can not use more simd than resident waves. the busiest cu (ceil(grid/num_cu) blocks)
+    decides the compute time of a launch, hence tail effect of a small grid is included
+    '''
+    def __init__(self, arch_detail):
+        self.arch_detail = arch_detail
+
+    def is_applicable(self, conv_param, tunable):
+        return cost_model_is_applicable(conv_param, tunable)
+
+    def estimate(self, conv_param, kernel):
+        '''
+        kernel is a igemm kernel with tunable and get_kernel_code(). None if kernel can not run this problem
+        '''
+        ad = self.arch_detail
+        tunable = kernel.tunable
+        if not self.is_applicable(conv_param, tunable):
+            return None
+        kernel_code = kernel.get_kernel_code()
+        est = cost_model_estimate_t(kernel.name())
+        est.blocks_per_cu = amdgpu_calculate_occupancy(ad, kernel_code.workitem_vgpr_count, tunable.block_size,
+                        kernel_code.workgroup_group_segment_byte_size, kernel_code.wavefront_sgpr_count)
+        if est.blocks_per_cu == 0:
+            return None
+        waves_per_block = amdgpu_waves_per_block(ad, tunable.block_size)
+        est.waves_per_simd = est.blocks_per_cu * waves_per_block / AMDGPU_SIMD_PER_CU
+
+        data_byte = amdgpu_precision_data_byte(tunable.precision)
+        m_per_block, n_per_block, k_per_block = tunable.gemm_m_per_block, tunable.gemm_n_per_block, tunable.gemm_k_per_block
+        cu_flops = ad.simd_per_cu * ad.fp32_fma_per_cycle * ad.sclk_mhz         # flop per us, same as theoretical_fp32_gflops()
+        bandwidth = ad.theoretical_bandwidth_gbps() * 1e3                       # byte per us
+
+        gemm_shapes = [s for s in cost_model_gemm_shapes(conv_param) if s[2] != 0]
+        if tunable.multihead:
+            # every gemm shares one launch, grid of the biggest gemm_k is used as bound of the launch
+            grid_per_gemm = _cost_model_div_ceil(gemm_shapes[0][0], m_per_block) * \
+                            _cost_model_div_ceil(gemm_shapes[0][1], n_per_block)
+            launches = [(grid_per_gemm * len(gemm_shapes) * conv_param.g, max(s[2] for s in gemm_shapes))]
+        else:
+            launches = [(_cost_model_div_ceil(m, m_per_block) * _cost_model_div_ceil(n, n_per_block) * conv_param.g, kk)
+                            for m, n, kk in gemm_shapes]
+
+        for grid_size, gemm_k in launches:
+            k_iters = _cost_model_div_ceil(gemm_k, k_per_block)
+            flop_per_block = 2 * m_per_block * n_per_block * k_per_block * k_iters
+            bytes_per_block = (m_per_block + n_per_block) * k_per_block * k_iters * data_byte + m_per_block * n_per_block * data_byte
+            blocks_on_cu = _cost_model_div_ceil(grid_size, ad.num_cu)
+            resident = min(est.blocks_per_cu, blocks_on_cu)
+            simd_usage = min(1.0, resident * waves_per_block / AMDGPU_SIMD_PER_CU)
+            est.compute_us += blocks_on_cu * flop_per_block / (cu_flops * simd_usage)
+            est.memory_us += grid_size * bytes_per_block / bandwidth
+            est.time_us += max(blocks_on_cu * flop_per_block / (cu_flops * simd_usage), grid_size * bytes_per_block / bandwidth)
+            est.flop_issued += grid_size * flop_per_block
+            est.bytes += grid_size * bytes_per_block
+            est.grid_size += grid_size
+            est.bytes_per_block = max(est.bytes_per_block, bytes_per_block)
+        est.launches = len(launches)
+        est.flop = sum(2 * m * n * kk for m, n, kk in gemm_shapes) * conv_param.g
+        est.padding_waste = 1.0 - est.flop / est.flop_issued
+        est.arithmetic_intensity = est.flop_issued / est.bytes
+        est.bound = COST_MODEL_BOUND_COMPUTE if est.compute_us >= est.memory_us else COST_MODEL_BOUND_MEMORY
+        return est
+
+    def rank(self, conv_param, kernel_list, top_k = 0):
+        '''
+        estimations sorted by time, kernels not able to run the problem are dropped
+        '''
+        est_list = [e for e in (self.estimate(conv_param, kernel) for kernel in kernel_list) if e is not None]
+        est_list.sort(key = lambda e: (e.time_us, e.name))
+        return est_list[:top_k] if top_k else est_list
+
+    def report(self, conv_param, est_list):
+        p = conv_param
+        peak_tflops = self.arch_detail.theoretical_fp32_gflops() / 1e3
+        lines = [f'problem {cost_model_problem_string(p)}, {len(est_list)} kernel(s)']
+        lines.append(f"{'rank':>5}{'time(us)':>11}{'tflops':>8}{'eff':>7}{'grid':>8}{'waste':>7}{'ai':>7}{'wg/cu':>7}{'waves/simd':>12}  {'bound':<9}kernel")
+        for i, e in enumerate(est_list):
+            lines.append(f'{i:>5}{e.time_us:>11.1f}{e.tflops():>8.2f}{100 * e.tflops() / peak_tflops:>6.1f}%{e.grid_size:>8}' + \
+                    f'{100 * e.padding_waste:>6.1f}%{e.arithmetic_intensity:>7.1f}{e.blocks_per_cu:>7}{e.waves_per_simd:>12g}  {e.bound:<9}{e.name}')
+        return '\n'.join(lines)
+
+    def __call__(self, conv_param_list, kernel_list, top_k = 0):
+        '''
+        print top_k ranking per problem, return list of ranking
+        '''
+        rank_list = list()
+        for conv_param in conv_param_list:
+            est_list = self.rank(conv_param, kernel_list, top_k)
+            print(self.report(conv_param, est_list))
+            rank_list.append(est_list)
+        return rank_list
@@ -27,11 +27,93 @@
 
 from .algo import *
 from .codegen import *
+from .kernel_manifest import *
+import os
+import json
+import multiprocessing
+
+IGEMM_SPLIT_MACRO_INCLUDE = 'igemm_macro.inc'
+IGEMM_SPLIT_METADATA = 'igemm_metadata.s'
+
+def _igemm_emit_kernel(kernel):
+    with kernel.mc.profile_kernel_context(kernel.name()):
+        kernel.prepare_kernel_body()
+        kernel._emit(';----------------------------------------------------------')
+        kernel._emit('; starting of kernel {}'.format(kernel.name()))
+        kernel._emit(kernel.tunable.serialize())
+
+        kernel.emit_kernel_symbol()
+
+        kernel.emit_kernel_header()
+        with kernel._indent_context():
+            if kernel.mc.arch_config.code_object == AMDGPU_CODEOBJECT_V2:
+                kernel.emit_kernel_amd_kernel_code_t()
+            kernel.emit_kernel_body()
+            kernel.emit_kernel_end()
+        if kernel.mc.arch_config.code_object == AMDGPU_CODEOBJECT_V3:
+            kernel.emit_kernel_amd_kernel_code_t()
+        kernel.emit_kernel_footer()
+
+def _igemm_emit_kernel_job(arch_config, tunable_dict, indent_level, cache = None, manifest = False, profiler = None):
+    '''
+    run in worker process, render a single kernel into its own string buffer.
+    vgpr layout is also returned, since kernel of the driver needs the allocated vgpr count for metadata,
+    and manifest entry if asked, since it comes from the recorded body of the kernel rendered here.
+    profiler, if given, is returned with what is measured here
+    '''
+    emitter = mc_emit_to_string_t()
+    emitter.set_indent(indent_level)
+    mc = mc_asm_printer_t(emitter, arch_config)
+    if profiler:
+        mc.set_profiler(profiler)
+    if cache:
+        mc.macro_cache = macro_cache_t(cache)
+    kernel = igemm_bwd_gtc_t(mc, igemm_gtc_tunable_parameter_t(tunable_dict))
+    _igemm_emit_kernel(kernel)
+    return emitter.get_buffer(), kernel.vgpr.get_layout(), kernel_manifest_get_entry(kernel) if manifest else None, profiler
+
+def _igemm_emit_kernel_buffer(kernel, indent_level, manifest = False):
+    '''
+    serial version of _igemm_emit_kernel_job(), render kernel of the driver itself into its own string buffer,
+    by swapping emitter of its mc, so the same kernel object is not built twice
+    '''
+    mc = kernel.mc
+    original_emitter = mc.emitter
+    mc.emitter = mc_emit_to_string_t()
+    mc.emitter.set_indent(indent_level)
+    try:
+        _igemm_emit_kernel(kernel)
+        kernel_buffer = mc.emitter.get_buffer()
+    finally:
+        mc.emitter = original_emitter
+    return kernel_buffer, kernel.vgpr.get_layout(), kernel_manifest_get_entry(kernel) if manifest else None, mc.profiler
+
+class igemm_split_compile_t(object):
+    '''
+    option of split-and-link build. mc of the driver writes the shared macro include,
+    each kernel goes to its own .s next to it, then all objects are linked into target_hsaco.
+    command templates are for compile_split_asm_t/compile_disass_t, None for default toolchain
+    '''
+    def __init__(self, target_hsaco, asm_cmd = None, link_cmd = None, disass_cmd = None):
+        self.target_hsaco = target_hsaco
+        self.asm_cmd = asm_cmd
+        self.link_cmd = link_cmd
+        self.disass_cmd = disass_cmd
 
 class igemm_codegen_driver_t(mc_base_t):
-    def __init__(self, mc, tunable_dicts):
+    def __init__(self, mc, tunable_dicts, jobs = 1, cache = None, split = None, emit_all_macro = False, advisor = None, manifest = None):
         mc_base_t.__init__(self, mc)
         self.tunable_dicts = tunable_dicts
+        self.jobs = jobs
+        self.cache = cache
+        self.split = split
+        self.emit_all_macro = emit_all_macro
+        self.advisor = advisor
+        self.manifest = manifest                # json file of kernel_manifest_write(), None for no manifest
+        self.manifest_entries = dict()          # kernel name -> entry, of kernels rendered by get_kernel_buffers()
+        self.split_asm_files = []
+        if cache:
+            mc.macro_cache = macro_cache_t(cache)
 
         kernel_list = []
 
@@ -40,6 +122,23 @@ class igemm_codegen_driver_t(mc_base_t):
 
         self.kernel_list = kernel_list
 
+    def apply_advisor(self, kernel_buffers = None):
+        '''
+        perf_advisor_t, print occupancy of every kernel and drop the ones below occupancy floor.
+        vgpr count is known only after allocation, so this is after kernels are rendered
+        '''
+        if not self.advisor:
+            return kernel_buffers
+        accepted = self.advisor(self.kernel_list)
+        if len(accepted) != len(self.kernel_list):
+            print(f'{len(self.kernel_list) - len(accepted)} kernel(s) below occupancy floor are not generated')
+        keep = [i for i, kernel in enumerate(self.kernel_list) if kernel in accepted]
+        self.tunable_dicts = [self.tunable_dicts[i] for i in keep]
+        self.kernel_list = accepted
+        if kernel_buffers is None:
+            return None
+        return [kernel_buffers[i] for i in keep]
+
     def emit_hsa_header(self):
         hsa_header_t(self.mc).emit()
 
@@ -71,44 +170,196 @@ class igemm_codegen_driver_t(mc_base_t):
                 self.mc.insert_unique(macro.name(), macro)
         self.mc.emit_all_unique()
 
-    def emit_igemm_kernel(self):
+    def insert_global_macro(self):
+        for macro in [macro_int_div_vv_t(self.mc), macro_int_div_vs_t(self.mc), macro_int_div_ss_t(self.mc),
+                    macro_int_div_rem_vv_t(self.mc), macro_int_div_rem_vs_t(self.mc), macro_int_div_rem_ss_t(self.mc),
+                    macro_c_clear_t(self.mc)]:
+            self.mc.insert_unique(macro.name(), macro)
+
+    def insert_igemm_macro(self):
+        for kernel in self.kernel_list:
+            for macro in kernel.get_kernel_macros():
+                self.mc.insert_unique(macro.name(), macro)
+            # fma macro is created inside fma_main_loop_t, same shape as there
+            tunable = kernel.tunable
+            fma = macro_v_fma_mxn_t(self.mc, tunable.thread_sub_tile_m, tunable.thread_sub_tile_n, tunable.thread_tile_n)
+            self.mc.insert_unique(fma.name(), fma)
+
+    def emit_referenced_macro(self, kernel_buffers):
+        '''
+        only emit macros invoked by kernels (or by other emitted macros), dependency first
+        '''
+        self.insert_global_macro()
+        self.insert_igemm_macro()
+        self.mc.emit_referenced_unique(mc_macro_reference_t(*kernel_buffers))
+
+    def emit_macro(self, kernel_buffers):
+        if self.emit_all_macro:
+            self.emit_global_macro()
+            self.emit_igemm_macro()
+        else:
+            self.emit_referenced_macro(kernel_buffers)
+
+    def get_kernel_cache_key(self, kernel, tunable_dict, indent_level):
+        # serialize() does not print every key (e.g. multihead, unmerge cluster), so raw dict is also part of the key
+        arch_config = self.mc.arch_config
+        return self.cache.get_key('kernel', kernel.tunable.serialize(), sorted(tunable_dict.items()), sorted(vars(arch_config).items()),
+                    indent_level, build_cache_generator_hash())
+
+    def get_kernel_buffers(self):
+        # each kernel is rendered into its own string buffer, either taken from cache or by worker process.
+        # buffers are returned in kernel_list order, vgpr layout of each is applied to kernel_list.
+        indent_level = self.mc.emitter.get_indent()
+        kernel_buffers = [None] * len(self.kernel_list)
+        if self.cache:
+            cache_keys = [self.get_kernel_cache_key(kernel, td, indent_level) for kernel, td in zip(self.kernel_list, self.tunable_dicts)]
+            # vgpr layout and manifest entry go with the kernel text, one hit or miss per kernel
+            extra_names = ['vgpr'] + (['manifest'] if self.manifest else [])
+            for i, key in enumerate(cache_keys):
+                if not all(self.cache.exists(key, name) for name in extra_names):
+                    self.cache.miss += 1
+                    continue
+                kernel_buffers[i] = self.cache.load_text(key)
+                if kernel_buffers[i] is not None:
+                    self.kernel_list[i].vgpr.set_layout(json.loads(self.cache.load_text(key, 'vgpr', count = False)))
+                    if self.manifest:
+                        self.manifest_entries[self.kernel_list[i].name()] = json.loads(self.cache.load_text(key, 'manifest', count = False))
+
+        job_index = [i for i, kb in enumerate(kernel_buffers) if kb is None]
+        parallel = self.jobs > 1 and len(job_index) > 1
+        # worker process measures into its own profiler, merged back here
+        if parallel:
+            profiler = self.mc.profiler.fork() if self.mc.profiler else None
+            job_args = [(self.mc.arch_config, self.tunable_dicts[i], indent_level, self.cache, self.manifest is not None, profiler) for i in job_index]
+            with multiprocessing.Pool(min(self.jobs, len(job_args))) as pool:
+                job_results = pool.starmap(_igemm_emit_kernel_job, job_args, chunksize = 1)
+        else:
+            job_results = [_igemm_emit_kernel_buffer(self.kernel_list[i], indent_level, self.manifest is not None) for i in job_index]
+
+        for i, (kb, layout, entry, profiler) in zip(job_index, job_results):
+            kernel_buffers[i] = kb
+            self.kernel_list[i].vgpr.set_layout(layout)
+            if parallel and profiler:
+                self.mc.profiler.merge(profiler)
+            if entry is not None:
+                self.manifest_entries[self.kernel_list[i].name()] = entry
+            if self.cache:
+                self.cache.store_text(cache_keys[i], kb)
+                self.cache.store_text(cache_keys[i], json.dumps(layout), 'vgpr')
+                if entry is not None:
+                    self.cache.store_text(cache_keys[i], json.dumps(entry), 'manifest')
+        return kernel_buffers
+
+    def is_serial(self):
+        return self.cache is None and (self.jobs <= 1 or len(self.kernel_list) <= 1)
+
+    def emit_igemm_kernel(self, kernel_buffers = None):
         # emit the kernel
         #emit_v4r1_dynamic_kernel(self.mc, self.tunable_dicts)
-        for kernel in self.kernel_list:
-            self._emit(';----------------------------------------------------------')
-            self._emit('; starting of kernel {}'.format(kernel.name()))
-            self._emit(kernel.tunable.serialize())
-
-            kernel.emit_kernel_symbol()
-
-            kernel.emit_kernel_header()
-            with kernel._indent_context():
-                if kernel.mc.arch_config.code_object == AMDGPU_CODEOBJECT_V2:
-                    kernel.emit_kernel_amd_kernel_code_t()
-                kernel.emit_kernel_body()
-                kernel.emit_kernel_end()
-            if kernel.mc.arch_config.code_object == AMDGPU_CODEOBJECT_V3:
-                kernel.emit_kernel_amd_kernel_code_t()
-            kernel.emit_kernel_footer()
+        if kernel_buffers is None:
+            for kernel in self.kernel_list:
+                _igemm_emit_kernel(kernel)
+            return
+
+        # macros are still collected in emit_igemm_macro() by this process, so output is identical to serial.
+        self.emit_kernel_buffers(kernel_buffers)
+
+    def emit_kernel_buffers(self, kernel_buffers):
+        for kernel_buffer in kernel_buffers:
+            # buffer is already indented, and each line ends with '\n'
+            if kernel_buffer:
+                self._emit_front(kernel_buffer[:-1])
 
     def emit_metadata(self):
         kernel_info_list = [kernel.get_kernel_info() for kernel in self.kernel_list]
         amdgpu_metadata_t(self.mc, kernel_info_list).emit()
 
+    def emit_manifest(self):
+        '''
+        kernels of serial emit are not rendered by get_kernel_buffers(), their entry is taken here
+        '''
+        if not self.manifest:
+            return
+        entries = [self.manifest_entries[kernel.name()] if kernel.name() in self.manifest_entries else kernel_manifest_get_entry(kernel)
+                    for kernel in self.kernel_list]
+        kernel_manifest_write(self.manifest, entries)
+
+    def get_split_mc(self, file_name):
+        split_dir = os.path.dirname(self.mc.emitter.file_name)
+        mc = mc_asm_printer_t(mc_emit_to_file_t(os.path.join(split_dir, file_name)), self.mc.arch_config)
+        mc.emit('.include "{}"'.format(os.path.basename(self.mc.emitter.file_name)))
+        mc.emit_empty_line()
+        self.split_asm_files.append(mc.emitter.file_name)
+        return mc
+
+    def do_emit_split(self):
+        # kernels are rendered first, to know which macros are referenced
+        kernel_buffers = self.apply_advisor(self.get_kernel_buffers())
+
+        # shared include, hsa header also goes here so every object gets it
+        self.emit_hsa_header()
+        self.emit_macro(kernel_buffers)
+        self.mc.close()
+
+        self.split_asm_files = []
+        for kernel, kernel_buffer in zip(self.kernel_list, kernel_buffers):
+            mc = self.get_split_mc(kernel.name() + '.s')
+            if kernel_buffer:
+                mc.emit_front(kernel_buffer[:-1])
+            mc.close()
+
+        mc = self.get_split_mc(IGEMM_SPLIT_METADATA)
+        amdgpu_metadata_t(mc, [kernel.get_kernel_info() for kernel in self.kernel_list]).emit()
+        mc.close()
+        self.emit_manifest()
+
     def do_emit(self):
+        if self.split:
+            self.do_emit_split()
+            return
         self.emit_hsa_header()
-        self.emit_global_macro()
-        self.emit_igemm_macro()
-        self.emit_igemm_kernel()
+        if self.emit_all_macro:
+            kernel_buffers = None
+            if self.is_serial():
+                # kernels are emitted after macros, but vgpr must be allocated before advisor
+                for kernel in self.kernel_list:
+                    kernel.prepare_kernel_body()
+            else:
+                kernel_buffers = self.get_kernel_buffers()
+            kernel_buffers = self.apply_advisor(kernel_buffers)
+            self.emit_global_macro()
+            self.emit_igemm_macro()
+            self.emit_igemm_kernel(kernel_buffers)
+        else:
+            # kernels are rendered first, to know which macros are referenced
+            kernel_buffers = self.apply_advisor(self.get_kernel_buffers())
+            self.emit_referenced_macro(kernel_buffers)
+            self.emit_kernel_buffers(kernel_buffers)
         self.emit_metadata()
+        self.emit_manifest()
+
+    def do_compile_split(self):
+        ass = compile_split_asm_t(self.mc.arch_config, self.split_asm_files, self.split.target_hsaco,
+                    self.split.asm_cmd, self.split.link_cmd, self.jobs, self.cache)
+        rtn = ass.compile()
+        if not rtn:
+            assert False
+
+        disass = compile_disass_t(self.mc, ass.target_hsaco, cache = self.cache, disass_cmd = self.split.disass_cmd)
+        rtn = disass.compile()
+        if not rtn:
+            assert False
 
     def do_compile(self):
-        ass = compile_asm_t(self.mc, self.mc.emitter.file_name)
+        if self.split:
+            self.do_compile_split()
+            return
+        ass = compile_asm_t(self.mc, self.mc.emitter.file_name, cache = self.cache)
         rtn = ass.compile()
         if not rtn:
             assert False
 
-        disass = compile_disass_t(self.mc, ass.target_hsaco)
+        disass = compile_disass_t(self.mc, ass.target_hsaco, cache = self.cache)
         rtn = disass.compile()
         if not rtn:
             assert False
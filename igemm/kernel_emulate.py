@@ -0,0 +1,148 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+import math
+import time
+from .codegen import *
+from .algo import *
+from .cost_model import *
+
+KERNEL_EMULATE_NRMS = 1e-6      # same as get_bwd_nrms() of host driver
+
+def _kernel_emulate_div_ceil(a, b):
+    return (a + b - 1) // b
+
+def kernel_emulate_bwd_launches(conv_param, tunable):
+    '''
+    list of (grid_size, karg dict), the same launches as igemm_bwd_gtc_driver.h does, pointers not included
+    '''
+    p = conv_param
+    gcd_h, gcd_w = math.gcd(p.sy, p.dy), math.gcd(p.sx, p.dx)
+    y_tilda, x_tilda = p.sy // gcd_h, p.sx // gcd_w
+    y_dot, x_dot = _kernel_emulate_div_ceil(p.y, y_tilda), _kernel_emulate_div_ceil(p.x, x_tilda)
+    h_tilda = p.ho + _kernel_emulate_div_ceil(p.dy * (p.y - 1), p.sy)
+    w_tilda = p.wo + _kernel_emulate_div_ceil(p.dx * (p.x - 1), p.sx)
+    h_tilda_left = max(0, p.py - p.dy * (y_tilda - 1)) // p.sy
+    w_tilda_left = max(0, p.px - p.dx * (x_tilda - 1)) // p.sx
+    h_tilda_right = min(h_tilda, _kernel_emulate_div_ceil(p.py + p.hi - 1, p.sy) + 1)
+    w_tilda_right = min(w_tilda, _kernel_emulate_div_ceil(p.px + p.wi - 1, p.sx) + 1)
+    h_tilda_slice, w_tilda_slice = h_tilda_right - h_tilda_left, w_tilda_right - w_tilda_left
+
+    karg = {'hi' : p.hi, 'wi' : p.wi, 'n' : p.n, 'k' : p.k, 'c' : p.c, 'ho' : p.ho, 'wo' : p.wo,
+            'stride_h' : p.sy, 'stride_w' : p.sx, 'dilation_h' : p.dy, 'dilation_w' : p.dx, 'pad_h' : p.py, 'pad_w' : p.px,
+            'y' : p.y, 'x' : p.x, 'dtile_iy' : 0, 'dtile_ix' : 0, 'dtile_dy' : p.dy // gcd_h, 'dtile_dx' : p.dx // gcd_w,
+            'dtile_y' : y_tilda, 'dtile_x' : x_tilda, 'dtile_h' : h_tilda, 'dtile_w' : w_tilda, 'dslice_y' : 0, 'dslice_x' : 0,
+            'dslice_h' : h_tilda_slice, 'dslice_w' : w_tilda_slice, 'dslice_h_left' : h_tilda_left, 'dslice_w_left' : w_tilda_left}
+    grid_size = _kernel_emulate_div_ceil(p.c, tunable.gemm_m_per_block) * \
+                    _kernel_emulate_div_ceil(p.n * h_tilda_slice * w_tilda_slice, tunable.gemm_n_per_block)
+    if tunable.multihead:
+        karg.update({'dtile_iy' : grid_size, 'dtile_ix' : x_dot | (y_dot << 16), 'dslice_y' : p.y % y_dot, 'dslice_x' : p.x % x_dot})
+        return [(grid_size * y_tilda * x_tilda, karg)]
+    launches = list()
+    for i_y_tilda in range(y_tilda):
+        for i_x_tilda in range(x_tilda):
+            y_dot_slice = y_dot if (i_y_tilda + 1) * y_dot <= p.y else p.y % y_dot
+            x_dot_slice = x_dot if (i_x_tilda + 1) * x_dot <= p.x else p.x % x_dot
+            if p.k * y_dot_slice * x_dot_slice > 0:
+                launches.append((grid_size, dict(karg, dtile_iy = i_y_tilda, dtile_ix = i_x_tilda,
+                                    dslice_y = y_dot_slice, dslice_x = x_dot_slice)))
+    return launches
+
+class kernel_emulate_t(object):
+    '''
+    run generated kernels on the cpu emulator and check them against numpy reference convolution,
+    so a kernel can be validated without gpu. with lds_bank, lds bank conflict of every kernel is reported as well,
+    with coalescing, global memory transactions and l2 footprint
+    '''
+    def __init__(self, asm_text, workgroup_batch = EMULATOR_WORKGROUP_BATCH, lds_bank = False, coalescing = False):
+        self.kernels = emulator_parse(asm_text)
+        self.workgroup_batch = workgroup_batch
+        self.lds_bank = lds_bank
+        self.coalescing = coalescing
+        self.num_insts = 0
+
+    def run(self, tunable, conv_param, tensors, lds_bank = None, coalescing = None):
+        '''
+        result of the kernel of tunable, on operands of conv_ref_tensors(). lds_bank_t if given, collects bank conflict,
+        gmem_coalescing_t if given, collects global memory transactions
+        '''
+        p = conv_param
+        assert tunable.direction == 'bwd' and p.direction == CONV_DIRECTION_BWD, 'only bwd kernel can be emulated for now'
+        assert p.g == 1, 'group conv is not supported by bwd kernel'
+        kernel = self.kernels[igemm_gtc_encode_kernel_name(tunable)]
+        memory = emulator_memory_t()
+        p_in = memory.alloc('input', np.zeros((p.n, p.c, p.hi, p.wi), dtype = np.float32))     # driver does hipMemset
+        p_wei = memory.alloc('weight', np.ascontiguousarray(tensors['wei'], dtype = np.float32))
+        p_out = memory.alloc('output', np.ascontiguousarray(tensors['out'], dtype = np.float32))
+        for grid_size, karg in kernel_emulate_bwd_launches(p, tunable):
+            karg.update({'p_in' : p_in, 'p_wei' : p_wei, 'p_out' : p_out})
+            emulator = emulator_t(kernel, memory, self.workgroup_batch, lds_bank, coalescing)
+            emulator.launch(grid_size, kernel.get_kernarg(karg))
+            for observer in (lds_bank, coalescing):
+                if observer:
+                    observer.add_launch(grid_size, memory)
+            self.num_insts += emulator.num_insts
+        return memory.get(p_in, np.float32).reshape(p.n, p.c, p.hi, p.wi).copy()
+
+    def validate(self, tunable, conv_param, seed = 0, ref_cache = None, lds_bank = None, coalescing = None):
+        '''
+        (nrms, valid, message). message is set if emulator stopped on a kernel error, like out of bound access
+        '''
+        if ref_cache:
+            tensors, ref = ref_cache.get(conv_param, seed)
+        else:
+            tensors = conv_ref_tensors(conv_param, seed)
+            ref = conv_ref(conv_param, tensors)
+        try:
+            result = self.run(tunable, conv_param, tensors, lds_bank, coalescing)
+        except emulator_error_t as e:
+            return float('inf'), False, str(e)
+        nrms = conv_ref_nrms(ref, result)
+        return nrms, nrms < KERNEL_EMULATE_NRMS, ''
+
+    def __call__(self, conv_param_list, tunable_list, seed = 0, ref_cache = None):
+        '''
+        validate every applicable kernel on every problem, print one line each. return number of failed
+        '''
+        num_failed = 0
+        for p in conv_param_list:
+            print(f'[{conv_direction_to_string(p.direction)}] {cost_model_problem_string(p)}')
+            for tunable in tunable_list:
+                if not cost_model_is_applicable(p, tunable):
+                    continue
+                start = time.perf_counter()
+                lds_bank = lds_bank_t() if self.lds_bank else None
+                coalescing = gmem_coalescing_t() if self.coalescing else None
+                nrms, valid, message = self.validate(tunable, p, seed, ref_cache, lds_bank, coalescing)
+                num_failed += 0 if valid else 1
+                reports = [a.report() for a in (lds_bank, coalescing) if a and valid]
+                print(f'  {igemm_gtc_encode_kernel_name(tunable)}, nrms:{nrms:.3e}, valid:{"y" if valid else "n"}, ' +
+                        f'emulate:{time.perf_counter() - start:.1f}s' + (f', {message}' if message else '') +
+                        ''.join(f', {r[0]}' for r in reports))
+                for r in reports:
+                    for line in r[1:]:
+                        print(f'  {line}')
+        return num_failed
@@ -0,0 +1,112 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+# json manifest of generated kernels, instruction mix and resource usage from the recorded kernel body
+import re
+import json
+from .codegen import *
+
+KERNEL_MANIFEST_PROLOGUE    = 'prologue'
+KERNEL_MANIFEST_MAIN_LOOP   = 'main_loop'
+KERNEL_MANIFEST_EPILOGUE    = 'epilogue'
+
+KERNEL_MANIFEST_PHASES = [KERNEL_MANIFEST_PROLOGUE, KERNEL_MANIFEST_MAIN_LOOP, KERNEL_MANIFEST_EPILOGUE]
+
+_kernel_manifest_re_fma = re.compile(r'^v_(fma|fmac|mac|mad|pk_fma|dot\d+)_\w*f(16|32)$')
+
+def kernel_manifest_is_fma(opcode):
+    return _kernel_manifest_re_fma.match(opcode) is not None
+
+def kernel_manifest_split_phases(ir):
+    '''
+    (prologue, main loop, epilogue) statements of kernel body. main loop is from the fma body label
+    to the branch back to it, so it is exactly one iteration. no main loop if no such label
+    '''
+    stmts = list(ir)
+    labels = [i for i, s in enumerate(stmts) if type(s) is label_t and s.name.endswith('_fma_body')]
+    if not labels:
+        return stmts, [], []
+    begin = labels[0]
+    name = stmts[begin].name
+    branches = [i for i, s in enumerate(stmts) if i > begin and type(s) is inst_t and s.category == IR_CATEGORY_BRANCH and
+                    s.src and str(s.src[0]) == name]
+    assert branches, f'no branch back to {name}'
+    end = branches[-1] + 1
+    return stmts[:begin], stmts[begin:end], stmts[end:]
+
+def kernel_manifest_count(stmts, macro_table):
+    '''
+    (instructions of every category, fma) of stmts, .rept unrolled and macro expanded.
+    invocation of macro that can not be expanded is counted as IR_CATEGORY_MACRO
+    '''
+    count = {c : 0 for c in IR_CATEGORY_ALL}
+    fma = [0]
+    def visit(inst, times):
+        count[inst.category] += times
+        if kernel_manifest_is_fma(inst.opcode):
+            fma[0] += times
+    macro_table.walk(stmts, visit)
+    return count, fma[0]
+
+def kernel_manifest_get_entry(kernel):
+    '''
+    manifest entry of a kernel, dict of plain types so it can be dumped to json as is
+    '''
+    kernel.prepare_kernel_body()
+    kernel_code = kernel.get_kernel_code()
+    macro_table = kernel.get_kernel_macro_table()
+    insts = dict()
+    fma = dict()
+    for phase, stmts in zip(KERNEL_MANIFEST_PHASES, kernel_manifest_split_phases(kernel.recorded_body)):
+        insts[phase], fma[phase] = kernel_manifest_count(stmts, macro_table)
+    main_loop = insts[KERNEL_MANIFEST_MAIN_LOOP]
+    mem = main_loop[IR_CATEGORY_VMEM] + main_loop[IR_CATEGORY_LDS]
+    return {
+        'name'          : kernel.name(),
+        'direction'     : kernel.tunable.direction,
+        'precision'     : kernel.tunable.precision,
+        'gemm_mnk_per_block' : [kernel.tunable.gemm_m_per_block, kernel.tunable.gemm_n_per_block, kernel.tunable.gemm_k_per_block],
+        'thread_tile'   : [kernel.tunable.thread_tile_m, kernel.tunable.thread_tile_n],
+        'vgpr'          : kernel_code.workitem_vgpr_count,
+        'sgpr'          : kernel_code.wavefront_sgpr_count,
+        'lds'           : kernel_code.workgroup_group_segment_byte_size,
+        'block_size'    : kernel.tunable.block_size,
+        'insts'         : insts,
+        'fma'           : fma,
+        'main_loop'     : {
+            'k_per_iteration'       : kernel.tunable.gemm_k_per_block,
+            'insts_per_iteration'   : sum(main_loop.values()),
+            'fma_per_iteration'     : fma[KERNEL_MANIFEST_MAIN_LOOP],
+            'fma_per_mem'           : round(fma[KERNEL_MANIFEST_MAIN_LOOP] / mem, 3) if mem else None }
+    }
+
+def kernel_manifest_write(file_name, entries):
+    '''
+    entries are in kernel order, that is also the order of kernels in the .s
+    '''
+    with open(file_name, 'w') as f:
+        json.dump({'kernels' : entries}, f, indent = 2)
+        f.write('\n')
@@ -0,0 +1,162 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+from .codegen import *
+from .algo import *
+from .cost_model import *
+from .tuning_db import *
+
+KERNEL_SET_NODE_LIMIT   = 200000    # branch and bound gives up proving optimality after this, and keeps the best found
+
+def kernel_set_times_from_tuning_db(tuning_db, arch):
+    '''
+    problem string -> {kernel name : measured time}, for shapes of arch
+    '''
+    return {cost_model_problem_string(tuning_db_key_to_conv_param(key)) : dict(results)
+                for key, results in tuning_db.records.items() if key[0] == tuning_db_arch(arch)}
+
+def kernel_set_times_from_cost_model(cost_model, conv_param_list, kernel_list):
+    '''
+    problem string -> {kernel name : modelled time}
+    '''
+    times = dict()
+    for conv_param in conv_param_list:
+        times[cost_model_problem_string(conv_param)] = {e.name : e.time_us for e in cost_model.rank(conv_param, kernel_list)}
+    return times
+
+class kernel_set_t(object):
+    '''
+    smallest set of kernels, so that every problem has a kernel within tolerance (e.g. 0.05 for 5%) of its best one.
+    this is set cover. problems covered by any kernel covering another problem, and kernels covering a subset of
+    another kernel are dropped first, then branch and bound on the problem with fewest kernels, seeded by greedy.
+    among kernels of same cover, the faster one in total is kept
+    '''
+    def __init__(self, times, tolerance, node_limit = KERNEL_SET_NODE_LIMIT):
+        self.times = times
+        self.tolerance = tolerance
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.optimal = True
+        self.uncovered = [p for p in times if not times[p]]     # no kernel can run it at all
+        self.best = {p : min(t.values()) for p, t in times.items() if t}
+        self.cover = dict()         # kernel -> frozenset of problems within tolerance
+        for p, t in times.items():
+            for kernel, time in t.items():
+                if p in self.best and time <= self.best[p] * (1 + tolerance):
+                    self.cover.setdefault(kernel, set()).add(p)
+        self.cover = {kernel : frozenset(ps) for kernel, ps in self.cover.items()}
+
+    def total_time(self, kernel):
+        return sum(self.times[p][kernel] for p in self.cover[kernel])
+
+    def reduce(self):
+        '''
+        return (kernels, problems) left after dominance reduction
+        '''
+        by_cover = dict()
+        for kernel in sorted(self.cover, key = lambda k: (self.total_time(k), k)):
+            by_cover.setdefault(self.cover[kernel], kernel)
+        kernels = [k for c, k in by_cover.items() if not any(c < other for other in by_cover)]
+        covering = {p : frozenset(k for k in kernels if p in self.cover[k]) for p in self.best}
+        problems = [p for p in self.best if not any(covering[q] < covering[p] or (covering[q] == covering[p] and q < p)
+                            for q in self.best if q != p)] if len(self.best) <= 2000 else list(self.best)
+        return kernels, problems
+
+    def greedy(self, kernels, problems):
+        left = set(problems)
+        chosen = list()
+        while left:
+            kernel = max(kernels, key = lambda k: (len(self.cover[k] & left), -self.total_time(k), k))
+            chosen.append(kernel)
+            left -= self.cover[kernel]
+        return chosen
+
+    def solve(self):
+        kernels, problems = self.reduce()
+        best = self.greedy(kernels, problems)
+        covering = {p : [k for k in kernels if p in self.cover[k]] for p in problems}
+        for p in covering:
+            covering[p].sort(key = lambda k: (-len(self.cover[k]), self.total_time(k), k))
+        self.nodes = 0
+
+        def lower_bound(left):
+            # problems with pairwise disjoint covering kernels need one kernel each
+            bound, used = 0, set()
+            for p in sorted(left, key = lambda p: len(covering[p])):
+                if used.isdisjoint(covering[p]):
+                    used.update(covering[p])
+                    bound += 1
+            return bound
+
+        def branch(left, chosen):
+            nonlocal best
+            self.nodes += 1
+            if self.nodes > self.node_limit:
+                self.optimal = False
+                return
+            if not left:
+                if len(chosen) < len(best):
+                    best = list(chosen)
+                return
+            if len(chosen) + lower_bound(left) >= len(best):
+                return
+            p = min(left, key = lambda p: (len(covering[p]), p))
+            for kernel in covering[p]:
+                chosen.append(kernel)
+                branch(left - self.cover[kernel], chosen)
+                chosen.pop()
+
+        branch(frozenset(problems), list())
+        return sorted(best)
+
+    def report(self, kernel_set):
+        '''
+        every problem with best time, and time of best kernel in set
+        '''
+        lines = [f"{'best':>12}{'in set':>12}{'slower':>9}  problem"]
+        for p in sorted(self.best):
+            in_set = min(self.times[p][k] for k in kernel_set if k in self.times[p])
+            lines.append(f'{self.best[p]:>12.3f}{in_set:>12.3f}{100 * (in_set / self.best[p] - 1):>8.1f}%  {p}')
+        for p in self.uncovered:
+            lines.append(f"{'-':>12}{'-':>12}{'-':>9}  {p}, no kernel")
+        lines.append(f"{len(kernel_set)} of {len(self.cover)} kernels cover {len(self.best)} problems within {100 * self.tolerance:g}%" + \
+                    ('' if self.optimal else f', not proved minimal after {self.nodes} nodes'))
+        return '\n'.join(lines)
+
+def kernel_set_prune_config(config_content, kernel_set):
+    '''
+    new config_content_t with only the igemm sections of kernel in kernel_set, other sections are kept
+    '''
+    kernel_set = set(kernel_set)
+    pruned = config_content_t()
+    for sec in config_content:
+        if sec.get_name().startswith('igemm_'):
+            name = igemm_gtc_encode_kernel_name(igemm_gtc_tunable_parameter_t(sec.to_dict()))
+            if name not in kernel_set:
+                continue
+            kernel_set.discard(name)
+        pruned.add_section(sec)
+    return pruned
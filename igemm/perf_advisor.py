@@ -24,11 +24,78 @@
 # 
 ################################################################################
 # pylint: disable=maybe-no-member
+from .codegen import *
+
+class perf_advisor_occupancy_t(object):
+    '''
+    occupancy of a single kernel. limits is resource -> max workgroups per cu,
+    to_free is resource -> how much to free to have one more workgroup per cu
+    '''
+    def __init__(self, name, vgpr, sgpr, lds, block_size):
+        self.name = name
+        self.vgpr = vgpr
+        self.sgpr = sgpr
+        self.lds = lds
+        self.block_size = block_size
+        self.limits = dict()
+        self.blocks_per_cu = 0
+        self.waves_per_simd = 0
+        self.limiter = None
+        self.to_free = dict()
 
 class perf_advisor_t(object):
     '''
     for amdgpu
+    static occupancy from vgpr/sgpr/lds usage of each kernel, and the limiting resource.
+    kernel below occupancy_floor (waves per simd) is rejected
     '''
-    def __init__(self):
-        pass
-    def advise_occupancy():
+    def __init__(self, arch_detail, occupancy_floor = 0):
+        self.arch_detail = arch_detail
+        self.occupancy_floor = occupancy_floor
+
+    def get_to_free(self, occupancy, target_blocks):
+        '''
+        resource -> amount to free, for every resource not enough for target_blocks. None if can't reach
+        '''
+        if occupancy.limits[AMDGPU_OCCUPANCY_LIMIT_WAVES] < target_blocks:
+            return None
+        used = {AMDGPU_OCCUPANCY_LIMIT_VGPR : occupancy.vgpr, AMDGPU_OCCUPANCY_LIMIT_SGPR : occupancy.sgpr, AMDGPU_OCCUPANCY_LIMIT_LDS : occupancy.lds}
+        return {resource : used[resource] - amdgpu_occupancy_max_resource(self.arch_detail, resource, occupancy.block_size, target_blocks)
+                    for resource, blocks in occupancy.limits.items() if blocks < target_blocks}
+
+    def advise_occupancy(self, kernel):
+        kernel_code = kernel.get_kernel_code()
+        occupancy = perf_advisor_occupancy_t(kernel.name(), kernel_code.workitem_vgpr_count, kernel_code.wavefront_sgpr_count,
+                        kernel_code.workgroup_group_segment_byte_size, kernel.tunable.block_size)
+        occupancy.limits = amdgpu_occupancy_limits(self.arch_detail, occupancy.vgpr, occupancy.block_size, occupancy.lds, occupancy.sgpr)
+        blocks = min(occupancy.limits.values())
+        assert blocks == 0 or amdgpu_valid_occupancy_with_max_waves(self.arch_detail, occupancy.block_size, blocks)
+        occupancy.blocks_per_cu = blocks
+        occupancy.waves_per_simd = blocks * amdgpu_waves_per_block(self.arch_detail, occupancy.block_size) / AMDGPU_SIMD_PER_CU
+        # hardware limit is reported only if every resource allows more
+        occupancy.limiter = min(occupancy.limits, key = lambda r: (occupancy.limits[r], r == AMDGPU_OCCUPANCY_LIMIT_WAVES))
+        occupancy.to_free = self.get_to_free(occupancy, blocks + 1)
+        return occupancy
+
+    def is_accepted(self, occupancy):
+        return occupancy.blocks_per_cu > 0 and occupancy.waves_per_simd >= self.occupancy_floor
+
+    def report(self, occupancy_list):
+        lines = [f"{'vgpr':>6}{'sgpr':>6}{'lds':>7}{'block':>7}{'wg/cu':>7}{'waves/simd':>12}  {'limiter':<9}{'next level':<28}kernel"]
+        for o in occupancy_list:
+            if o.to_free is None:
+                next_level = 'max'
+            else:
+                next_level = 'free ' + ', '.join(f'{v} {k}' for k, v in sorted(o.to_free.items()))
+            if not self.is_accepted(o):
+                next_level = f'rejected, < {self.occupancy_floor}'
+            lines.append(f"{o.vgpr:>6}{o.sgpr:>6}{o.lds:>7}{o.block_size:>7}{o.blocks_per_cu:>7}{o.waves_per_simd:>12g}  {o.limiter:<9}{next_level:<28}{o.name}")
+        return '\n'.join(lines)
+
+    def __call__(self, kernel_list):
+        '''
+        print report, return list of kernel accepted
+        '''
+        occupancy_list = [self.advise_occupancy(kernel) for kernel in kernel_list]
+        print(self.report(occupancy_list))
+        return [kernel for kernel, o in zip(kernel_list, occupancy_list) if self.is_accepted(o)]
@@ -0,0 +1,222 @@
+################################################################################
+# 
+#  MIT License
+# 
+#  Copyright (c) 2020 Advanced Micro Devices, Inc.
+# 
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+# 
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+# 
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+# 
+################################################################################
+# pylint: disable=maybe-no-member
+import os
+import re
+import math
+import struct
+from .codegen import *
+from .algo import *
+
+# binary tuning database, read by driver/tuning_db.h as well. little endian:
+#   header      magic, version, num_records, num_buckets, num_names, names_bytes, num_entries
+#   names       num_names kernel names, each terminated by '\0'
+#   records     num_records x (TUNING_DB_KEY_LEN int32 key, uint32 first entry, uint32 num entries)
+#   entries     num_entries x (uint32 name index, float32 time in ms), fastest first in each record
+#   buckets     num_buckets x uint32 record index, open addressing with linear probe of tuning_db_hash()
+TUNING_DB_MAGIC         = b'IGTUNEDB'
+TUNING_DB_VERSION       = 1
+TUNING_DB_KEY_LEN       = 17
+TUNING_DB_EMPTY_BUCKET  = 0xffffffff
+TUNING_DB_HEADER        = struct.Struct('<8s6I')
+TUNING_DB_RECORD        = struct.Struct(f'<{TUNING_DB_KEY_LEN}i2I')
+TUNING_DB_ENTRY         = struct.Struct('<If')
+
+# key is arch, direction, precision, then these conv_param_t fields
+TUNING_DB_KEY_FIELDS    = ['n', 'c', 'hi', 'wi', 'k', 'y', 'x', 'sy', 'sx', 'py', 'px', 'dy', 'dx', 'g']
+# nearest shape: squared distance of log2(1+v) of each field, filter geometry weights more than sizes
+TUNING_DB_FEATURE_WEIGHTS = [1, 1, 1, 1, 1, 4, 4, 4, 4, 4, 4, 4, 4, 4]
+
+def tuning_db_arch(arch):
+    '''
+    arch is AMDGPU_ARCH_* or string like 'gfx908', and is stored as 908
+    '''
+    if type(arch) is not str:
+        arch = amdgpu_arch_to_string(arch)
+    return int(arch[3:])
+
+def tuning_db_key(arch, conv_param):
+    precision = conv_param.precision
+    if type(precision) is str:
+        precision = amdgpu_string_to_precision(precision)
+    return (tuning_db_arch(arch), conv_param.direction, precision >> 20) + \
+                tuple(getattr(conv_param, f) for f in TUNING_DB_KEY_FIELDS)
+
+def tuning_db_key_to_conv_param(key):
+    fields = dict(zip(TUNING_DB_KEY_FIELDS, key[3:]))
+    return conv_param_t(fields['n'], fields['g'], fields['c'], fields['hi'], fields['wi'], fields['k'], fields['y'], fields['x'],
+                fields['py'], fields['px'], fields['sy'], fields['sx'], fields['dy'], fields['dx'], -1, -1,
+                key[1], amdgpu_precision_to_string(key[2] << 20))
+
+def tuning_db_hash(key):
+    '''
+    fnv-1a over 32bit words of key
+    '''
+    h = 2166136261
+    for w in key:
+        h = ((h ^ (w & 0xffffffff)) * 16777619) & 0xffffffff
+    return h
+
+def _tuning_db_is_1x1(key):
+    # nxe=0 kernels only run this class, so nearest shape never crosses it
+    y, x, sy, sx, py, px = key[8:14]
+    return y == 1 and x == 1 and sy == 1 and sx == 1 and py == 0 and px == 0
+
+def _tuning_db_features(key):
+    return [math.log2(1 + v) for v in key[3:]]
+
+class tuning_db_t(object):
+    '''
+    (arch, direction, precision, conv shape) -> kernels ranked by measured time.
+    exact match is a hash lookup, unseen shape falls back to nearest tuned shape of same arch/direction/precision
+    '''
+    def __init__(self, file_name = None):
+        self.file_name = file_name
+        self.records = dict()       # key -> [(kernel name, time ms)], fastest first
+        if file_name and os.path.exists(file_name):
+            self.load(file_name)
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, arch, conv_param, results):
+        '''
+        results is iterable of (kernel name, time ms), merged into existing record by keeping best time of each kernel
+        '''
+        key = tuning_db_key(arch, conv_param)
+        best = dict(self.records.get(key, list()))
+        for name, time_ms in results:
+            if name not in best or time_ms < best[name]:
+                best[name] = time_ms
+        self.records[key] = sorted(best.items(), key = lambda r: (r[1], r[0]))
+
+    def lookup(self, arch, conv_param):
+        return self.records.get(tuning_db_key(arch, conv_param), None)
+
+    def nearest(self, arch, conv_param):
+        '''
+        return (conv_param of nearest tuned shape, results), or None
+        '''
+        key = tuning_db_key(arch, conv_param)
+        features = _tuning_db_features(key)
+        is_1x1 = _tuning_db_is_1x1(key)
+        best_key, best_dist = None, 0
+        for k in self.records:
+            if k[:3] != key[:3] or _tuning_db_is_1x1(k) != is_1x1:
+                continue
+            dist = sum(w * (a - b) ** 2 for w, a, b in zip(TUNING_DB_FEATURE_WEIGHTS, _tuning_db_features(k), features))
+            if best_key is None or (dist, k) < (best_dist, best_key):
+                best_key, best_dist = k, dist
+        if best_key is None:
+            return None
+        return tuning_db_key_to_conv_param(best_key), self.records[best_key]
+
+    def find(self, arch, conv_param):
+        '''
+        return (results, is exact match), results is None if nothing in db for this arch/direction/precision
+        '''
+        results = self.lookup(arch, conv_param)
+        if results is not None:
+            return results, True
+        near = self.nearest(arch, conv_param)
+        return (near[1] if near else None), False
+
+    def load(self, file_name):
+        with open(file_name, 'rb') as f:
+            data = f.read()
+        magic, version, num_records, num_buckets, num_names, names_bytes, num_entries = TUNING_DB_HEADER.unpack_from(data, 0)
+        assert magic == TUNING_DB_MAGIC and version == TUNING_DB_VERSION, f'{file_name} is not a tuning db of version {TUNING_DB_VERSION}'
+        offset = TUNING_DB_HEADER.size
+        names = data[offset : offset + names_bytes].decode().split('\0')[:num_names]
+        offset += names_bytes
+        entries_offset = offset + num_records * TUNING_DB_RECORD.size
+        self.records = dict()
+        for record in TUNING_DB_RECORD.iter_unpack(data[offset : entries_offset]):
+            first, count = record[TUNING_DB_KEY_LEN:]
+            entries = [TUNING_DB_ENTRY.unpack_from(data, entries_offset + (first + i) * TUNING_DB_ENTRY.size) for i in range(count)]
+            self.records[record[:TUNING_DB_KEY_LEN]] = [(names[i], t) for i, t in entries]
+
+    def save(self, file_name = None):
+        file_name = file_name if file_name else self.file_name
+        names = sorted({name for results in self.records.values() for name, _ in results})
+        name_index = {name : i for i, name in enumerate(names)}
+        names_data = b''.join(name.encode() + b'\0' for name in names)
+        keys = sorted(self.records)
+        num_buckets = 2
+        while num_buckets < 2 * len(keys):
+            num_buckets *= 2
+        buckets = [TUNING_DB_EMPTY_BUCKET] * num_buckets
+        records_data = bytearray()
+        entries_data = bytearray()
+        num_entries = 0
+        for i, key in enumerate(keys):
+            results = self.records[key]
+            records_data += TUNING_DB_RECORD.pack(*key, num_entries, len(results))
+            for name, time_ms in results:
+                entries_data += TUNING_DB_ENTRY.pack(name_index[name], time_ms)
+            num_entries += len(results)
+            b = tuning_db_hash(key) & (num_buckets - 1)
+            while buckets[b] != TUNING_DB_EMPTY_BUCKET:
+                b = (b + 1) & (num_buckets - 1)
+            buckets[b] = i
+        with open(file_name, 'wb') as f:
+            f.write(TUNING_DB_HEADER.pack(TUNING_DB_MAGIC, TUNING_DB_VERSION, len(keys), num_buckets, len(names), len(names_data), num_entries))
+            f.write(names_data)
+            f.write(records_data)
+            f.write(entries_data)
+            f.write(struct.pack(f'<{num_buckets}I', *buckets))
+
+def tuning_db_import_driver_log(tuning_db, arch, lines):
+    '''
+    conv_driver.exe prints "[bwd] n:.., c:.., ..." before the kernels of a shape, then "  <kernel>, cost:<t>ms, ..." per kernel.
+    precision is the one igemm_gtc_encode_kernel_name() puts in the kernel name, so kernels of different precision
+    go to different keys. kernel with "valid:n" is not imported. return number of kernel results imported
+    '''
+    shape_args = None
+    results = dict()        # precision -> [(kernel, time)]
+    num_results = 0
+    def flush():
+        if shape_args is None:
+            return
+        for precision, precision_results in results.items():
+            tuning_db.add(arch, conv_param_t(*shape_args, precision), precision_results)
+    for line in lines:
+        shape = re.match(r'\s*\[(fwd|bwd|wrw)\]\s*(.*)', line)
+        if shape:
+            flush()
+            results = dict()
+            f = {k : int(v) for k, v in re.findall(r'(\w+):\s*(-?\d+)', shape.group(2))}
+            shape_args = (f['n'], f.get('g', 1), f['c'], f['h'], f['w'], f['k'], f['y'], f['x'], f['py'], f['px'],
+                            f['sy'], f['sx'], f['dy'], f['dx'], -1, -1, conv_string_to_direction(shape.group(1)))
+            continue
+        result = re.match(r'\s*(\w+),\s*cost:\s*([0-9.]+)ms', line)
+        if result and shape_args is not None and 'valid:n' not in line:
+            precision = re.match(r'igemm_(?:fwd|bwd|wrw)_gtc_(fp32|fp16|bf16)_', result.group(1))
+            assert precision, f'no precision in kernel name {result.group(1)}'
+            results.setdefault(precision.group(1), []).append((result.group(1), float(result.group(2))))
+            num_results += 1
+    flush()
+    return num_results
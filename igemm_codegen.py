@@ -25,6 +25,8 @@
 ################################################################################
 from __future__ import print_function
 import argparse
+import logging
+import itertools
 import sys, os, shutil
 
 from igemm import *
@@ -32,37 +34,224 @@ from igemm import *
 OUT_DIR='out'
 CPP_DIR='driver'
 
-def igemm_host_driver(args, config_content):
+def igemm_get_cache(args):
+    if args.no_cache:
+        return None
+    return build_cache_t(args.cache_dir if args.cache_dir else os.path.join(args.dir, BUILD_CACHE_DIR))
+
+def igemm_host_driver(args, config_file, config_content, cache = None):
     cpp_src = os.path.join(CPP_DIR, "conv_driver.cpp")
     target_exe = os.path.join(args.dir, "conv_driver.exe")
     sec_root = config_content.get_section('codegen')[0]
     arch = amdgpu_arch_config_t({
         'arch'          :   amdgpu_string_to_arch(sec_root['arch'])})
-    builder = compile_host_t(arch, cpp_src, target_exe)
-    config_file_name = os.path.abspath(args.config_file)
+    builder = compile_host_t(arch, cpp_src, target_exe, cache = cache)
+    config_file_name = os.path.abspath(config_file)
     hsaco_name = os.path.splitext(os.path.basename(args.config_file))[0] + '.hsaco'
     rtn = builder.compile(cxxflags=['-DIGEMM_CONFIG_FILE=\"{}\"'.format(config_file_name), \
                         '-DIGEMM_HSACO=\"{}\"'.format(hsaco_name)])
     if not rtn:
         assert False
 
-def igemm_flatten(args, config_content):
-    asm_target = os.path.join(args.dir, os.path.splitext(os.path.basename(args.config_file))[0] + '.s')
+def igemm_expand_sweep(args, config_content, write = True):
+    '''
+    sections with list/range/'auto' values are expanded into one section per valid tunable, and written
+    to output dir, since host driver reads kernels from the config file as well. if not write, config file is None
+    '''
+    if not any(igemm_gtc_is_sweep_dict(sec.to_dict()) for sec in config_content if sec.get_name().startswith('igemm_')):
+        return args.config_file, config_content
+    def expand_sections():
+        for sec in config_content:
+            if not sec.get_name().startswith('igemm_'):
+                continue
+            for tunable_dict in igemm_gtc_expand_tunable_dicts([sec.to_dict()]):
+                expanded_sec = config_section_t(sec.get_name())
+                for key, value in tunable_dict.items():
+                    expanded_sec[key] = value
+                yield expanded_sec
+    sweep_content = config_content_t()
+    for sec in config_content:
+        if not sec.get_name().startswith('igemm_'):
+            sweep_content.add_section(sec)
+    num_tunables = 0
+    for sec in itertools.islice(expand_sections(), args.sweep_limit if args.sweep_limit else None):
+        sweep_content.add_section(sec)
+        num_tunables += 1
+    if not write:
+        print(f'sweep: {num_tunables} valid tunable(s)')
+        return None, sweep_content
+    config_file = os.path.join(args.dir, os.path.splitext(os.path.basename(args.config_file))[0] + '_sweep.config')
+    sweep_content.write(config_file)
+    print(f'sweep: {num_tunables} valid tunable(s) written to {config_file}')
+    return config_file, sweep_content
+
+def igemm_flatten(args, config_content, cache = None):
+    base_name = os.path.splitext(os.path.basename(args.config_file))[0]
+    split = None
+    if args.split:
+        # one .s per kernel under this dir, driver mc writes the shared macro include
+        split_dir = os.path.join(args.dir, base_name + '_split')
+        os.makedirs(split_dir, exist_ok=True)
+        asm_target = os.path.join(split_dir, IGEMM_SPLIT_MACRO_INCLUDE)
+        split = igemm_split_compile_t(os.path.join(args.dir, base_name + '.hsaco'),
+                    args.asm_cmd, args.link_cmd, args.disass_cmd)
+    else:
+        asm_target = os.path.join(args.dir, base_name + '.s')
     emitter = mc_emit_to_file_t(asm_target)
     sec_root = config_content.get_section('codegen')[0]
     arch = amdgpu_arch_config_t({
         'arch'          :   amdgpu_string_to_arch( sec_root['arch'] ),
         'data_type'     :   AMDGPU_PRECISION_FP32,
-        'code_object'   :   amdgpu_string_to_codeobj( sec_root['code_object']) })
+        'code_object'   :   amdgpu_string_to_codeobj( sec_root['code_object']),
+        'schedule'      :   args.schedule,
+        'vgpr_alloc'    :   not args.linear_vgpr,
+        'analytic_waitcnt'  :   not args.manual_waitcnt })
 
     # create mc
     mc = mc_asm_printer_t(emitter, arch)
+    profiler = None
+    if args.profile or args.profile_trace:
+        profiler = mc_profiler_t(trace = args.profile_trace is not None)
+        mc.set_profiler(profiler)
 
     tunable_dicts = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_')]
 
-    igemm_codegen_driver_t(mc, tunable_dicts)()
+    advisor = perf_advisor_t(amdgpu_get_arch_detail(arch.arch), args.occupancy_floor)
+
+    manifest = os.path.join(args.dir, base_name + '_manifest.json') if args.manifest else None
 
+    driver = igemm_codegen_driver_t(mc, tunable_dicts, args.jobs, cache, split, args.emit_all_macro, advisor, manifest)
+    driver.do_emit()
+    if profiler:
+        print(profiler.report(args.profile_top))
+        if args.profile_trace:
+            profiler.write_trace(args.profile_trace)
+    driver.do_compile()
+    # kernels below --occupancy-floor are dropped by advisor
+    return driver.tunable_dicts
 
+def igemm_occupancy_config(args, config_file, config_content, tunable_dicts):
+    '''
+    host driver looks up every kernel of its config in the hsaco, so if --occupancy-floor dropped any, the kernels
+    really generated are written to output dir like the _sweep/_min config, for host driver to be built from
+    '''
+    if len(tunable_dicts) == len([sec for sec in config_content if sec.get_name().startswith('igemm_')]):
+        return config_file
+    names = [igemm_gtc_encode_kernel_name(igemm_gtc_tunable_parameter_t(td)) for td in tunable_dicts]
+    config_file = os.path.join(args.dir, os.path.splitext(os.path.basename(args.config_file))[0] + '_occupancy.config')
+    kernel_set_prune_config(config_content, names).write(config_file)
+    print(f'occupancy floor: {len(names)} kernel(s) written to {config_file}')
+    return config_file
+
+def igemm_get_conv_params(args, tunable_dicts):
+    '''
+    problems of --rank, and of --problems scripts/logs of driver command lines, for directions of kernels in config
+    '''
+    conv_param_list = [cost_model_parse_problem(problem) for problem in args.rank]
+    workload = conv_workload_t()
+    for problem_file in args.problems:
+        workload.add_file(problem_file)
+    if args.problems:
+        print(f'workload: {len(workload)} unique problem(s) from {workload.num_lines} line(s)')
+    directions = {conv_string_to_direction(td['direction']) for td in tunable_dicts}
+    return [p for p in conv_param_list + workload.get_conv_params() if p.direction in directions]
+
+def igemm_get_allocated_kernels(args, config_content, tunable_dicts):
+    '''
+    kernels of config with the vgpr count they are generated with. until the body is recorded and allocated,
+    kernel_vgpr_t only has the linear layout, so cost model and occupancy would see too many vgpr
+    '''
+    sec_root = config_content.get_section('codegen')[0]
+    arch = amdgpu_arch_config_t({
+        'arch'          :   amdgpu_string_to_arch( sec_root['arch'] ),
+        'data_type'     :   AMDGPU_PRECISION_FP32,
+        'code_object'   :   amdgpu_string_to_codeobj( sec_root['code_object']),
+        'schedule'      :   args.schedule,
+        'vgpr_alloc'    :   not args.linear_vgpr,
+        'analytic_waitcnt'  :   False })         # does not change vgpr
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), arch)
+    kernel_list = [igemm_bwd_gtc_t(mc, igemm_gtc_tunable_parameter_t(td)) for td in tunable_dicts]
+    if arch.vgpr_alloc:
+        # body is only generated for data_type of arch, other kernels keep the linear count
+        for kernel in kernel_list:
+            if kernel.tunable.precision == 'fp32':
+                kernel.prepare_kernel_body()
+    return kernel_list
+
+def igemm_rank(args, config_content):
+    '''
+    rank kernels of config for every problem by roofline cost model, nothing is written
+    '''
+    sec_root = config_content.get_section('codegen')[0]
+    tunable_dicts = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_')]
+    kernel_list = igemm_get_allocated_kernels(args, config_content, tunable_dicts)
+    conv_param_list = igemm_get_conv_params(args, tunable_dicts)
+    cost_model_t(amdgpu_get_arch_detail(amdgpu_string_to_arch(sec_root['arch'])))(conv_param_list, kernel_list, args.rank_top)
+
+def igemm_emulate(args, config_content):
+    '''
+    generate kernels of config in memory, and validate them on --rank/--problems problems by cpu emulator.
+    return number of failed kernel/problem pairs
+    '''
+    sec_root = config_content.get_section('codegen')[0]
+    arch = amdgpu_arch_config_t({
+        'arch'          :   amdgpu_string_to_arch( sec_root['arch'] ),
+        'data_type'     :   AMDGPU_PRECISION_FP32,
+        'code_object'   :   amdgpu_string_to_codeobj( sec_root['code_object']),
+        'schedule'      :   args.schedule,
+        'vgpr_alloc'    :   not args.linear_vgpr,
+        'analytic_waitcnt'  :   not args.manual_waitcnt })
+    assert arch.code_object == AMDGPU_CODEOBJECT_V3, 'emulator only parses code object v3'
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), arch)
+    # emulator computes fp32 only
+    tunable_dicts = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_') and sec['precision'] == 'fp32']
+    igemm_codegen_driver_t(mc, tunable_dicts).do_emit()
+    ref_cache = None
+    if not args.no_cache:
+        ref_cache = conv_ref_cache_t(os.path.join(args.cache_dir if args.cache_dir else os.path.join(args.dir, BUILD_CACHE_DIR), 'conv_ref'))
+    conv_param_list = igemm_get_conv_params(args, tunable_dicts)
+    assert conv_param_list, 'no problem of --rank/--problems has the direction of a kernel in config, nothing to emulate'
+    emulate = kernel_emulate_t(mc.emitter.get_buffer(), lds_bank = args.lds_bank, coalescing = args.coalescing)
+    num_failed = emulate(conv_param_list, [igemm_gtc_tunable_parameter_t(td) for td in tunable_dicts], ref_cache = ref_cache)
+    print(f'emulate: {num_failed} failed')
+    return num_failed
+
+def igemm_tuning_db(args, config_content):
+    '''
+    import conv_driver.exe logs into tuning db, so host driver with IGEMM_TUNING_DB only runs the best kernel of a tuned shape
+    '''
+    sec_root = config_content.get_section('codegen')[0]
+    tuning_db = tuning_db_t(args.tuning_db)
+    num_results = 0
+    for log_file in args.tuning_log:
+        with open(log_file) as f:
+            num_results += tuning_db_import_driver_log(tuning_db, sec_root['arch'], f)
+    tuning_db.save()
+    print(f'tuning db: {num_results} result(s) imported, {len(tuning_db)} shape(s) in {args.tuning_db}')
+
+def igemm_kernel_set(args, config_content):
+    '''
+    write config with smallest set of kernels keeping every problem within tolerance of its best kernel.
+    times are measured ones from --tuning-db, or modelled ones for --rank problems
+    '''
+    arch = amdgpu_string_to_arch(config_content.get_section('codegen')[0]['arch'])
+    tunable_dicts = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_')]
+    if args.tuning_db:
+        times = kernel_set_times_from_tuning_db(tuning_db_t(args.tuning_db), arch)
+        # only kernels of this config can be chosen
+        names = {igemm_gtc_encode_kernel_name(igemm_gtc_tunable_parameter_t(td)) for td in tunable_dicts}
+        times = {p : {k : t for k, t in kt.items() if k in names} for p, kt in times.items()}
+    else:
+        kernel_list = igemm_get_allocated_kernels(args, config_content, tunable_dicts)
+        conv_param_list = igemm_get_conv_params(args, tunable_dicts)
+        times = kernel_set_times_from_cost_model(cost_model_t(amdgpu_get_arch_detail(arch)), conv_param_list, kernel_list)
+    assert any(times.values()), 'no problem has a time of any kernel of this config, nothing to choose kernel set for'
+    kernel_set = kernel_set_t(times, args.kernel_set_tolerance / 100)
+    chosen = kernel_set.solve()
+    print(kernel_set.report(chosen))
+    config_file = os.path.join(args.dir, os.path.splitext(os.path.basename(args.config_file))[0] + '_min.config')
+    kernel_set_prune_config(config_content, chosen).write(config_file)
+    print(f'kernel set: {len(chosen)} kernel(s) written to {config_file}')
 
 #def igemm_sequence(args, config_content):
 #    kseq = v4r1_dynamic_kernel_sequencer_t(amdgpu_get_gfx906_60cu(),
@@ -73,7 +262,40 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument("config_file", help="config file as input")
     parser.add_argument("-d", "--dir", help="directory of output files", default = OUT_DIR)
+    parser.add_argument("-j", "--jobs", help="number of processes to generate kernels in parallel", type=int, default = 1)
+    parser.add_argument("--cache-dir", help="directory of build cache, default is {}/ under output dir".format(BUILD_CACHE_DIR), default = None)
+    parser.add_argument("--no-cache", help="clean output dir and rebuild everything", action="store_true")
+    parser.add_argument("--emit-all-macro", help="emit every known macro, not only the ones referenced by kernels", action="store_true")
+    parser.add_argument("--schedule", help="latency-aware schedule of fma main loop, the lds unroll body and the loop tail with global/lds load macros expanded. s_barrier, vmcnt waits, exec writes, labels and branches stay fences. predicted stall cycles are printed with --verbose", action="store_true")
+    parser.add_argument("--linear-vgpr", help="keep vgpr in declaration order, no live range allocation", action="store_true")
+    parser.add_argument("--manual-waitcnt", help="keep hand written s_waitcnt, no dataflow waitcnt pass. predicted wait cycles of the pass are printed with --verbose", action="store_true")
+    parser.add_argument("--manifest", help="write json of instruction mix per prologue/main loop/epilogue and resource usage of every kernel, next to the .s", action="store_true")
+    parser.add_argument("--profile", help="time and count lines/bytes emitted by every emitter class and every kernel, print the most expensive ones", action="store_true")
+    parser.add_argument("--profile-top", help="number of emitters and kernels listed by --profile, 0 for all", type=int, default = 20)
+    parser.add_argument("--profile-trace", help="also write chrome trace json of code generation to this file, implies --profile", default = None)
+    parser.add_argument("--occupancy-floor", help="skip kernels with less waves per SIMD than this, host driver is then built from _occupancy.config of the generated ones in output dir", type=float, default = 0)
+    parser.add_argument("--sweep-limit", help="take at most this many valid tunables from config sections with list/range values", type=int, default = 0)
+    parser.add_argument("--rank", help="rank kernels of config by roofline cost model for this problem instead of generating, e.g. \"n=128,c=1024,hi=17,wi=17,k=1024,x=7,px=3\", can be repeated", action="append", default = [])
+    parser.add_argument("--problems", help="script or log of driver command lines (conv -n .. -c .. -H ..) as problems of --rank and --kernel-set-tolerance, can be repeated", action="append", default = [])
+    parser.add_argument("--emulate", help="validate kernels of config on --rank/--problems problems by cpu emulator instead of ranking, exit non-zero on mismatch", action="store_true")
+    parser.add_argument("--lds-bank", help="with --emulate, report lds bank conflict cycles of every kernel and its worst ds instructions", action="store_true")
+    parser.add_argument("--coalescing", help="with --emulate, report global memory transactions per request, wasted bytes and l2 footprint per workgroup of every kernel", action="store_true")
+    parser.add_argument("--rank-top", help="number of kernels listed per problem by --rank, 0 for all", type=int, default = 5)
+    parser.add_argument("--tuning-db", help="tuning db file to import --tuning-log into, instead of generating", default = None)
+    parser.add_argument("--tuning-log", help="output of conv_driver.exe imported into --tuning-db, can be repeated", action="append", default = [])
+    parser.add_argument("--kernel-set-tolerance", help="write smallest set of kernels within this percent of best kernel of every problem, by --tuning-db measurement or --rank problems", type=float, default = None)
+    parser.add_argument("--split", help="write one .s per kernel, assemble them with --jobs workers and link into one hsaco", action="store_true")
+    parser.add_argument("--asm-cmd", help="assembler command template for --split, with {arch}, {src}, {obj}", default = None)
+    parser.add_argument("--link-cmd", help="linker command template for --split, with {objs}, {target}", default = None)
+    parser.add_argument("--disass-cmd", help="disassembler command template for --split, with {arch}, {src}, output from stdout", default = None)
+    parser.add_argument("-v", "--verbose", help="print per kernel statistics of code generation passes", action="store_true")
     args = parser.parse_args()
+    if args.kernel_set_tolerance is not None and not args.tuning_db and not (args.rank or args.problems):
+        parser.error("--kernel-set-tolerance needs --tuning-db, or --rank/--problems for modelled times")
+    if args.emulate and not (args.rank or args.problems):
+        parser.error("--emulate needs --rank/--problems for problems to validate on")
+    if args.verbose:
+        logging.basicConfig(level = logging.INFO, format = '%(message)s')
 
     config_parser = config_parser_t(args.config_file)
     #print(os.getcwd())
@@ -81,10 +303,29 @@ if __name__ == '__main__':
     #config_content.dump()
 
     if config_content.get_section('codegen')[0]['mode'] in ('flat', 'flatten'):
-        shutil.rmtree(args.dir, ignore_errors=True)
-        os.mkdir(args.dir)
-        igemm_host_driver(args, config_content)
-        igemm_flatten(args, config_content)
+        if (args.rank or args.problems) and args.kernel_set_tolerance is None and not args.emulate:
+            # ranking writes nothing, output dir is left untouched
+            _, config_content = igemm_expand_sweep(args, config_content, write = False)
+            igemm_rank(args, config_content)
+            sys.exit(0)
+        if args.no_cache:
+            shutil.rmtree(args.dir, ignore_errors=True)
+        os.makedirs(args.dir, exist_ok=True)
+        cache = igemm_get_cache(args)
+        config_file, config_content = igemm_expand_sweep(args, config_content)
+        if args.kernel_set_tolerance is not None:
+            igemm_kernel_set(args, config_content)
+            sys.exit(0)
+        if args.emulate:
+            sys.exit(1 if igemm_emulate(args, config_content) else 0)
+        if args.tuning_db:
+            igemm_tuning_db(args, config_content)
+            sys.exit(0)
+        tunable_dicts = igemm_flatten(args, config_content, cache)
+        config_file = igemm_occupancy_config(args, config_file, config_content, tunable_dicts)
+        igemm_host_driver(args, config_file, config_content, cache)
+        if cache:
+            print(cache.summary())
 
     if config_content.get_section('codegen')[0]['mode'] in ('seq', 'sequencer'):
         # config_content.dump()
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+import tempfile
+import contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from igemm import *
+
+BENCHMARK_CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc.config')
+BENCHMARK_SCALES = [1, 4, 16, 64]
+
+def get_benchmark_arch():
+    return amdgpu_arch_config_t({
+        'arch'          :   AMDGPU_ARCH_GFX908,
+        'data_type'     :   AMDGPU_PRECISION_FP32,
+        'code_object'   :   AMDGPU_CODEOBJECT_V3 })
+
+def get_benchmark_tunable_dicts(scale):
+    config_content = config_parser_t(BENCHMARK_CONFIG)()
+    tunable_dicts = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_')]
+    # only fp32 is fully supported by the generator for now
+    tunable_dicts = [td for td in tunable_dicts if td['precision'] == 'fp32']
+    return tunable_dicts * scale
+
+def benchmark_emit(emitter, tunable_dicts):
+    mc = mc_asm_printer_t(emitter, get_benchmark_arch())
+    start = time.perf_counter()
+    igemm_codegen_driver_t(mc, tunable_dicts).do_emit()
+    if type(emitter) is mc_emit_to_string_t:
+        emitter.get_buffer()
+    mc.close()
+    return time.perf_counter() - start
+
+def benchmark_backend_string(tunable_dicts, tmp_dir):
+    return benchmark_emit(mc_emit_to_string_t(), tunable_dicts)
+
+def benchmark_backend_file(tunable_dicts, tmp_dir):
+    return benchmark_emit(mc_emit_to_file_t(os.path.join(tmp_dir, 'benchmark.s')), tunable_dicts)
+
+def benchmark_backend_iostream(tunable_dicts, tmp_dir):
+    with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f):
+        return benchmark_emit(mc_emit_to_iostream_t(), tunable_dicts)
+
+def benchmark_nested_deferred(depth, lines_per_level):
+    '''
+    every level emits some lines then splices the whole inner deferred block,
+    which is what nested macros/functors in the kernel generator do
+    '''
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), get_benchmark_arch())
+    start = time.perf_counter()
+    def level(d):
+        with mc.deferred_context():
+            for i in range(lines_per_level):
+                mc.emit(f'v_add_u32 v[{d}], v[{i}], v[{d}]')
+            if d + 1 < depth:
+                inner = level(d + 1)
+                mc.emit(inner)
+        return mc.get_deferred()
+    mc.emit(level(0))
+    mc.emitter.get_buffer()
+    return time.perf_counter() - start
+
+def run_all_benchmark():
+    backends = [('string', benchmark_backend_string),
+                ('file', benchmark_backend_file),
+                ('iostream', benchmark_backend_iostream)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(f"{'backend':<10}{'kernels':>10}{'time(s)':>12}{'ms/kernel':>12}")
+        for name, func in backends:
+            for scale in BENCHMARK_SCALES:
+                tunable_dicts = get_benchmark_tunable_dicts(scale)
+                t = func(tunable_dicts, tmp_dir)
+                print(f"{name:<10}{len(tunable_dicts):>10}{t:>12.3f}{1000 * t / len(tunable_dicts):>12.3f}")
+    print('')
+    print(f"{'deferred':<10}{'depth':>10}{'time(s)':>12}{'us/level':>12}")
+    for depth in [50, 100, 200, 400]:
+        t = benchmark_nested_deferred(depth, 200)
+        print(f"{'nested':<10}{depth:>10}{t:>12.3f}{1000000 * t / depth:>12.3f}")
+
+if __name__ == '__main__':
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 4000))
+    run_all_benchmark()
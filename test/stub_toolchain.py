@@ -0,0 +1,63 @@
+'''
+stub assembler/linker/disassembler, to test split-and-link build without ROCm.
+
+  stub_toolchain.py as <src.s> -o <obj>       resolve every .include from cwd, write a fake object
+  stub_toolchain.py ld <obj> ... -o <target>   concatenate objects, fail on duplicated kernel
+  stub_toolchain.py objdump <hsaco>            dump target to stdout
+
+e.g. igemm_codegen.py --split -j 8 \
+        --asm-cmd "python3 test/stub_toolchain.py as {src} -o {obj}" \
+        --link-cmd "python3 test/stub_toolchain.py ld {objs} -o {target}" \
+        --disass-cmd "python3 test/stub_toolchain.py objdump {src}" config/igemm_bwd_gtc.config
+'''
+import os
+import re
+import sys
+import hashlib
+
+def stub_as(src, obj):
+    with open(src) as f:
+        text = f.read()
+    for inc in re.findall(r'^\s*\.include\s+"([^"]+)"', text, re.M):
+        if not os.path.exists(inc):
+            print(f'{src}: can not find include file "{inc}" from {os.getcwd()}')
+            return 1
+    kernels = re.findall(r'^\s*\.amdhsa_kernel\s+(\S+)', text, re.M)
+    with open(obj, 'w') as f:
+        f.write(f'; stub object of {os.path.basename(src)}, sha1:{hashlib.sha1(text.encode()).hexdigest()}\n')
+        for k in kernels:
+            f.write(f'kernel {k}\n')
+    return 0
+
+def stub_ld(objs, target):
+    kernels = set()
+    lines = []
+    for obj in objs:
+        with open(obj) as f:
+            for line in f:
+                if line.startswith('kernel '):
+                    if line in kernels:
+                        print(f'duplicated symbol {line.split()[1]} in {obj}')
+                        return 1
+                    kernels.add(line)
+                lines.append(line)
+    with open(target, 'w') as f:
+        f.writelines(lines)
+    return 0
+
+def stub_objdump(target):
+    with open(target) as f:
+        sys.stdout.write(f.read())
+    return 0
+
+if __name__ == '__main__':
+    tool, argv = sys.argv[1], sys.argv[2:]
+    if tool == 'as':
+        sys.exit(stub_as(argv[0], argv[argv.index('-o') + 1]))
+    if tool == 'ld':
+        o = argv.index('-o')
+        sys.exit(stub_ld(argv[:o] + argv[o + 2:], argv[o + 1]))
+    if tool == 'objdump':
+        sys.exit(stub_objdump(argv[0]))
+    print(f'unknown tool {tool}')
+    sys.exit(1)
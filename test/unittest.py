@@ -1,4 +1,10 @@
 from igemm import *
+import os
+import json
+import sys
+import shutil
+import subprocess
+import tempfile
 
 def get_default_mc():
     return mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t(None))
@@ -90,11 +96,723 @@ def unittest_thread_mapping():
     mc.emit(thread_mapping( 'v_gemm_in', 'v_gemm_im', 'v_tid_shifter', 'v_tmp'))
     print(mc.emitter.get_buffer())
 
+def unittest_mc_rope():
+    '''
+    rope buffers of string/deferred emitter must give byte identical text to the former += string buffers,
+    including nested deferred blocks spliced into each other, spliced twice, and concatenated with str
+    '''
+    from igemm.codegen.mc import _mc_indent_t
+    class plus_string_emit_t(mc_emit_to_string_t):
+        def __init__(self):
+            self.indent = _mc_indent_t(4)
+            self.string_buffer = ''
+        def emit(self, s):
+            self.string_buffer += self.indent() + s + '\n'
+        def get_buffer(self):
+            return self.string_buffer
+    class plus_deferred_emit_t(mc_deferred_emit_t):
+        def __init__(self, upper_emitter):
+            self.indent = upper_emitter.indent
+            self.buffer = ''
+            self.is_first_line = True
+        def emit(self, s):
+            if self.is_first_line:
+                self.buffer += s
+                self.is_first_line = False
+            else:
+                self.buffer += '\n' + self.indent() + s
+        def get_buffer(self):
+            return self.buffer
+    class plus_asm_printer_t(mc_asm_printer_t):
+        def deferred_context(self):
+            mc = self
+            class deferred_context_t(object):
+                def __enter__(self):
+                    self.original_emitter = mc.emitter
+                    self.deferred_emitter = plus_deferred_emit_t(self.original_emitter)
+                    mc.emitter = self.deferred_emitter
+                def __exit__(self, type, value, traceback):
+                    mc.emitter = self.original_emitter
+                    mc.deferred_buffer = self.deferred_emitter.get_buffer()
+            return deferred_context_t()
+
+    def emit_nested(mc):
+        def level(d):
+            with mc.deferred_context():
+                mc.emit(f'; level {d}')
+                with mc.indent_context():
+                    mc.emit(f'v_add_u32 v[{d}], 1, v[{d}]\nv_add_u32 v[{d}], 2, v[{d}]')
+                    if d + 1 < 4:
+                        inner = level(d + 1)
+                        mc.emit(inner)
+                        mc.emit(inner)
+                    mc.emit('s_nop 0 ; ' + level(4) if d == 0 else 's_nop 0')
+            return mc.get_deferred()
+        with mc.indent_context():
+            nested = level(0)
+            mc.emit(nested)
+            mc.emit_empty_line()
+            mc.emit_front(nested)
+            with mc.deferred_context():
+                pass
+            mc.emit(mc.get_deferred())
+
+    arch = amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908, 'data_type' : AMDGPU_PRECISION_FP32})
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc_nxe0.config')
+    tunable_dicts = [sec.to_dict() for sec in config_parser_t(config_file)() if sec.get_name().startswith('igemm_')][:2]
+    buffers = []
+    for printer, emitter in [(mc_asm_printer_t, mc_emit_to_string_t), (plus_asm_printer_t, plus_string_emit_t)]:
+        mc = printer(emitter(), arch)
+        emit_nested(mc)
+        for emit_all_macro in (False, True):
+            igemm_codegen_driver_t(mc, tunable_dicts, emit_all_macro = emit_all_macro).do_emit()
+        buffers.append(mc.emitter.get_buffer())
+    assert type(buffers[0]) is str and buffers[0] == buffers[1], 'rope buffer differs from += string buffer'
+    print(f'mc rope: {len(buffers[0])} bytes identical to += buffer')
+
+def unittest_split_compile():
+    '''
+    split-and-link build with stub toolchain, second build should be fully taken from cache
+    '''
+    stub = '{} {}'.format(sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_toolchain.py'))
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc_nxe0.config')
+    config_content = config_parser_t(config_file)()
+    tunable_dicts = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_')]
+    arch = amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908, 'code_object' : AMDGPU_CODEOBJECT_V3})
+    with tempfile.TemporaryDirectory() as out_dir:
+        split_dir = os.path.join(out_dir, 'split')
+        os.mkdir(split_dir)
+        objects = []
+        for i in range(2):
+            cache = build_cache_t(os.path.join(out_dir, 'cache'))
+            mc = mc_asm_printer_t(mc_emit_to_file_t(os.path.join(split_dir, IGEMM_SPLIT_MACRO_INCLUDE)), arch)
+            split = igemm_split_compile_t(os.path.join(out_dir, 'kernel.hsaco'), f'{stub} as {{src}} -o {{obj}}',
+                        f'{stub} ld {{objs}} -o {{target}}', f'{stub} objdump {{src}}')
+            igemm_codegen_driver_t(mc, tunable_dicts, 2, cache, split)()
+            objects.append({f : build_cache_hash_file(os.path.join(split_dir, f)) for f in os.listdir(split_dir) if f.endswith('.o')})
+            print(f'build {i}: {len(tunable_dicts)} kernels, cache {cache.hit} hit, {cache.miss} miss')
+        assert cache.miss == 0 and cache.hit > 0, 'second build is not fully taken from cache'
+        assert len(objects[0]) == len(tunable_dicts) + 1 and objects[0] == objects[1]
+        with open(os.path.join(out_dir, 'kernel.disass.s')) as f:
+            kernels = [line.split()[1] for line in f if line.startswith('kernel ')]
+        assert kernels == [igemm_gtc_encode_kernel_name(igemm_gtc_tunable_parameter_t(td)) for td in tunable_dicts]
+
+def unittest_ir():
+    '''
+    record coalescing store into ir, printing it back should give exactly the same text
+    '''
+    def emit_coalescing_store(mc):
+        ctm = ctrl_thread_mapping_t()
+        ctm.thread_lengths = [2,2,1,1,4,4]
+        ctm.cluster_lengths = [1,1,4,4,4,4]
+        ctrl = ctrl_coalescing_store_t()
+        ctrl.ctm = ctm
+        ctrl.coalescing_groups = 4
+        ctrl.data_byte = 4
+        ctrl.vector_write_out = 1
+        ctrl.block_size = 256
+        ctrl.gemm_m_order = IGEMM_COALESCING_GEMM_M_ORDER_M1_M0
+        ctrl.gemm_m_m0_m1 = [4, 32]
+        ctrl.adjust_optimal_coalescing_groups()
+        coalescing_store = igemm_coalescing_store_t(mc, ctrl)
+        mc.emit(coalescing_store('v_c', 'v_co_sst', 'v_co_sld', 's_p_out', 'v_out_offset', 's_out_offset', 's_gemm_m0_stride', 's_gemm_m1_stride', 's_tmp'))
+
+    mc_ref = get_default_mc()
+    emit_coalescing_store(mc_ref)
+
+    mc = get_default_mc()
+    with mc.record_context():
+        emit_coalescing_store(mc)
+    ir = mc.get_recorded()
+    mc.emit_ir(ir)
+    print(', '.join(f'{k}:{v}' for k, v in ir.count_by_category().items() if v != 0))
+    assert mc.emitter.get_buffer() == mc_ref.emitter.get_buffer(), 'ir round trip changes emitted text'
+    assert ir.count_by_category()[IR_CATEGORY_VMEM] > 0 and ir.count_by_category()[IR_CATEGORY_LDS] > 0
+
+def unittest_schedule():
+    '''
+    lds load issued after fma that don't depend on it, scheduler should hoist it and re-compute lgkmcnt
+    '''
+    scheduler = ir_scheduler_t(amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908}))
+    pending = ir_parse('ds_read_b128 v[v_a:v_a+3], v[v_sld_os]')
+    body = ir_t(ir_parse('\n'.join(['s_waitcnt lgkmcnt(0)'] +
+                [f'v_mac_f32 v[v_c+{i}], v[v_a+{i}], v[v_b]' for i in range(4)] +
+                [f'v_mac_f32 v[v_c+{i+4}], v[v_a+4], v[v_b+{i}]' for i in range(4)] +
+                ['ds_read_b128 v[v_b:v_b+3], v[v_sld_os] offset:256'])))
+    scheduled = scheduler(body, pending)
+    print(scheduled.emit_str())
+    stall = (scheduler.predict_stall(body, pending), scheduler.predict_stall(scheduled, pending))
+    print(f'stall: {stall[0]} -> {stall[1]}')
+    assert stall[1] <= stall[0], f'scheduled stall {stall[1]} worse than original {stall[0]}'
+
+    lines = [l.strip() for l in scheduled.emit_str().split('\n') if l.strip()]
+    fma = [l for l in lines if l.startswith('v_mac_f32')]
+    assert sorted(fma) == sorted(l.strip() for l in body.emit_str().split('\n') if l.strip().startswith('v_mac_f32'))
+    # fma reading the pending ds_read result must stay behind a lgkmcnt(0)
+    wait = lines.index('s_waitcnt lgkmcnt(0)')
+    for i in range(4):
+        assert lines.index(f'v_mac_f32 v[v_c+{i}], v[v_a+{i}], v[v_b]') > wait
+    # ds_read overwriting v_b must stay behind every fma reading v_b
+    ds_read = lines.index('ds_read_b128 v[v_b:v_b+3], v[v_sld_os] offset:256')
+    assert all(lines.index(l) < ds_read for l in fma if 'v[v_b' in l)
+
+    # loop tail like block, salu carry chain keeps its order through scc, exec write is a fence
+    tail = ir_t(ir_parse('\n'.join([f'v_mac_f32 v[v_c+{i}], v[v_a+{i}], v[v_b]' for i in range(4)] +
+                ['s_add_u32 s[s_p], s[s_p], s[s_move]',
+                 's_addc_u32 s[s_p+1], 0, s[s_p+1]',
+                 'buffer_load_dword v[v_g], v[v_os], s[s_p:s_p+3], 0 offen offset:0',
+                 's_or_b64 exec, exec, s[s_tmp:s_tmp+1]',
+                 'v_mac_f32 v[v_c+4], v[v_a+4], v[v_b]'])))
+    scheduled = scheduler(tail, None)
+    print(scheduled.emit_str())
+    lines = [l.strip() for l in scheduled.emit_str().split('\n') if l.strip()]
+    assert lines.index('s_add_u32 s[s_p], s[s_p], s[s_move]') < lines.index('s_addc_u32 s[s_p+1], 0, s[s_p+1]') < \
+            lines.index('buffer_load_dword v[v_g], v[v_os], s[s_p:s_p+3], 0 offen offset:0')
+    # long latency load is issued ahead of fma not feeding it
+    assert lines.index('buffer_load_dword v[v_g], v[v_os], s[s_p:s_p+3], 0 offen offset:0') < \
+            lines.index('v_mac_f32 v[v_c+3], v[v_a+3], v[v_b]')
+    assert lines[-2:] == ['s_or_b64 exec, exec, s[s_tmp:s_tmp+1]', 'v_mac_f32 v[v_c+4], v[v_a+4], v[v_b]']
+
+def unittest_vgpr_alloc():
+    '''
+    v_t is dead before the loop and can share with v_x, v_y/v_z are live through the whole loop
+    '''
+    ir = ir_t(ir_parse('\n'.join(['v_mov_b32 v[v_t], v0',
+                'v_add_u32 v[v_x], 1, v[v_t]',
+                'L_loop:',
+                'v_add_u32 v[v_z], 1, v[v_y]',
+                'v_add_u32 v[v_y], 1, v[v_z]',
+                's_cbranch_scc0 L_loop',
+                'v_mov_b32 v[v_w], v[v_x]',
+                'global_store_dwordx2 v[v_p:v_p+1], v[v_y:v_y+1], off'])))
+    ranges, extents = gpr_get_live_ranges(ir, ['v_t', 'v_x', 'v_y', 'v_z', 'v_w', 'v_p'])
+    sizes = [('v_t', 1), ('v_x', 1), ('v_y', 2), ('v_z', 1), ('v_w', 1), ('v_p', 2)]
+    alloc = gpr_alloc_t()
+    alloc.add_fixed(0, 1, (0, ranges[0][1]))
+    for name, size in sizes:
+        alloc.add(name, size, size, tuple(ranges[name]))
+    allocated = alloc()
+    print(', '.join(f'{k}:{v}' for k, v in ranges.items()))
+    print(', '.join(f'{k}:{v}' for k, v in allocated.items()) + f', count:{alloc.count}')
+    # v_y/v_z cross the loop so cover all of it, store sources end at the store as they are read at issue
+    assert ranges == {0 : [0, 0], 'v_t' : [0, 1], 'v_x' : [1, 6], 'v_z' : [2, 5], 'v_y' : [2, 7],
+                      'v_w' : [6, 6], 'v_p' : [7, 7]}, f'{ranges}'
+
+    # no two registers alive at the same stmt may overlap, v0 is pinned
+    placed = [(0, 1, ranges[0])] + [(allocated[name], size, ranges[name]) for name, size in sizes]
+    for i, (o0, s0, r0) in enumerate(placed):
+        assert o0 % s0 == 0
+        for o1, s1, r1 in placed[i + 1:]:
+            if r0[0] <= r1[1] and r1[0] <= r0[1]:
+                assert o0 + s0 <= o1 or o1 + s1 <= o0, f'{placed}'
+
+    # declaration order, like sym_t of the kernel, after v0
+    linear = 1
+    for _, size in sizes:
+        linear = (linear + size - 1) // size * size + size
+    assert alloc.count == max(o + s for o, s, _ in placed) and alloc.count <= linear, f'{alloc.count}, {linear}'
+
+def unittest_waitcnt():
+    '''
+    hand written waits are dropped. v_b aliases v_a+4, and lds load of the loop is still in flight at loop head
+    '''
+    ir = ir_t(ir_parse('\n'.join(['buffer_load_dword v[v_a], v[v_os], s[s_p:s_p+3], 0 offen offset:0',
+                'buffer_load_dword v[v_a+4], v[v_os], s[s_p:s_p+3], 0 offen offset:4',
+                's_waitcnt vmcnt(0)',
+                'v_mov_b32 v[v_c], v[v_a]',
+                'L_loop:',
+                'v_add_f32 v[v_c], v[v_c], v[v_d]',
+                'ds_read_b32 v[v_d], v[v_os]',
+                's_cbranch_scc0 L_loop',
+                'v_mov_b32 v[v_c+1], v[v_b]'])))
+    symbols = {'v_a' : ('v', 0, 8), 'v_b' : ('v', 4, 1), 'v_c' : ('v', 8, 2), 'v_d' : ('v', 10, 1), 'v_os' : ('v', 11, 1), 's_p' : ('s', 0, 4)}
+    waited = ir_waitcnt_t(amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908}), symbols = symbols)(ir).emit_str()
+    print(waited)
+    lines = [l.strip() for l in waited.split('\n') if l.strip()]
+    waits = [(i, l) for i, l in enumerate(lines) if l.startswith('s_waitcnt')]
+    # v_a only needs the first load, v_b (v_a+4) needs both, ds_read of previous iteration is waited at loop head
+    assert waits == [(lines.index('v_mov_b32 v[v_c], v[v_a]') - 1, 's_waitcnt vmcnt(1)'),
+                     (lines.index('v_add_f32 v[v_c], v[v_c], v[v_d]') - 1, 's_waitcnt lgkmcnt(0)'),
+                     (lines.index('v_mov_b32 v[v_c+1], v[v_b]') - 1, 's_waitcnt vmcnt(0)')], f'{waits}'
+    assert lines.index('L_loop:') < waits[1][0]
+
+def unittest_perf_advisor():
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc_nxe0.config')
+    config_content = config_parser_t(config_file)()
+    tunable_dicts = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_')]
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908}))
+    kernel_list = [igemm_bwd_gtc_t(mc, igemm_gtc_tunable_parameter_t(td)) for td in tunable_dicts]
+    arch_detail = amdgpu_get_gfx908_120cu()
+    advisor = perf_advisor_t(arch_detail, occupancy_floor = 2)
+    accepted = advisor(kernel_list)
+    print(f'{len(accepted)}/{len(kernel_list)} kernels accepted')
+    for kernel in kernel_list:
+        o = advisor.advise_occupancy(kernel)
+        assert o.blocks_per_cu == amdgpu_calculate_occupancy(arch_detail, o.vgpr, o.block_size, o.lds, o.sgpr)
+        if o.to_free is None:
+            continue
+        # freeing what is advised gives the next occupancy level
+        vgpr, sgpr, lds = [getattr(o, r) - o.to_free.get(r, 0) for r in (AMDGPU_OCCUPANCY_LIMIT_VGPR, AMDGPU_OCCUPANCY_LIMIT_SGPR, AMDGPU_OCCUPANCY_LIMIT_LDS)]
+        assert amdgpu_calculate_occupancy(arch_detail, vgpr, o.block_size, lds, sgpr) > o.blocks_per_cu, f'{o.name}, free {o.to_free}'
+
+def unittest_cost_model():
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config')
+    tunable_dicts = [sec.to_dict() for config_file in ('igemm_bwd_gtc.config', 'igemm_bwd_gtc_nxe0.config')
+                for sec in config_parser_t(os.path.join(config_dir, config_file))() if sec.get_name().startswith('igemm_')]
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908, 'data_type' : AMDGPU_PRECISION_FP32}))
+    kernel_list = [igemm_bwd_gtc_t(mc, igemm_gtc_tunable_parameter_t(td)) for td in tunable_dicts]
+    # occupancy is from the vgpr count kernels are generated with, not the linear layout
+    linear = [kernel.vgpr.get_count() for kernel in kernel_list]
+    for kernel in kernel_list:
+        if kernel.tunable.precision == 'fp32':
+            kernel.prepare_kernel_body()
+    allocated = [kernel.get_kernel_code().workitem_vgpr_count for kernel in kernel_list]
+    assert all(a <= l for a, l in zip(allocated, linear)) and any(a < l for a, l in zip(allocated, linear))
+    # stride 2 with 3x3 filter is 4 gemms, gemm_k of them are k*2*2, k*2*1, k*1*2, k*1*1
+    conv_param = cost_model_parse_problem('n=128,c=128,hi=35,wi=35,k=128,y=3,x=3,sy=2,sx=2')
+    assert [s[2] for s in cost_model_gemm_shapes(conv_param)] == [512, 256, 256, 128]
+    rank_list = cost_model_t(amdgpu_get_gfx908_120cu())([conv_param], kernel_list, 3)
+    assert len(rank_list[0]) == 3 and all(e.padding_waste == 0 for e in rank_list[0])
+
+def unittest_tuning_db():
+    with tempfile.TemporaryDirectory() as db_dir:
+        db_file = os.path.join(db_dir, 'tuning.db')
+        tuning_db = tuning_db_t(db_file)
+        tuning_db.add('gfx908', cost_model_parse_problem('n=128,c=1024,hi=17,wi=17,k=1024,x=7,px=3'), [('kernel_a', 2.0), ('kernel_b', 1.0)])
+        tuning_db.add('gfx908', cost_model_parse_problem('n=64,c=256,hi=28,wi=28,k=128'), [('kernel_c', 0.5)])
+        tuning_db.save()
+        tuning_db = tuning_db_t(db_file)
+        results, exact = tuning_db.find('gfx908', cost_model_parse_problem('n=128,c=1024,hi=17,wi=17,k=1024,x=7,px=3'))
+        assert exact and [r[0] for r in results] == ['kernel_b', 'kernel_a']
+        # 1x1 never falls back to a 1x7 shape
+        results, exact = tuning_db.find('gfx908', cost_model_parse_problem('n=128,c=1024,hi=17,wi=17,k=1024'))
+        assert not exact and results[0][0] == 'kernel_c'
+        assert tuning_db.find('gfx906', cost_model_parse_problem('n=64,c=256,hi=28,wi=28,k=128')) == (None, False)
+        print(f'tuning db: {len(tuning_db)} shapes, {os.path.getsize(db_file)} bytes')
+
+    # precision of a result is the one in its kernel name
+    log = ['[bwd] n:64, c:256, h:28, w:28, k:128, y:1, x:1, sy:1, sx:1, dy:1, dx:1, py:0, px:0, ho:28, wo:28, g:1',
+           '  igemm_bwd_gtc_fp32_bx1_ex0_bt128x128x16, cost:0.500ms, tflops:1.000(1.00%), valid:y',
+           '  igemm_bwd_gtc_fp16_bx1_ex0_bt128x128x16, cost:0.300ms, tflops:1.000(1.00%), valid:y',
+           '  igemm_bwd_gtc_fp32_bx1_ex0_bt64x64x16, cost:0.400ms, tflops:1.000(1.00%), valid:n']
+    tuning_db = tuning_db_t()
+    assert tuning_db_import_driver_log(tuning_db, 'gfx908', log) == 2
+    for precision in ('fp32', 'fp16'):
+        problem = cost_model_parse_problem(f'n=64,c=256,hi=28,wi=28,k=128,precision={precision}')
+        results, exact = tuning_db.find('gfx908', problem)
+        assert exact and [r[0] for r in results] == [f'igemm_bwd_gtc_{precision}_bx1_ex0_bt128x128x16']
+
+def unittest_kernel_set():
+    # kernel_a and kernel_b are each best somewhere, kernel_c is within 5% everywhere
+    times = {'p0' : {'kernel_a' : 1.0, 'kernel_b' : 2.0, 'kernel_c' : 1.04},
+             'p1' : {'kernel_a' : 2.0, 'kernel_b' : 1.0, 'kernel_c' : 1.03},
+             'p2' : {'kernel_b' : 3.0}}
+    kernel_set = kernel_set_t(times, 0.05)
+    chosen = kernel_set.solve()
+    assert chosen == ['kernel_b', 'kernel_c'] and kernel_set.optimal
+    print(kernel_set.report(chosen))
+
+def unittest_conv_workload():
+    lines = ['./out/conv_driver.exe conv -n 128 -c 128 -H 17 -W 17 -k 128 -y 7 -x 1 -p 3 -q 0 -u 1 -v 1 -l 1 -j 1 -F 2',
+             '[2020-06-01 10:00:00] MIOpenDriver conv -n 128 -c 128 -H 17 -W 17 -k 128 -y 7 -x 1 -p 3 -q 0 -F 2',
+             'MIOpenDriver convfp16 --batchsize 64 -c 64 -H 56 -W 56 -k 64 -y 3 -x 3 -g 2 -F 3',
+             'MIOpenDriver conv -_ 3 -n 1 -F 2',
+             './out/conv_driver.exe has no command']
+    workload = conv_workload_t().add_lines(lines)
+    problems = [(cost_model_problem_string(p), count) for p, count in workload]
+    assert len(problems) == 3 and problems[0][1] == 2 and 'x=1,py=3' in problems[0][0]
+    assert {p.direction for p in workload.get_conv_params()} == {CONV_DIRECTION_FWD, CONV_DIRECTION_BWD}
+    assert all(p.g == 2 and p.n == 64 for p in workload.get_conv_params() if p.precision == 'fp16')
+    print(f'workload: {len(workload)} unique problems from {workload.num_lines} lines')
+
+def unittest_conv_ref():
+    if np is None:
+        print('conv reference: no numpy, skipped')
+        return
+    # <fwd(x, w), dy> == <x, bwd_data(dy, w)> == <w, bwd_weight(x, dy)>
+    p = conv_param_t(2, 2, 4, 9, 8, 6, 3, 2, 1, 2, 2, 1, 2, 1, -1, -1, CONV_DIRECTION_FWD, 'fp32')
+    x, w = conv_ref_tensors(p, 1).values()
+    dy = np.random.default_rng(2).random((p.n, p.k, p.ho, p.wo), dtype = np.float32)
+    a = np.vdot(conv_ref_fwd(x, w, p).astype(np.float64), dy)
+    b = np.vdot(x.astype(np.float64), conv_ref_bwd_data(dy, w, p))
+    c = np.vdot(w.astype(np.float64), conv_ref_bwd_weight(x, dy, p))
+    assert abs(a - b) < 1e-4 * abs(a) and abs(a - c) < 1e-4 * abs(a), f'{a}, {b}, {c}'
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = conv_ref_cache_t(cache_dir)
+        _, ref = cache.get(p, 1)
+        _, ref_again = cache.get(p, 1)
+        assert conv_ref_nrms(ref, ref_again) == 0 and type(ref_again) is np.memmap
+        print(cache.summary())
+
+def unittest_naive_conv_bwd_gemm():
+    '''
+    host reference of bwd data in driver/naive_conv.h, as gemm of every dtile, against conv_ref_bwd_data()
+    '''
+    if np is None or shutil.which('g++') is None:
+        print('naive conv bwd gemm: no numpy or g++, skipped')
+        return
+    driver_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'driver')
+    source = '\n'.join(['#include <cstdio>',
+                '#include <cstdlib>',
+                '#include "naive_conv.h"',
+                'int main(int argc, char **argv) {',
+                '    size_t a[13];',
+                '    for (int i = 0; i < 13; i++)',
+                '        a[i] = strtoul(argv[i + 4], nullptr, 10);',
+                '    size_t n = a[0], w = a[1], h = a[2], c = a[3], k = a[4], fx = a[5], fy = a[6];',
+                '    size_t ow = naive_conv_out_size(w, a[7], a[11], fx, a[9]), oh = naive_conv_out_size(h, a[8], a[12], fy, a[10]);',
+                '    std::vector<float> out(n * k * oh * ow), wei(k * c * fy * fx), inp(n * c * h * w, -1.0f);',
+                '    FILE *f = fopen(argv[1], "rb"); fread(out.data(), 4, out.size(), f); fclose(f);',
+                '    f = fopen(argv[2], "rb"); fread(wei.data(), 4, wei.size(), f); fclose(f);',
+                '    naive_conv_bwd_d_nchw_gemm(inp.data(), wei.data(), out.data(), n, w, h, c, k, fx, fy, a[7], a[8], a[9], a[10], a[11], a[12]);',
+                '    f = fopen(argv[3], "wb"); fwrite(inp.data(), 4, inp.size(), f); fclose(f);',
+                '    return 0;',
+                '}', ''])
+    # (n, c, hi, wi, k, y, x, py, px, sy, sx, dy, dx). 1x1 of stride 2 has dtile of gemm_k 0, gcd(s, d) > 1 leaves
+    # input not reached by any dtile
+    shapes = [(2, 20, 7, 9, 3, 3, 3, 1, 1, 2, 2, 1, 1),
+              (2, 17, 6, 5, 4, 1, 1, 0, 0, 2, 2, 1, 1),
+              (1, 5, 11, 10, 6, 3, 2, 2, 1, 2, 2, 2, 2),
+              (3, 4, 13, 12, 5, 2, 3, 1, 0, 3, 2, 2, 3),
+              (1, 3, 8, 8, 2, 5, 5, 2, 2, 1, 1, 1, 1)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src, exe = os.path.join(tmp_dir, 'bwd_gemm.cpp'), os.path.join(tmp_dir, 'bwd_gemm')
+        with open(src, 'w') as f:
+            f.write(source)
+        subprocess.run(['g++', '-std=c++14', '-O1', '-pthread', '-I', driver_dir, src, '-o', exe], check = True)
+        for n, c, hi, wi, k, y, x, py, px, sy, sx, dy, dx in shapes:
+            p = conv_param_t(n, 1, c, hi, wi, k, y, x, py, px, sy, sx, dy, dx, -1, -1, CONV_DIRECTION_BWD, 'fp32')
+            tensors = conv_ref_tensors(p, 3)
+            files = [os.path.join(tmp_dir, f'{name}.bin') for name in ('out', 'wei', 'inp')]
+            tensors['out'].tofile(files[0])
+            tensors['wei'].tofile(files[1])
+            subprocess.run([exe] + files + [str(v) for v in (n, wi, hi, c, k, x, y, px, py, sx, sy, dx, dy)], check = True)
+            inp = np.fromfile(files[2], dtype = np.float32).reshape(n, c, hi, wi)
+            nrms = conv_ref_nrms(conv_ref(p, tensors), inp)
+            print(f'naive conv bwd gemm: {p.n}x{p.c}x{p.hi}x{p.wi}, k:{p.k}, {p.y}x{p.x}, s:{p.sy}x{p.sx}, d:{p.dy}x{p.dx}, nrms:{nrms:.3e}')
+            assert nrms < 1e-6, f'bwd gemm reference differs, nrms {nrms}'
+
+def unittest_shared_store_issues():
+    mc = get_default_mc()
+    for length_d0, length_d1, vector_d1, stride_d1 in [(1, 4, 4, 1), (4, 1, 1, 1), (2, 4, 1, 256), (4, 2, 1, 64 * 1024)]:
+        ctrl = ctrl_2d_shared_store_t()
+        ctrl.length_d0, ctrl.length_d1, ctrl.vector_d1 = length_d0, length_d1, vector_d1
+        ctrl.stride_d0, ctrl.stride_d1 = 512, stride_d1
+        sst = macro_igemm_2d_shared_store_t(mc, ctrl)
+        with mc.deferred_context():
+            sst.emit()
+        assert sst.get_issues() == sst.issue_cnt, f'{sst.name()}: {sst.get_issues()} vs emitted {sst.issue_cnt}'
+        print(f'{sst.name()}: {sst.get_issues()} issues')
+    # not supported by emit(), must be rejected before the memoized lookup
+    for precision, length_d1, stride_d1 in [('fp16', 4, 256), ('fp32', 4, 1)]:
+        ctrl = ctrl_2d_shared_store_t()
+        ctrl.length_d0, ctrl.length_d1, ctrl.vector_d1 = 2, length_d1, 1
+        ctrl.stride_d0, ctrl.stride_d1, ctrl.precision = 512, stride_d1, precision
+        try:
+            macro_igemm_2d_shared_store_t(mc, ctrl).get_issues()
+        except AssertionError:
+            continue
+        assert False, f'{precision}, stride_d1:{stride_d1} should be rejected'
+
+def unittest_macro_cache():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        mc = get_default_mc()
+        mc.macro_cache = macro_cache_t(build_cache_t(cache_dir))
+        macro_cache_t.memo.clear()
+        text = mc.render_macro(macro_c_clear_t(mc))
+        assert mc.render_macro(macro_c_clear_t(mc)) == text
+        macro_cache_t.memo.clear()
+        assert mc.render_macro(macro_c_clear_t(mc)) == text    # from disk
+        print(mc.macro_cache.summary())
+
+    class node_t(object):
+        def __init__(self, value):
+            self.value = value
+            self.next = None
+    a, b = node_t(1), node_t(1)
+    a.next, b.next = a, b
+    assert macro_cache_signature(a) == macro_cache_signature(b)
+    shared = node_t(2)
+    assert macro_cache_signature([shared, shared]) == macro_cache_signature([node_t(2), node_t(2)])
+    try:
+        macro_cache_signature({'v' : {1, 2}})
+    except AssertionError:
+        return
+    assert False, 'set has no stable signature, should be rejected'
+
+def unittest_kernel_cache():
+    '''
+    kernel cache is keyed per kernel: changing one tunable misses only that kernel,
+    while a different generator or arch config misses all of them
+    '''
+    import igemm.codegen.build_cache as build_cache
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc_nxe0.config')
+    tunable_dicts = [sec.to_dict() for sec in config_parser_t(config_file)() if sec.get_name().startswith('igemm_')]
+    changed_dicts = [dict(td) for td in tunable_dicts]
+    changed_dicts[1]['gemm_n_unmerge_cluster'] = 1 - changed_dicts[1].get('gemm_n_unmerge_cluster', 0)
+    arch = {'arch' : AMDGPU_ARCH_GFX908, 'data_type' : AMDGPU_PRECISION_FP32}
+    generator_hash = build_cache_generator_hash()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        def build(tds, arch_dict):
+            cache = build_cache_t(cache_dir)
+            mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t(arch_dict))
+            igemm_codegen_driver_t(mc, tds, 1, cache).do_emit()
+            return cache.hit, cache.miss
+        n = len(tunable_dicts)
+        try:
+            assert build(tunable_dicts, arch) == (0, n)
+            assert build(tunable_dicts, arch) == (n, 0)
+            assert build(changed_dicts, arch) == (n - 1, 1), 'only the changed kernel should miss'
+            assert build(tunable_dicts, dict(arch, schedule = True)) == (0, n), 'arch config change should miss all'
+            build_cache._build_cache_generator_hash = generator_hash + '_changed'
+            assert build(tunable_dicts, arch) == (0, n), 'generator change should miss all'
+        finally:
+            build_cache._build_cache_generator_hash = generator_hash
+        assert build(tunable_dicts, arch) == (n, 0)
+    print(f'kernel cache: {n} kernels, invalidated per tunable, by arch config and by generator hash')
+
+def unittest_macro_reference():
+    '''
+    only macros invoked by kernel body, or by another emitted macro, are emitted, and each one before its first use
+    '''
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config')
+    tunable_dicts = [[sec.to_dict() for sec in config_parser_t(os.path.join(config_dir, config_file))()
+                if sec.get_name().startswith('igemm_') and sec['precision'] == 'fp32'][0]
+                for config_file in ('igemm_bwd_gtc_nxe0.config', 'igemm_bwd_gtc.config')]
+    for emit_all_macro in (True, False):
+        mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908, 'data_type' : AMDGPU_PRECISION_FP32}))
+        igemm_codegen_driver_t(mc, tunable_dicts, emit_all_macro = emit_all_macro).do_emit()
+        macros = dict()         # name -> body, in emitted order
+        kernel_lines = []
+        name = None
+        for line in mc.emitter.get_buffer().split('\n'):
+            token = line.split()[0] if line.split() else ''
+            if token == '.macro':
+                name = line.split()[1].rstrip(',')
+                macros[name] = []
+            elif token == '.endm':
+                name = None
+            elif name:
+                macros[name].append(line)
+            else:
+                kernel_lines.append(line)
+        if emit_all_macro:
+            all_macros = list(macros)
+            continue
+        # walk invocations from kernel body, any macro not reached must not be emitted
+        kernel_ref = mc_macro_reference_t('\n'.join(kernel_lines))
+        used = set()
+        pending = [m for m in macros if m in kernel_ref]
+        while pending:
+            m = pending.pop()
+            if m not in used:
+                used.add(m)
+                pending.extend(d for d in macros if d not in used and d in mc_macro_reference_t('\n'.join(macros[m])))
+        assert set(macros) == used, f'emitted but not referenced: {set(macros) - used}'
+        order = list(macros)
+        for m in macros:
+            ref = mc_macro_reference_t('\n'.join(macros[m]))
+            for d in macros:
+                if d != m and d in ref:
+                    assert order.index(d) < order.index(m), f'{d} is used by {m} but emitted after it'
+    fma = [m for m in all_macros if m.startswith('.v_fma_')]
+    assert len(fma) > 1 and [m for m in macros if m.startswith('.v_fma_')] == ['.v_fma_4x4_s8'], f'{list(macros)}'
+    # .v_u32_div/.v_u32_div_rem are used by none of the two kernels
+    dropped = set(all_macros) - set(macros)
+    assert {'.v_u32_div', '.v_u32_div_rem'} <= dropped and set(macros) < set(all_macros)
+    print(f'macro reference: {len(macros)} of {len(all_macros)} macros emitted')
+
+def unittest_tunable_sweep():
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc.config')
+    tunable_dicts = [sec.to_dict() for sec in config_parser_t(config_file)() if sec.get_name().startswith('igemm_')]
+    for td in tunable_dicts:
+        assert len(list(igemm_gtc_tunable_sweep_t(td))) == 1, f'hand written tunable is pruned, {td}'
+    sweep_dict = dict(tunable_dicts[1])
+    sweep_dict.update({'gemm_m_per_block' : [64, 128, 256], 'gemm_k_per_block' : range(4, 33, 4), 'nxe' : [0, 1],
+                'tensor_a_thread_lengths' : 'auto', 'tensor_a_cluster_lengths' : 'auto',
+                'tensor_b_thread_lengths' : 'auto', 'tensor_b_cluster_lengths' : 'auto'})
+    sweep = igemm_gtc_tunable_sweep_t(sweep_dict)
+    tunables = list(sweep.get_tunables())
+    print(f'sweep: {len(tunables)} valid tunables')
+
+def unittest_tunable_sweep_emit():
+    '''
+    every point of a small sweep must emit. with bt64x128x4, some 'auto' lengths pass the tunable level checks
+    but give m index the coalescing store can't stride evenly, the sweep must drop them
+    '''
+    sweep_dict = {'direction' : 'bwd', 'precision' : 'fp32', 'nxb' : 4, 'nxe' : [0, 1],
+                'gemm_m_per_block' : [64, 128], 'gemm_n_per_block' : 128, 'gemm_k_per_block' : [4, 8],
+                'gemm_m_per_thread' : 4, 'gemm_m_level0_cluster' : 2, 'gemm_m_level1_cluster' : 4,
+                'gemm_n_per_thread' : 4, 'gemm_n_level0_cluster' : 4, 'gemm_n_level1_cluster' : 4,
+                'tensor_a_thread_lengths' : 'auto', 'tensor_a_cluster_lengths' : 'auto',
+                'tensor_b_thread_lengths' : 'auto', 'tensor_b_cluster_lengths' : 'auto', 'gemm_m_unmerge_cluster' : [0, 1]}
+    unstridable = dict(sweep_dict, nxe = 0, gemm_m_per_block = 64, gemm_k_per_block = 4, gemm_m_unmerge_cluster = 0,
+                tensor_a_thread_lengths = [1, 1, 2, 1], tensor_a_cluster_lengths = [1, 4, 1, 32],
+                tensor_b_thread_lengths = [1, 1, 4, 1], tensor_b_cluster_lengths = [1, 4, 1, 32])
+    assert not igemm_gtc_is_valid_tunable_dict(unstridable)
+    tunable_dicts = list(igemm_gtc_tunable_sweep_t(sweep_dict))
+    assert len(tunable_dicts) > 0
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908, 'data_type' : AMDGPU_PRECISION_FP32}))
+    igemm_codegen_driver_t(mc, tunable_dicts).do_emit()
+    print(f'sweep: {len(tunable_dicts)} tunables emitted')
+
+def unittest_sweep_filter():
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config')
+    tunable_dicts = [sec.to_dict() for config_file in ('igemm_bwd_gtc.config', 'igemm_bwd_gtc_nxe0.config')
+                for sec in config_parser_t(os.path.join(config_dir, config_file))() if sec.get_name().startswith('igemm_')]
+    # coalescing store can't stride m index of this one evenly, see unittest_tunable_sweep_emit()
+    unstridable = {'direction' : 'bwd', 'precision' : 'fp32', 'nxb' : 4, 'nxe' : 0,
+                'gemm_m_per_block' : 64, 'gemm_n_per_block' : 128, 'gemm_k_per_block' : 4,
+                'gemm_m_per_thread' : 4, 'gemm_m_level0_cluster' : 2, 'gemm_m_level1_cluster' : 4,
+                'gemm_n_per_thread' : 4, 'gemm_n_level0_cluster' : 4, 'gemm_n_level1_cluster' : 4,
+                'tensor_a_thread_lengths' : [1, 1, 2, 1], 'tensor_a_cluster_lengths' : [1, 4, 1, 32],
+                'tensor_b_thread_lengths' : [1, 1, 4, 1], 'tensor_b_cluster_lengths' : [1, 4, 1, 32]}
+    candidates = igemm_gtc_candidates_from_dicts(tunable_dicts + [unstridable])
+    candidates[0]['gemm_k_per_block'] = 8        # no longer covered by thread/cluster lengths
+    valid, resources = igemm_gtc_validate_candidates(candidates)
+    assert not valid[0] and all(valid[1:-1]) and not valid[-1]
+    mc = get_default_mc()
+    for td, r in zip(tunable_dicts[1:], resources[1:-1]):
+        tunable = igemm_gtc_tunable_parameter_t(td)
+        assert (r['block_size'], r['lds_total'], r['num_vgpr_accumulate_c']) == (tunable.block_size, tunable.lds_total, tunable.num_vgpr_accumulate_c)
+        # linear vgpr count of the kernel, before live range allocation
+        assert r['vgpr'] == igemm_bwd_gtc_t(mc, tunable).vgpr.get_count(), f"{td['name']}: {r['vgpr']}"
+    print(f'sweep filter: {valid.sum()}/{len(valid)} valid, vgpr {resources["vgpr"].tolist()}')
+
+def unittest_emulator():
+    if np is None:
+        print('emulator: no numpy, skipped')
+        return
+    config_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config')
+    tunable_dicts = list()
+    # one nxe1 kernel with b thread lengths 1x1x8x1 over 1x16x1x16, one nxe0 kernel with unmerged n/c cluster
+    selects = [('igemm_bwd_gtc.config', lambda t: t.tensor_b_thread_lengths == [1, 1, 8, 1] and t.tensor_b_cluster_lengths == [1, 16, 1, 16]),
+               ('igemm_bwd_gtc_nxe0.config', lambda t: t.gemm_m_unmerge_cluster == 1 and t.gemm_n_unmerge_cluster == 1)]
+    for config_file, select in selects:
+        for sec in config_parser_t(os.path.join(config_dir, config_file))():
+            if sec.get_name().startswith('igemm_') and sec['precision'] == 'fp32' and select(igemm_gtc_tunable_parameter_t(sec.to_dict())):
+                tunable_dicts.append(sec.to_dict())
+    assert len(tunable_dicts) == 2, f'expect one kernel selected from each config, got {len(tunable_dicts)}'
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908, 'data_type' : AMDGPU_PRECISION_FP32}))
+    igemm_codegen_driver_t(mc, tunable_dicts).do_emit()
+    emulate = kernel_emulate_t(mc.emitter.get_buffer())
+    # stride 2 has dtile of a single filter tap, 1x1 is for nxe0 kernel with unmerged n/c
+    conv_params = [cost_model_parse_problem('n=128,c=128,hi=6,wi=6,k=16,y=3,x=3,py=1,px=1,sy=2,sx=2'),
+                   cost_model_parse_problem('n=128,c=128,hi=3,wi=3,k=32,y=1,x=1')]
+    num_failed = emulate(conv_params, [igemm_gtc_tunable_parameter_t(td) for td in tunable_dicts])
+    assert num_failed == 0, f'{num_failed} kernel(s) not valid on emulator'
+    # waves run in lockstep, the missing barrier must be found from lds access of other waves, not by result
+    no_barrier = '\n'.join(l for l in mc.emitter.get_buffer().split('\n') if l.strip() != 's_barrier')
+    num_failed = kernel_emulate_t(no_barrier)(conv_params[1:], [igemm_gtc_tunable_parameter_t(td) for td in tunable_dicts])
+    assert num_failed == len(tunable_dicts), 'kernel without s_barrier passes on emulator'
+
+def unittest_lds_bank():
+    if np is None:
+        print('lds bank: no numpy, skipped')
+        return
+    lane = np.arange(64, dtype = np.uint32)[None, :]
+    active = np.ones((1, 64), dtype = bool)
+    # (byte address of lane, dwords per lane, expected cycles), 2 phases of 32 lanes for b32, 8 phases of 8 lanes for b128
+    for addr, dw, expected in [(lane * 4, 1, 2), (lane * 8, 1, 4), (lane * 0, 1, 2), (lane * 128, 1, 64),
+                               (lane * 16, 4, 8), (lane * 32, 4, 16), (lane * 8, 2, 4)]:
+        cycles, ideal = lds_bank_cycles(addr, active, dw)
+        assert cycles[0] == expected, f'{addr[0, :4]}, dw:{dw}, {cycles[0]} cycles, expect {expected}'
+    cycles, ideal = lds_bank_cycles(lane * 128, lane < 8, 1)
+    assert (cycles[0], ideal[0]) == (8, 1)
+
+def unittest_gmem_coalescing():
+    if np is None:
+        print('gmem coalescing: no numpy, skipped')
+        return
+    lane = np.arange(64, dtype = np.int64)[None, :]
+    active = np.ones((1, 64), dtype = bool)
+    # (byte address of lane, dwords per lane, expected 64 byte segments, expected bytes)
+    for addr, dw, expected in [(lane * 4, 1, (4, 256)), (lane * 8, 1, (8, 256)), (lane * 0, 1, (1, 4)),
+                               (lane * 16, 4, (16, 1024)), (lane * 4 + 60, 1, (5, 256)), (lane * 256, 1, (64, 256))]:
+        segments, nbytes = gmem_coalescing_segments(addr, active, dw)
+        assert (segments[0], nbytes[0]) == expected, f'{addr[0, :4]}, dw:{dw}, {segments[0]} segments, {nbytes[0]} bytes, expect {expected}'
+    segments, nbytes = gmem_coalescing_segments(lane * 4, lane < 16, 1)
+    assert (segments[0], nbytes[0]) == (1, 64)
+
+def unittest_kernel_manifest():
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc_nxe0.config')
+    config_content = config_parser_t(config_file)()
+    tunable_dict = [sec.to_dict() for sec in config_content if sec.get_name().startswith('igemm_')][0]
+    mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908}))
+    kernel = igemm_bwd_gtc_t(mc, igemm_gtc_tunable_parameter_t(tunable_dict))
+    entry = kernel_manifest_get_entry(kernel)
+    t = kernel.tunable
+    # .rept of unroll k and every macro is walked into, one iteration has all fma of gemm_k_per_block
+    assert entry['main_loop']['fma_per_iteration'] == t.thread_tile_m * t.thread_tile_n * t.gemm_k_per_block
+    assert all(entry['insts'][phase][IR_CATEGORY_MACRO] == 0 for phase in KERNEL_MANIFEST_PHASES)
+    assert entry['insts'][KERNEL_MANIFEST_MAIN_LOOP][IR_CATEGORY_BARRIER] == 1
+    print(json.dumps(entry['main_loop']))
+
+def unittest_profiler():
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc_nxe0.config')
+    tunable_dicts = [sec.to_dict() for sec in config_parser_t(config_file)() if sec.get_name().startswith('igemm_')][:2]
+    buffers = []
+    for profiler in (None, mc_profiler_t(trace = True)):
+        mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908}))
+        if profiler:
+            mc.set_profiler(profiler)
+        igemm_codegen_driver_t(mc, tunable_dicts).do_emit()
+        buffers.append(mc.emitter.get_buffer())
+    assert buffers[0] == buffers[1], 'profiler changes emitted text'
+    assert len(profiler.kernels) == 2 and profiler.stats['igemm_bwd_gtc_t.emit_kernel_prologue'][3] > 0
+    # recorded body is counted when recorded, not when emitted again
+    assert profiler.stats['mc_asm_printer_t.emit_ir'][3] == 0
+    print(profiler.report(5))
+
+def unittest_parallel_emit():
+    '''
+    kernels rendered by worker process or by the driver itself, with or without cache, must give the same text
+    '''
+    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'igemm_bwd_gtc_nxe0.config')
+    tunable_dicts = [sec.to_dict() for sec in config_parser_t(config_file)() if sec.get_name().startswith('igemm_')][:4]
+    for emit_all_macro in (False, True):
+        buffers = dict()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for jobs, cached in [(1, False), (4, False), (1, True), (4, True)]:
+                mc = mc_asm_printer_t(mc_emit_to_string_t(), amdgpu_arch_config_t({'arch' : AMDGPU_ARCH_GFX908}))
+                cache = build_cache_t(os.path.join(cache_dir, f'{jobs}')) if cached else None
+                igemm_codegen_driver_t(mc, tunable_dicts, jobs, cache, emit_all_macro = emit_all_macro).do_emit()
+                buffers[(jobs, cached)] = mc.emitter.get_buffer()
+        for key, buffer in buffers.items():
+            assert buffer == buffers[(1, False)], f'emit_all_macro:{emit_all_macro}, jobs:{key[0]}, cache:{key[1]} differs from serial'
+    print(f'parallel emit: {len(tunable_dicts)} kernels identical with 1 and 4 jobs')
+
 def run_all_unittest():
     # unittest_share_memory()
     #unittest_coalescing_store()
     unittest_coalescing_store_m1_m0()
     # unittest_thread_mapping()
+    unittest_mc_rope()
+    unittest_split_compile()
+    unittest_ir()
+    unittest_schedule()
+    unittest_vgpr_alloc()
+    unittest_waitcnt()
+    unittest_perf_advisor()
+    unittest_cost_model()
+    unittest_tuning_db()
+    unittest_kernel_set()
+    unittest_conv_workload()
+    unittest_conv_ref()
+    unittest_naive_conv_bwd_gemm()
+    unittest_shared_store_issues()
+    unittest_macro_cache()
+    unittest_kernel_cache()
+    unittest_macro_reference()
+    unittest_tunable_sweep()
+    unittest_tunable_sweep_emit()
+    unittest_sweep_filter()
+    unittest_emulator()
+    unittest_lds_bank()
+    unittest_gmem_coalescing()
+    unittest_kernel_manifest()
+    unittest_profiler()
+    unittest_parallel_emit()
 
 if __name__ == '__main__':
     run_all_unittest()
\ No newline at end of file